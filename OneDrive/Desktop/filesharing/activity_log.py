@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import queue
+import base64
+import sqlite3
+import threading
+from datetime import datetime
+
+# Most activities written in one transaction
+batch_size = 1000
+
+# Longest an activity waits in memory before it is written, in seconds
+flush_interval = 0.5
+
+# Page sizes of query()
+default_page_size = 20
+max_page_size = 500
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS activities (
+        id INTEGER PRIMARY KEY,
+        time REAL NOT NULL,
+        timestamp TEXT NOT NULL,
+        user_id TEXT,
+        user_name TEXT,
+        action TEXT NOT NULL,
+        details TEXT,
+        ip TEXT
+    );
+    CREATE INDEX IF NOT EXISTS activities_time ON activities (time);
+    CREATE INDEX IF NOT EXISTS activities_user_id ON activities (user_id, time);
+    CREATE INDEX IF NOT EXISTS activities_user_name ON activities (user_name, time);
+    CREATE INDEX IF NOT EXISTS activities_action ON activities (action, time);
+'''
+
+COLUMNS = ('id', 'timestamp', 'user_id', 'user_name', 'action', 'details', 'ip')
+
+def parse_time(value):
+    """Parse epoch seconds or an ISO 8601 date/time, raising ValueError if it is neither"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def filter_conditions(user_id=None, user_name=None, action=None, since=None, until=None):
+    """Build the WHERE conditions and parameters for a set of filters"""
+    conditions = []
+    params = []
+    for column, value in (('user_id', user_id), ('user_name', user_name), ('action', action)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if since is not None:
+        conditions.append('time >= ?')
+        params.append(since)
+    if until is not None:
+        conditions.append('time <= ?')
+        params.append(until)
+    return conditions, params
+
+def encode_cursor(row_time, row_id):
+    """Encode the position after an activity as an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps([row_time, row_id]).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor into (time, id), raising ValueError if malformed"""
+    try:
+        row_time, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(row_time), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+class ActivityLog:
+    """Append-only activity log in SQLite, written in batches by a background thread
+
+    append() only puts the activity on a queue, so recording one costs the
+    request next to nothing; the writer thread commits whatever has queued
+    up every flush_interval seconds in a single transaction. Every filter of
+    query() is served by an index ending in the activity time, and pages
+    continue from a (time, id) cursor, so a query touches about one page of
+    rows however long the log grows.
+
+    Several processes may share one log; each has its own writer.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._queue = None
+        self._writer_pid = None
+        self._start_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        # Connections must not cross a fork into worker processes
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _writer_queue(self):
+        # The writer thread is started lazily so each worker process gets its own
+        if self._writer_pid != os.getpid():
+            with self._start_lock:
+                if self._writer_pid != os.getpid():
+                    self._queue = queue.SimpleQueue()
+                    threading.Thread(target=self._run, args=(self._queue,),
+                                     name='activity-log', daemon=True).start()
+                    self._writer_pid = os.getpid()
+        return self._queue
+
+    def append(self, activity):
+        """Queue an activity dict (as made by PresenceRegistry) for writing"""
+        self._writer_queue().put((
+            time.time(),
+            activity.get('timestamp') or datetime.now().isoformat(),
+            activity.get('user_id'),
+            activity.get('user_name'),
+            activity['action'],
+            activity.get('details'),
+            activity.get('ip')
+        ))
+
+    def flush(self, timeout=5):
+        """Wait until everything appended so far is written; return False on timeout"""
+        done = threading.Event()
+        self._writer_queue().put(done)
+        return done.wait(timeout)
+
+    def _run(self, pending):
+        db = self._connection()
+        while True:
+            batch = []
+            waiters = []
+            item = pending.get()
+            deadline = time.monotonic() + flush_interval
+            while True:
+                if isinstance(item, threading.Event):
+                    # Someone is waiting for a flush; write what we have now
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    break
+                try:
+                    item = pending.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    with db:
+                        db.executemany('INSERT INTO activities (time, timestamp, user_id, user_name, '
+                                       'action, details, ip) VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+                except sqlite3.Error as e:
+                    print(f"Error writing activity log: {e}")
+            for waiter in waiters:
+                waiter.set()
+
+    def query(self, user_id=None, user_name=None, action=None, since=None, until=None,
+              cursor=None, limit=default_page_size):
+        """Return (activities, next_cursor), newest first, matching every given filter
+
+        since and until are epoch seconds. Raises ValueError for a bad cursor.
+        """
+        conditions, params = filter_conditions(user_id, user_name, action, since, until)
+        if cursor:
+            conditions.append('(time, id) < (?, ?)')
+            params.extend(decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        limit = min(max(limit, 1), max_page_size)
+        rows = self._connection().execute(
+            f"SELECT time, {', '.join(COLUMNS)} FROM activities {where} "
+            f"ORDER BY time DESC, id DESC LIMIT ?", params + [limit + 1]).fetchall()
+        next_cursor = encode_cursor(rows[limit - 1][0], rows[limit - 1][1]) if len(rows) > limit else None
+        return [dict(zip(COLUMNS, row[1:])) for row in rows[:limit]], next_cursor
+
+    def count(self, user_id=None, user_name=None, action=None, since=None, until=None):
+        """Return the number of activities matching every given filter"""
+        conditions, params = filter_conditions(user_id, user_name, action, since, until)
+        if not conditions:
+            # Nothing is ever deleted, so the last id is the count
+            return self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM activities').fetchone()[0]
+        return self._connection().execute(
+            f"SELECT COUNT(*) FROM activities WHERE {' AND '.join(conditions)}", params).fetchone()[0]
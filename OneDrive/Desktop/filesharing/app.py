@@ -1,15 +1,42 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, flash, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, g, Response, make_response, send_file
 import os
+import json
+import socket
+import base64
+import hashlib
 import threading
 import time
 import uuid
-from datetime import datetime, timedelta
+import shutil
+import tempfile
+from datetime import datetime
 from werkzeug.utils import secure_filename
-from utils import get_local_ip, generate_qr_code, is_safe_path, scan_directory
+from werkzeug.http import http_date
+from utils import get_local_ip, qr_code_png, is_safe_path, format_size, iter_directory, unique_file_path, listing_etag, sort_items, SORT_KEYS, ListingCache
+from downloads import send_file_ranges, not_modified_response, content_disposition, file_etag, FileBody, open_cached
+from compression import CompressionCache
+from delta import SignatureCache
+from archives import iter_tree, iter_zip, iter_tar, ARCHIVE_FORMATS
+from dedup import ContentIndex
+import search
+from search import SearchIndex
+from state import MemoryState
+from activity_log import ActivityLog, parse_time
+from thumbnails import ThumbnailCache, can_thumbnail, THUMBNAIL_EXTENSIONS
+from uploads import UploadSessionStore, UploadError, stream_multipart_upload
+from mirror import Mirror
+from discovery import Discovery
+from shaping import BandwidthShaper, ShapedBody, ShapedInput
+from metrics import RequestMetrics, CountedBody, metric, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from events import EventStream
+from federation import PeerSessions, RemoteListingCache, RemoteFileCache, PeerError, open_remote_file, relay, max_cached_file_size, FORWARDED_RESPONSE_HEADERS
+from urllib.parse import urlparse
 import requests
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
+app.jinja_env.filters['filesize'] = format_size
+app.jinja_env.tests['thumbnailable'] = can_thumbnail
 
 # Global variables
 shared_folder = None
@@ -17,10 +44,115 @@ server_running = False
 local_ip = get_local_ip()
 port = 8080
 
-# Connected users tracking
-connected_users = {}
-user_activities = []
-max_activities = 50
+# Settings, presence and events; replaced by configure_state() for multi-worker serving
+state = MemoryState()
+shared_folder_lock = threading.Lock()
+
+# Server-Sent Events pushed to open pages
+event_broker = state.events()
+
+# Seconds between keep-alive pings on /api/events
+event_heartbeat = 15
+
+# Open /api/events streams per process, or None for no cap. Under a threaded
+# WSGI server each one holds a thread; pages turned away poll instead
+max_event_streams = None
+open_event_streams = 0
+open_event_streams_lock = threading.Lock()
+
+# Seconds between checks of the folders that open pages are showing
+folder_poll_interval = 2
+
+# Folders watched for open pages: subpath -> [subscriber count, fingerprint]
+watched_folders = {}
+watched_folders_lock = threading.Lock()
+folder_watcher = None
+
+# Every activity ever recorded, written to disk in batches off the request path
+activity_log = ActivityLog(os.path.join(app.instance_path, 'activity.sqlite3'))
+
+def presence_changed(kind, data):
+    """Publish presence changes to open pages and keep activities in the log"""
+    event_broker.publish(kind, data)
+    if kind == 'activity':
+        activity_log.append(data)
+
+# Connected users and their recent activities
+presence = state.presence(timeout=300, max_activities=50, on_event=presence_changed)
+
+# Directory listing cache shared by all browse requests
+listing_cache = ListingCache(max_entries=256)
+
+# Chunked upload sessions, staged outside the shared folder until committed
+upload_sessions = UploadSessionStore(os.path.join(tempfile.gettempdir(), 'filesharing-uploads'))
+
+# Precompressed variants of text-heavy files, compressed once per file version
+compression_cache = CompressionCache(os.path.join(tempfile.gettempdir(), 'filesharing-compressed'))
+
+# Block signature manifests for delta sync, hashed once per file version
+signature_cache = SignatureCache(os.path.join(tempfile.gettempdir(), 'filesharing-signatures'))
+
+# Image thumbnails, rendered in worker processes and cached on disk
+thumbnail_cache = ThumbnailCache(os.path.join(tempfile.gettempdir(), 'filesharing-thumbnails'))
+
+# How long a thumbnail request waits for a render before asking the client to retry
+thumbnail_wait = 5
+
+# Content hash index of the shared folder used to deduplicate uploads
+content_index = None
+
+# Filename and full-text search index of the shared folder
+search_index = None
+
+# LAN peer discovery, set up by configure_discovery() (None = disabled)
+discovery = None
+
+# Bandwidth limits for downloads and uploads, shared fairly between users
+download_shaper = BandwidthShaper()
+upload_shaper = BandwidthShaper()
+
+# Endpoints whose bodies are shaped; pages and API calls are never held back
+SHAPED_DOWNLOADS = {'download_file', 'download_folder', 'download_selection', 'peer_download', 'file_signature'}
+SHAPED_UPLOADS = {'upload_file', 'upload_chunk'}
+
+# Browsing peers through this server: keep-alive sessions per peer, remote
+# listings revalidated with their ETags, and popular remote files on disk
+peer_sessions = PeerSessions()
+remote_listings = RemoteListingCache(peer_sessions)
+remote_files = RemoteFileCache(os.path.join(tempfile.gettempdir(), 'filesharing-peer-cache'))
+
+# Request counts, latency and bytes moved, exposed on /metrics
+request_metrics = RequestMetrics()
+
+# With a shared state backend each worker copies its metrics there this often,
+# in seconds, and /metrics adds up those of every worker
+metrics_flush_interval = 5
+metrics_worker = None
+metrics_worker_pid = None
+metrics_worker_lock = threading.Lock()
+
+# Mirror jobs started through /api/mirror in this process, by id
+mirror_jobs = {}
+mirror_jobs_lock = threading.Lock()
+
+# Finished mirror jobs are reported for this many seconds, and at most this many are kept
+mirror_job_ttl = 3600
+max_finished_mirror_jobs = 50
+
+# Search result pagination
+search_page_size = 50
+search_max_page_size = 500
+
+# Size limits for /upload, enforced while the body streams in (None = unlimited)
+max_upload_file_size = None
+max_upload_size = None
+
+# Listing ETags also change whenever the browse template is edited
+browse_template_version = str(int(os.path.getmtime(os.path.join(app.root_path, 'templates', 'browse.html'))))
+
+# Pagination of directory listings
+browse_page_size = 200
+browse_max_page_size = 1000
 
 # User session management
 def get_or_create_user_session():
@@ -33,36 +165,7 @@ def get_or_create_user_session():
 
 def update_user_activity(user_id, action, details=None):
     """Update user activity log"""
-    global user_activities
-
-    user_name = connected_users.get(user_id, {}).get('name', 'Anonymous User')
-    activity = {
-        'user_id': user_id,
-        'user_name': user_name,
-        'action': action,
-        'details': details,
-        'timestamp': datetime.now().isoformat(),
-        'ip': request.remote_addr if request else 'Unknown'
-    }
-
-    user_activities.insert(0, activity)
-    if len(user_activities) > max_activities:
-        user_activities = user_activities[:max_activities]
-
-def cleanup_inactive_users():
-    """Remove inactive users (older than 5 minutes)"""
-    global connected_users
-    cutoff_time = datetime.now() - timedelta(minutes=5)
-
-    inactive_users = []
-    for user_id, user_data in connected_users.items():
-        last_seen = datetime.fromisoformat(user_data['last_seen'])
-        if last_seen < cutoff_time:
-            inactive_users.append(user_id)
-
-    for user_id in inactive_users:
-        del connected_users[user_id]
-        update_user_activity(user_id, 'disconnected')
+    presence.record_activity(user_id, action, details, request.remote_addr if request else 'Unknown')
 
 @app.route('/')
 def index():
@@ -73,19 +176,13 @@ def index():
     user_id = get_or_create_user_session()
 
     # Update connected users
-    connected_users[user_id] = {
-        'name': session.get('user_name', 'Anonymous User'),
-        'ip': request.remote_addr,
-        'last_seen': datetime.now().isoformat(),
-        'connected_at': session.get('connected_at'),
-        'current_page': 'home'
-    }
+    presence.touch(user_id, session.get('user_name'), request.remote_addr, 'home',
+                   session.get('connected_at'))
 
     # Clean up inactive users
-    cleanup_inactive_users()
+    presence.expire()
 
     server_url = f"http://{local_ip}:{port}"
-    qr_code = generate_qr_code(server_url) if shared_folder else None
 
     return render_template('index.html',
                          shared_folder=shared_folder,
@@ -93,18 +190,316 @@ def index():
                          local_ip=local_ip,
                          port=port,
                          server_url=server_url,
-                         qr_code=qr_code,
-                         connected_users=list(connected_users.values()),
-                         user_activities=user_activities[:10])
+                         qr_version=qr_code_version() if shared_folder else None,
+                         connected_users=presence.users(),
+                         user_activities=presence.activities(10))
+
+def qr_code_version():
+    """Identify the current QR code; it changes with the IP, port or shared folder"""
+    return hashlib.sha1(f"{local_ip}:{port}:{shared_folder}".encode()).hexdigest()[:16]
+
+@app.route('/qr.png')
+def qr_png():
+    """Serve the QR code for the server URL as a cacheable image"""
+    if not shared_folder:
+        return "No folder is being shared", 404
+
+    version = qr_code_version()
+    etag = f'"{version}"'
+    # The page links the versioned URL, which never changes meaning
+    cache_control = 'public, max-age=31536000, immutable' if request.args.get('v') == version else 'no-cache'
+    if request.if_none_match.contains(version):
+        return Response(status=304, headers={'ETag': etag, 'Cache-Control': cache_control})
+
+    try:
+        png = qr_code_png(f"http://{local_ip}:{port}")
+    except Exception as e:
+        print(f"Error generating QR code: {e}")
+        return "QR code unavailable", 500
+    return Response(png, mimetype='image/png', headers={'ETag': etag, 'Cache-Control': cache_control})
+
+def configure_state(new_state):
+    """Keep settings, presence and events in new_state, e.g. an SQLiteState shared by workers"""
+    global state, event_broker, presence
+
+    state = new_state
+    event_broker = state.events()
+    presence = state.presence(timeout=presence.timeout, max_activities=presence.max_activities,
+                              on_event=presence_changed)
+    upload_sessions.shared = state.shared
+
+def apply_shared_folder(folder):
+    """Share folder from this process, opening its indexes"""
+    global shared_folder
+
+    shared_folder = folder
+    listing_cache.invalidate()
+    open_content_index(folder)
+    open_search_index(folder)
+
+@app.before_request
+def start_request_timer():
+    """Registered first, so the timing covers every other hook"""
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Count the request, its latency and the bytes of its body"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    sent = 0
+    if not response.is_streamed:
+        sent = response.content_length or 0
+    elif request.method != 'HEAD':
+        count_streamed_body(response)
+    # Shaped uploads are counted by the shaper as they move
+    received = 0 if request.endpoint in SHAPED_UPLOADS else request.content_length or 0
+    request_metrics.observe(route, request.method, response.status_code,
+                            time.perf_counter() - started, sent, received)
+    if state.shared and metrics_worker_pid != os.getpid():
+        start_metrics_flusher()
+    return response
+
+def is_file_wrapper(body):
+    """Tell whether a body is the server's zero-copy wsgi.file_wrapper"""
+    wrapper = request.environ.get('wsgi.file_wrapper')
+    return isinstance(wrapper, type) and isinstance(body, wrapper)
+
+def count_streamed_body(response):
+    """Have a streamed body add its bytes to request_metrics as they are sent"""
+    body = response.response
+    if isinstance(body, (ShapedBody, FileBody)):
+        # Only downloads produce these, and the download shaper counts them
+        return
+    if is_file_wrapper(body):
+        # The server sends it without handing the bytes to Python
+        request_metrics.count_sent(response.content_length or 0)
+    elif isinstance(body, EventStream):
+        # Wrapping it would hide it from asgi.py, which streams it on the event loop
+        body.on_data = request_metrics.count_sent
+    else:
+        response.response = CountedBody(body, request_metrics)
+
+@app.before_request
+def sync_shared_folder():
+    """Pick up a folder chosen through another worker process"""
+    folder = state.get('shared_folder')
+    if folder and folder != shared_folder:
+        with shared_folder_lock:
+            if folder != shared_folder:
+                apply_shared_folder(folder)
+
+def discovery_status():
+    """Host name, share name and load announced to other servers"""
+    folder = state.get('shared_folder')
+    load = os.getloadavg()[0] / (os.cpu_count() or 1) if hasattr(os, 'getloadavg') else 0
+    return {
+        'name': socket.gethostname(),
+        'share': os.path.basename(folder) if folder else None,
+        'users': presence.user_count(),
+        'load': round(load, 2)
+    }
+
+def configure_discovery(address=None):
+    """Announce this server on the LAN and track peers; call discovery.start() in each serving process"""
+    global discovery
+
+    discovery = Discovery(port, discovery_status, address)
+    return discovery
+
+def transfer_key():
+    """Who a transfer counts against: the session's user id, or the client IP without one"""
+    return session.get('user_id') or request.remote_addr
+
+@app.before_request
+def start_shaping():
+    """Pace upload bodies and remember who a download belongs to"""
+    if request.endpoint in SHAPED_DOWNLOADS:
+        # Taken before the view can create a session for a cookieless client
+        g.transfer_key = transfer_key()
+    elif request.endpoint in SHAPED_UPLOADS and 'filesharing.upload_results' not in request.environ:
+        transfer = upload_shaper.open(transfer_key())
+        request.environ['filesharing.upload_transfer'] = transfer
+        request.environ['wsgi.input'] = ShapedInput(request.environ['wsgi.input'], transfer)
+
+@app.after_request
+def shape_download(response):
+    """Pace streamed download bodies"""
+    if 'transfer_key' not in g or not response.is_streamed:
+        return response
+    body = response.response
+    if isinstance(body, FileBody):
+        body.shape(download_shaper, g.transfer_key)
+    elif download_shaper.limited or not is_file_wrapper(body):
+        # Zero-copy file wrappers are only given up when a limit is set
+        response.response = ShapedBody(body, download_shaper, g.transfer_key)
+    return response
+
+@app.teardown_request
+def end_upload_shaping(exc):
+    transfer = request.environ.get('filesharing.upload_transfer')
+    if transfer is not None:
+        transfer.close()
+
+def open_content_index(folder):
+    """Switch the dedup index to folder and catch it up in the background"""
+    global content_index
+
+    if content_index is not None:
+        content_index.close()
+
+    key = hashlib.sha1(folder.encode()).hexdigest()[:16]
+    db_path = os.path.join(tempfile.gettempdir(), 'filesharing-index', f'{key}.sqlite3')
+    content_index = ContentIndex(db_path, folder)
+    threading.Thread(target=content_index.scan, name='dedup-scan', daemon=True).start()
+
+def open_search_index(folder):
+    """Switch the search index to folder and build it in the background"""
+    global search_index
+
+    if search_index is not None:
+        search_index.stop()
+
+    key = hashlib.sha1(folder.encode()).hexdigest()[:16]
+    db_path = os.path.join(tempfile.gettempdir(), 'filesharing-search', f'{key}.sqlite3')
+    search_index = SearchIndex(db_path, folder)
+    search_index.start()
+
+def file_added(path):
+    """Tell the search index and open pages about a new file in the share"""
+    directory = os.path.dirname(path)
+    if search_index is not None:
+        search_index.notify_changed(directory)
+    subpath = os.path.relpath(directory, shared_folder).replace('\\', '/')
+    folder_changed('' if subpath == '.' else subpath)
+
+def folder_changed(subpath):
+    """Push a folder change to subscribers, remembering the folder's new fingerprint"""
+    directory = os.path.join(shared_folder, subpath) if subpath else shared_folder
+    try:
+        fingerprint = listing_cache.fingerprint(directory)
+    except OSError:
+        fingerprint = None
+    with watched_folders_lock:
+        if subpath in watched_folders:
+            watched_folders[subpath][1] = fingerprint
+    event_broker.publish('folder', {'path': subpath})
+
+def watch_folders():
+    """Poll the watched folders' listing fingerprints and announce the ones that changed
+
+    One stat per watched folder here, plus a rescan once its cached listing
+    is a second old, replaces every open page polling the server for its
+    listing.
+    """
+    while True:
+        time.sleep(folder_poll_interval)
+        if not shared_folder:
+            continue
+        with watched_folders_lock:
+            watched = [(subpath, watch_state[1]) for subpath, watch_state in watched_folders.items()]
+        for subpath, known in watched:
+            directory = os.path.join(shared_folder, subpath) if subpath else shared_folder
+            try:
+                fingerprint = listing_cache.fingerprint(directory)
+            except OSError:
+                fingerprint = None
+            if fingerprint != known:
+                folder_changed(subpath)
+
+def watch_folder(subpath, delta):
+    """Add (delta=1) or remove (delta=-1) a subscriber's interest in a folder"""
+    global folder_watcher
+
+    with watched_folders_lock:
+        watch_state = watched_folders.get(subpath)
+        if watch_state is None:
+            if delta < 0:
+                return
+            directory = os.path.join(shared_folder, subpath) if subpath else shared_folder
+            try:
+                fingerprint = listing_cache.fingerprint(directory)
+            except OSError:
+                fingerprint = None
+            watch_state = watched_folders[subpath] = [0, fingerprint]
+        watch_state[0] += delta
+        if watch_state[0] <= 0:
+            del watched_folders[subpath]
+        if folder_watcher is None:
+            folder_watcher = threading.Thread(target=watch_folders, name='folder-watcher', daemon=True)
+            folder_watcher.start()
+
+@app.route('/api/events')
+def api_events():
+    """Stream presence, activity and folder change events (Server-Sent Events)
+
+    ?path= names the shared subfolder the page shows; 'folder' events are
+    sent when it changes. Reconnecting clients send Last-Event-ID and get the
+    events they missed.
+    """
+    global open_event_streams
+    user_id = get_or_create_user_session()
+    with open_event_streams_lock:
+        if max_event_streams is not None and open_event_streams >= max_event_streams:
+            # EventSource gives up on a 503, and the page falls back to polling
+            return jsonify({'error': 'Too many open event streams'}), 503
+        open_event_streams += 1
+
+    subpath = request.args.get('path', '').strip('/')
+    watching = 'path' in request.args and bool(shared_folder) and is_safe_path(shared_folder, subpath)
+    if watching:
+        watch_folder(subpath, 1)
+
+    def closed():
+        global open_event_streams
+        with open_event_streams_lock:
+            open_event_streams -= 1
+        if watching:
+            watch_folder(subpath, -1)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    stream = event_broker.stream(last_event_id, event_heartbeat,
+                                 on_heartbeat=lambda: presence.heartbeat(user_id), on_close=closed)
+
+    # Passed through as it is, so asgi.py can run it on the event loop
+    return Response(stream, mimetype='text/event-stream', direct_passthrough=True, headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+def deduplicate_upload(path, sha256):
+    """Link an uploaded file to an identical copy already in the share
+
+    Returns the dict of fields reported to the client for a duplicate, or an
+    empty dict when the content is new.
+    """
+    if content_index is None:
+        return {}
+    try:
+        duplicate_of, method = content_index.deduplicate(path, sha256)
+    except Exception as e:
+        print(f"Error deduplicating upload: {e}")
+        return {}
+    if duplicate_of is None:
+        return {}
+    return {
+        'duplicate_of': duplicate_of,
+        'dedup': method,
+        'message': f'Identical to {duplicate_of}, stored as a {method}'
+    }
 
 @app.route('/set_folder', methods=['POST'])
 def set_folder():
     """Set the folder to share"""
-    global shared_folder
-
     folder_path = request.form.get('folder_path')
     if folder_path and os.path.exists(folder_path) and os.path.isdir(folder_path):
-        shared_folder = os.path.abspath(folder_path)
+        with shared_folder_lock:
+            apply_shared_folder(os.path.abspath(folder_path))
+            state.set('shared_folder', shared_folder)
+        event_broker.publish('share', {'folder': os.path.basename(shared_folder)})
         flash(f'Folder set successfully: {shared_folder}', 'success')
     else:
         flash('Invalid folder path', 'error')
@@ -125,13 +520,9 @@ def browse(subpath=''):
     user_id = get_or_create_user_session()
 
     # Update connected users
-    connected_users[user_id] = {
-        'name': session.get('user_name', 'Anonymous User'),
-        'ip': request.remote_addr,
-        'last_seen': datetime.now().isoformat(),
-        'connected_at': session.get('connected_at'),
-        'current_page': f'browsing: /{subpath}' if subpath else 'browsing: root'
-    }
+    presence.touch(user_id, session.get('user_name'), request.remote_addr,
+                   f'browsing: /{subpath}' if subpath else 'browsing: root',
+                   session.get('connected_at'))
 
     # Log activity
     update_user_activity(user_id, 'browsing', f'Viewing folder: /{subpath}' if subpath else 'Viewing root folder')
@@ -151,8 +542,20 @@ def browse(subpath=''):
         flash('Path not found', 'error')
         return redirect(url_for('browse'))
 
-    # Get directory contents
-    items = scan_directory(current_path)
+    # Answer revalidations from the listing fingerprint alone. Pages that
+    # carry flash messages are one-off and never cached.
+    fingerprint = listing_cache.fingerprint(current_path)
+    etag = listing_etag(fingerprint, f'html:{browse_template_version}')
+    cacheable = '_flashes' not in session
+    if cacheable:
+        not_modified = not_modified_response(request, etag, fingerprint[1] / 1e9,
+                                             {'Cache-Control': 'no-cache'})
+        if not_modified is not None:
+            return not_modified
+
+    # Get the first page of directory contents, the rest is loaded on scroll
+    items, positions = listing_cache.get_view(current_path)
+    page, next_cursor = paginate_listing(items, positions, None, browse_page_size)
 
     # Create breadcrumb navigation
     breadcrumbs = []
@@ -166,11 +569,159 @@ def browse(subpath=''):
                 'path': current_breadcrumb
             })
 
-    return render_template('browse.html',
-                         items=items,
+    response = make_response(render_template('browse.html',
+                         items=page,
+                         total_items=len(items),
+                         next_cursor=next_cursor,
                          current_path=subpath,
                          breadcrumbs=breadcrumbs,
-                         shared_folder_name=os.path.basename(shared_folder))
+                         shared_folder_name=os.path.basename(shared_folder),
+                         thumbnail_extensions=sorted(THUMBNAIL_EXTENSIONS),
+                         listing_etag=listing_etag(fingerprint, f'poll:{browse_template_version}')))
+    response.headers['Cache-Control'] = 'no-cache' if cacheable else 'no-store'
+    if cacheable:
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(fingerprint[1] // 1_000_000_000)
+    return response
+
+def encode_cursor(name, index):
+    """Encode the position after a listing entry as an opaque cursor"""
+    raw = json.dumps({'n': name, 'i': index}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor into (name, index), raising ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        name, index = str(data['n']), int(data['i'])
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if index < 0:
+        raise ValueError('Invalid cursor')
+    return name, index
+
+def paginate_listing(items, positions, cursor, limit):
+    """Return (page, next_cursor) for a sorted listing view
+
+    The cursor names the last entry of the previous page, so pages stay
+    consistent when entries are added or removed before that point. If the
+    entry has since been deleted, the next one has moved up into its stored
+    index, so the page starts there.
+    """
+    start = 0
+    if cursor:
+        name, index = decode_cursor(cursor)
+        start = positions[name] + 1 if name in positions else index
+
+    page = items[start:start + limit]
+    next_cursor = None
+    if page and start + limit < len(items):
+        next_cursor = encode_cursor(page[-1]['name'], start + len(page) - 1)
+    return page, next_cursor
+
+@app.route('/api/browse')
+@app.route('/api/browse/<path:subpath>')
+def api_browse(subpath=''):
+    """List a shared directory as paginated JSON or a streamed NDJSON feed"""
+    if not shared_folder:
+        return jsonify({'error': 'No folder is being shared'}), 404
+
+    # Security check
+    if not is_safe_path(shared_folder, subpath):
+        return jsonify({'error': 'Access denied'}), 403
+
+    current_path = os.path.join(shared_folder, subpath) if subpath else shared_folder
+    if not os.path.isdir(current_path):
+        return jsonify({'error': 'Path not found'}), 404
+
+    # Every representation is derived from the listing fingerprint and query
+    fingerprint = listing_cache.fingerprint(current_path)
+    variant = f"api:{browse_template_version}:{request.query_string.decode()}"
+    if not request.query_string:
+        variant = f'poll:{browse_template_version}'
+    etag = listing_etag(fingerprint, variant)
+    cache_headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(fingerprint[1] // 1_000_000_000),
+        'Cache-Control': 'no-cache'
+    }
+    not_modified = not_modified_response(request, etag, fingerprint[1] / 1e9, cache_headers)
+    if not_modified is not None:
+        return not_modified
+
+    # NDJSON mode emits entries in directory order as they are scanned
+    stream = request.args.get('stream') == '1' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+    if stream:
+        def generate():
+            try:
+                for item in iter_directory(current_path):
+                    yield json.dumps(item) + '\n'
+            except OSError as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson', headers=cache_headers)
+
+    sort = request.args.get('sort', 'name')
+    if sort not in SORT_KEYS:
+        return jsonify({'error': f'Invalid sort key: {sort}'}), 400
+    order = request.args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': f'Invalid order: {order}'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', browse_page_size)), 1), browse_max_page_size)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    items, positions = listing_cache.get_view(current_path, sort, order == 'desc')
+    try:
+        page, next_cursor = paginate_listing(items, positions, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    response = jsonify({
+        'path': subpath,
+        'sort': sort,
+        'order': order,
+        'items': page,
+        'next_cursor': next_cursor,
+        'total_count': len(items)
+    })
+    response.headers.update(cache_headers)
+    return response
+
+@app.route('/api/search')
+def api_search():
+    """Search file and folder names, or text file contents with content=1"""
+    if not shared_folder or search_index is None:
+        return jsonify({'error': 'No folder is being shared'}), 404
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing search query'}), 400
+    kind = request.args.get('type')
+    if kind not in (None, 'file', 'directory'):
+        return jsonify({'error': f'Invalid type: {kind}'}), 400
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', search_page_size)), 1), search_max_page_size)
+    except ValueError:
+        return jsonify({'error': 'Invalid page or per_page'}), 400
+    # No page lies past the ranked matches, and huge numbers would overflow SQLite's OFFSET
+    page = min(page, search.max_matches // per_page + 1)
+
+    start = time.perf_counter()
+    results, total = search_index.search(query, limit=per_page, offset=(page - 1) * per_page,
+                                         content=request.args.get('content') == '1', kind=kind)
+    return jsonify({
+        'query': query,
+        'page': page,
+        'per_page': per_page,
+        'total_count': total,
+        'results': results,
+        'indexing': not search_index.ready,
+        'took_ms': round((time.perf_counter() - start) * 1000, 2)
+    })
 
 @app.route('/download/<path:filename>')
 def download_file(filename):
@@ -191,18 +742,174 @@ def download_file(filename):
     if not os.path.exists(file_path) or not os.path.isfile(file_path):
         return "File not found", 404
 
-    # Log download activity
-    update_user_activity(user_id, 'download', f'Downloaded: {os.path.basename(filename)}')
+    response = send_file_ranges(request, file_path, relative_path=filename,
+                                compressor=compression_cache)
+
+    # Log download activity once per transfer, not once per resumed or parallel
+    # segment, and not for revalidations answered with 304
+    range_header = request.headers.get('Range', '')
+    first_segment = not range_header or range_header.replace(' ', '').startswith('bytes=0-')
+    if response.status_code in (200, 206) and first_segment:
+        update_user_activity(user_id, 'download', f'Downloaded: {os.path.basename(filename)}')
+
+    return response
+
+@app.route('/api/signature/<path:filename>')
+def file_signature(filename):
+    """Serve the block signature manifest of a shared file for delta sync"""
+    if not shared_folder:
+        return "No folder is being shared", 404
+
+    # Security check
+    if not is_safe_path(shared_folder, filename):
+        return "Access denied", 403
+
+    file_path = os.path.join(shared_folder, filename)
+    if not os.path.isfile(file_path):
+        return "File not found", 404
+
+    st = os.stat(file_path)
+    # Clients send the file's own ETag as If-Range when fetching blocks
+    etag = file_etag(st, 'signature')
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    not_modified = not_modified_response(request, etag, st.st_mtime, headers)
+    if not_modified is not None:
+        return not_modified
+
+    # Opened before the headers go out; a second try computes the manifest
+    # again if another worker evicted it in between
+    for attempt in range(2):
+        path = signature_cache.get(file_path, st, file_etag(st))
+        manifest, size = open_cached(path)
+        if manifest is not None:
+            break
+        signature_cache.discard(path)
+    else:
+        return "Signature unavailable, try again", 503
+    headers['Content-Length'] = str(size)
+    return Response(FileBody([(path, 0, size - 1)], {path: manifest}), headers=headers,
+                    mimetype='application/octet-stream', direct_passthrough=True)
+
+@app.route('/thumb/<path:filename>')
+def thumbnail(filename):
+    """Serve a small JPEG preview of an image in the shared folder"""
+    if not shared_folder:
+        return "No folder is being shared", 404
+
+    # Security check
+    if not is_safe_path(shared_folder, filename):
+        return "Access denied", 403
+
+    file_path = os.path.join(shared_folder, filename)
+    if not can_thumbnail(filename) or not os.path.isfile(file_path):
+        return "Thumbnail not found", 404
+
+    st = os.stat(file_path)
+    # Versioned URLs (?v=) change whenever the image does, so they never need revalidating
+    cache_control = 'public, max-age=31536000, immutable' if request.args.get('v') else 'no-cache'
+    etag = file_etag(st, 'thumb')
+    not_modified = not_modified_response(request, etag, st.st_mtime, {'Cache-Control': cache_control})
+    if not_modified is not None:
+        return not_modified
+
+    # A second try renders the thumbnail again if another worker evicted it
+    # between the lookup and opening it
+    for attempt in range(2):
+        try:
+            thumb_path = thumbnail_cache.get(file_path, st, timeout=thumbnail_wait)
+        except TimeoutError:
+            # Still rendering or the queue is full; the render continues in the background
+            return Response("Thumbnail is being generated", status=503, headers={'Retry-After': '1'})
+        except ValueError:
+            return "Thumbnail not available", 404
+        try:
+            response = send_file(thumb_path, mimetype='image/jpeg', conditional=False, etag=False)
+            break
+        except FileNotFoundError:
+            thumbnail_cache.discard(thumb_path)
+    else:
+        return Response("Thumbnail is being generated", status=503, headers={'Retry-After': '1'})
+    response.headers['Cache-Control'] = cache_control
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(int(st.st_mtime))
+    return response
+
+def archive_response(entries, name):
+    """Stream (path, arcname) entries as a ZIP or TAR download named after name"""
+    archive_format = request.values.get('format', 'zip')
+    if archive_format not in ARCHIVE_FORMATS:
+        return f"Unsupported archive format: {archive_format}", 400
+
+    if archive_format == 'tar':
+        body = iter_tar(entries)
+        mimetype = 'application/x-tar'
+    else:
+        body = iter_zip(entries, deflate=request.values.get('compression') == 'deflate')
+        mimetype = 'application/zip'
 
-    directory = os.path.dirname(file_path)
-    filename_only = os.path.basename(file_path)
+    # The size is unknown up front, so the archive is sent chunked
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': content_disposition(f"{name}.{archive_format}"),
+        'Cache-Control': 'no-store'
+    })
 
-    return send_from_directory(directory, filename_only, as_attachment=True)
+@app.route('/download_folder')
+@app.route('/download_folder/<path:subpath>')
+def download_folder(subpath=''):
+    """Download a whole folder as a streamed ZIP or TAR archive"""
+    if not shared_folder:
+        return "No folder is being shared", 404
+
+    user_id = get_or_create_user_session()
+
+    # Security check
+    if not is_safe_path(shared_folder, subpath):
+        return "Access denied", 403
+
+    folder_path = os.path.join(shared_folder, subpath) if subpath else shared_folder
+    if not os.path.isdir(folder_path):
+        return "Folder not found", 404
+
+    name = os.path.basename(os.path.normpath(folder_path))
+    update_user_activity(user_id, 'download', f'Downloaded folder: /{subpath}' if subpath else 'Downloaded root folder')
+    return archive_response(iter_tree(folder_path, name), name)
+
+@app.route('/download_selection', methods=['POST'])
+def download_selection():
+    """Download the selected files and folders as one streamed archive"""
+    if not shared_folder:
+        return "No folder is being shared", 404
+
+    user_id = get_or_create_user_session()
+
+    paths = [path.strip('/') for path in request.form.getlist('paths') if path.strip('/')]
+    if not paths:
+        return "No files selected", 400
+
+    # Security check on every selected path before anything is streamed
+    for path in paths:
+        if not is_safe_path(shared_folder, path) or not os.path.exists(os.path.join(shared_folder, path)):
+            return "Access denied", 403
+
+    def entries():
+        for path in paths:
+            yield from iter_tree(os.path.join(shared_folder, path), os.path.basename(path))
+
+    update_user_activity(user_id, 'download', f'Downloaded {len(paths)} selected item(s)')
+    return archive_response(entries(), os.path.basename(shared_folder))
 
 @app.route('/connect')
 def connect():
     """Page to connect to other users' shared folders"""
-    return render_template('connect.html')
+    peers = discovery.directory.peers() if discovery is not None else []
+    return render_template('connect.html', peers=peers, discovery_enabled=discovery is not None)
+
+@app.route('/api/peers')
+def api_peers():
+    """Servers heard announcing themselves on the LAN, from the cached peer table"""
+    if discovery is None:
+        return jsonify({'enabled': False, 'peers': []})
+    return jsonify({'enabled': True, 'error': discovery.error, 'peers': discovery.directory.peers()})
 
 @app.route('/connect_to', methods=['POST'])
 def connect_to():
@@ -214,15 +921,25 @@ def connect_to():
         flash('Please enter an IP address', 'error')
         return redirect(url_for('connect'))
 
+    def connected():
+        # Store connection info in session
+        session['remote_ip'] = remote_ip
+        session['remote_port'] = remote_port
+        if request.form.get('proxy'):
+            peer_id = register_peer(f"http://{remote_ip}:{remote_port}")
+            return redirect(url_for('peer_browse', peer_id=peer_id))
+        return redirect(f"http://{remote_ip}:{remote_port}/browse")
+
+    # A server heard announcing itself in the last few seconds needs no probe
+    if discovery is not None and remote_port.isdigit() and discovery.directory.find(remote_ip, int(remote_port)):
+        return connected()
+
     try:
         # Test connection to remote server
         remote_url = f"http://{remote_ip}:{remote_port}/browse"
         response = requests.get(remote_url, timeout=5)
         if response.status_code == 200:
-            # Store connection info in session
-            session['remote_ip'] = remote_ip
-            session['remote_port'] = remote_port
-            return redirect(f"http://{remote_ip}:{remote_port}/browse")
+            return connected()
         else:
             flash('Could not connect to the remote server', 'error')
     except Exception as e:
@@ -230,6 +947,184 @@ def connect_to():
 
     return redirect(url_for('connect'))
 
+def peer_url(peer_id):
+    """Base URL of a discovered or registered peer, or None"""
+    if discovery is not None:
+        peer = discovery.directory.get(peer_id)
+        if peer is not None:
+            return peer['url']
+    return state.get(f'peer:{peer_id}')
+
+def register_peer(base_url):
+    """Remember a peer connected to by address, returning its id for /peer/<id>/ URLs"""
+    peer_id = hashlib.sha1(base_url.encode()).hexdigest()[:16]
+    state.set(f'peer:{peer_id}', base_url)
+    return peer_id
+
+@app.route('/peer/<peer_id>/browse/')
+@app.route('/peer/<peer_id>/browse/<path:subpath>')
+def peer_browse(peer_id, subpath=''):
+    """Browse a peer's shared folder through this server"""
+    base_url = peer_url(peer_id)
+    if base_url is None:
+        flash('That server is no longer available', 'error')
+        return redirect(url_for('connect'))
+
+    subpath = subpath.strip('/')
+    try:
+        items = sort_items(remote_listings.get(base_url, subpath))
+    except PeerError as e:
+        flash(e.message, 'error')
+        return redirect(url_for('connect'))
+
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    start = (page - 1) * browse_page_size
+
+    breadcrumbs = []
+    if subpath:
+        parts = subpath.split('/')
+        for index, part in enumerate(parts):
+            breadcrumbs.append({'name': part, 'path': '/'.join(parts[:index + 1])})
+
+    user_id = get_or_create_user_session()
+    update_user_activity(user_id, 'browsing', f'Viewing {base_url}/{subpath}')
+
+    return render_template('peer_browse.html',
+                           peer_id=peer_id,
+                           peer_url=base_url,
+                           items=items[start:start + browse_page_size],
+                           total_items=len(items),
+                           page=page,
+                           has_next=start + browse_page_size < len(items),
+                           current_path=subpath,
+                           breadcrumbs=breadcrumbs)
+
+@app.route('/peer/<peer_id>/download/<path:filename>')
+def peer_download(peer_id, filename):
+    """Download a peer's file through this server, from the local cache when possible"""
+    base_url = peer_url(peer_id)
+    if base_url is None:
+        return "Unknown peer", 404
+
+    try:
+        item = remote_listings.find(base_url, filename.strip('/'))
+    except PeerError as e:
+        return e.message, e.status
+    if item is None or item['type'] != 'file':
+        return "File not found", 404
+
+    user_id = get_or_create_user_session()
+    range_header = request.headers.get('Range', '')
+    if not range_header or range_header.replace(' ', '').startswith('bytes=0-'):
+        update_user_activity(user_id, 'download', f'Downloaded from {base_url}: {os.path.basename(filename)}')
+
+    cache_name = remote_files.name_for(base_url, filename, item['size'], item['mtime'])
+    # Opened before anything is sent, so another worker evicting it cannot cut the download short
+    cached_path, cached = remote_files.open(cache_name)
+    if cached is not None:
+        try:
+            response = send_file_ranges(request, cached_path, download_name=os.path.basename(filename),
+                                        offload=False, file=cached)
+        except Exception:
+            cached.close()
+            raise
+        response.call_on_close(cached.close)
+        return response
+
+    try:
+        response = open_remote_file(peer_sessions, base_url, filename, request.headers,
+                                    'HEAD' if request.method == 'HEAD' else 'GET')
+    except PeerError as e:
+        return e.message, e.status
+
+    headers = {name: response.headers[name] for name in FORWARDED_RESPONSE_HEADERS if name in response.headers}
+    if request.method == 'HEAD':
+        # Nothing will read a body, so hand the connection back to the pool now
+        response.close()
+        return Response(status=response.status_code, headers=headers)
+
+    # Whole transfers of the version in the listing are copied into the cache on the way through
+    cacheable = (response.status_code == 200 and item['size'] <= max_cached_file_size and
+                 response.headers.get('Last-Modified') == http_date(int(item['mtime'])))
+    body = relay(response, remote_files if cacheable else None, cache_name, item['size'])
+    relayed = Response(body, status=response.status_code, headers=headers)
+    # Runs even if the body is never iterated, e.g. when the client leaves first
+    relayed.call_on_close(response.close)
+    return relayed
+
+def expire_mirror_jobs():
+    """Forget finished mirror jobs that are too old or too many; call with mirror_jobs_lock held"""
+    now = time.time()
+    finished = sorted((job.finished_at, job_id) for job_id, job in mirror_jobs.items() if job.finished_at)
+    for index, (finished_at, job_id) in enumerate(finished):
+        if now - finished_at > mirror_job_ttl or index < len(finished) - max_finished_mirror_jobs:
+            del mirror_jobs[job_id]
+
+@app.route('/api/mirror', methods=['POST'])
+def start_mirror():
+    """Start pulling a remote peer's share into a folder of this share"""
+    if not shared_folder:
+        return jsonify({'error': 'No folder is being shared'}), 400
+
+    data = request.get_json(silent=True) or {}
+    url = (data.get('url') or '').rstrip('/')
+    if not url and data.get('remote_ip'):
+        url = f"http://{data['remote_ip']}:{data.get('remote_port') or '8080'}"
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return jsonify({'error': 'Invalid peer URL'}), 400
+
+    target = (data.get('target') or f"mirror-{parsed.hostname}-{parsed.port or 80}").strip('/')
+    if not is_safe_path(shared_folder, target):
+        return jsonify({'error': 'Invalid target folder'}), 400
+    try:
+        workers = min(max(int(data.get('workers') or 4), 1), 16)
+    except ValueError:
+        return jsonify({'error': 'Invalid workers'}), 400
+
+    local_dir = os.path.abspath(os.path.join(shared_folder, target))
+    with mirror_jobs_lock:
+        expire_mirror_jobs()
+        for job_id, job in mirror_jobs.items():
+            if job.local_dir == local_dir and job.state in ('pending', 'running'):
+                return jsonify({'error': 'A mirror into this folder is already running', 'id': job_id}), 409
+        job_id = uuid.uuid4().hex
+        job = Mirror(url, local_dir, data.get('path') or '', workers, on_file=file_added)
+        mirror_jobs[job_id] = job
+    threading.Thread(target=job.run, name='mirror', daemon=True).start()
+
+    user_id = get_or_create_user_session()
+    update_user_activity(user_id, 'mirror', f'Mirroring {url} into {target}')
+    return jsonify(dict(job.progress(), id=job_id)), 202
+
+@app.route('/api/mirror')
+def list_mirrors():
+    """Report progress of every mirror job of this process"""
+    with mirror_jobs_lock:
+        expire_mirror_jobs()
+        jobs = list(mirror_jobs.items())
+    return jsonify({'mirrors': [dict(job.progress(), id=job_id) for job_id, job in jobs]})
+
+@app.route('/api/mirror/<job_id>')
+def mirror_status(job_id):
+    """Report progress and throughput of one mirror job"""
+    job = mirror_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown mirror job'}), 404
+    return jsonify(dict(job.progress(), id=job_id))
+
+@app.route('/api/mirror/<job_id>', methods=['DELETE'])
+def cancel_mirror(job_id):
+    """Stop a mirror job; starting it again resumes where it stopped"""
+    job = mirror_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown mirror job'}), 404
+    job.cancel()
+    return jsonify({'success': True})
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Upload files to the shared folder"""
@@ -238,50 +1133,25 @@ def upload_file():
     if not shared_folder:
         return jsonify({'error': 'No folder is being shared'}), 400
 
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file selected'}), 400
-
-    files = request.files.getlist('file')
-    if not files or all(f.filename == '' for f in files):
+    # Parts are parsed and written as the body arrives instead of being spooled
+    # first; under asgi.py that already happened on the event loop
+    results = request.environ.get('filesharing.upload_results')
+    if results is None:
+        results = stream_multipart_upload(request.stream, request.content_type, shared_folder,
+                                          unique_file_path, max_upload_file_size, max_upload_size)
+    if not results:
         return jsonify({'error': 'No files selected'}), 400
 
-    results = []
     success_count = 0
-    
-    for file in files:
-        if file.filename == '':
-            continue
-            
-        try:
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(shared_folder, filename)
-            
-            # If file exists, add a number to the filename
-            base, ext = os.path.splitext(filename)
-            counter = 1
-            while os.path.exists(file_path):
-                filename = f"{base}_{counter}{ext}"
-                file_path = os.path.join(shared_folder, filename)
-                counter += 1
-
-            file.save(file_path)
+    user_id = get_or_create_user_session()
+    for result in results:
+        path = result.pop('path', None)
+        if result['status'] == 'success':
+            result.update(deduplicate_upload(path, result['sha256']))
+            file_added(path)
             success_count += 1
-            results.append({
-                'filename': filename,
-                'status': 'success',
-                'message': 'Uploaded successfully'
-            })
-            
             # Update activity log
-            user_id = get_or_create_user_session()
-            update_user_activity(user_id, 'upload', filename)
-            
-        except Exception as e:
-            results.append({
-                'filename': file.filename,
-                'status': 'error',
-                'message': str(e)
-            })
+            update_user_activity(user_id, 'upload', result['filename'])
 
     if success_count == 0:
         return jsonify({
@@ -294,13 +1164,110 @@ def upload_file():
         'results': results
     }), 200
 
+# Chunked, resumable upload sessions
+
+def upload_directory(subpath):
+    """Resolve the shared subfolder an upload targets, or raise UploadError"""
+    if not shared_folder:
+        raise UploadError('No folder is being shared')
+    if not is_safe_path(shared_folder, subpath):
+        raise UploadError('Access denied', 403)
+    directory = os.path.join(shared_folder, subpath) if subpath else shared_folder
+    if not os.path.isdir(directory):
+        raise UploadError('Upload folder not found', 404)
+    return directory
+
+@app.errorhandler(UploadError)
+def handle_upload_error(e):
+    """Return upload errors as JSON"""
+    return jsonify({'error': e.message}), e.status
+
+def upload_request_json():
+    """Return the request's JSON object, {} without a body, or raise UploadError"""
+    data = request.get_json(silent=True)
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise UploadError('Expected a JSON object')
+    return data
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Start a chunked upload session"""
+    data = upload_request_json()
+    filename = secure_filename(str(data.get('filename') or ''))
+    if not filename:
+        raise UploadError('Invalid filename')
+
+    subpath = str(data.get('path') or '').strip('/')
+    directory = upload_directory(subpath)
+
+    try:
+        size = int(data.get('size'))
+        chunk_size = int(data['chunk_size']) if data.get('chunk_size') else None
+    except (TypeError, ValueError):
+        raise UploadError('Invalid size or chunk_size')
+    if max_upload_file_size is not None and size > max_upload_file_size:
+        raise UploadError(f'File exceeds the {max_upload_file_size} byte limit', 413)
+    # The staged file is checked against its own disk by the session store
+    if size > shutil.disk_usage(directory).free:
+        raise UploadError('Not enough free space in the shared folder', 507)
+
+    status = upload_sessions.create(filename, size, subpath, chunk_size, data.get('sha256'))
+    return jsonify(status), 201
+
+@app.route('/api/uploads/<upload_id>')
+def upload_status(upload_id):
+    """Report which chunks of an upload session have arrived"""
+    return jsonify(upload_sessions.status(upload_id))
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """Store one numbered chunk of an upload session"""
+    received = upload_sessions.write_chunk(upload_id, index, request.stream,
+                                           request.content_length,
+                                           request.headers.get('X-Chunk-SHA256'))
+    return jsonify({'index': index, 'received_count': received})
+
+@app.route('/api/uploads/<upload_id>/commit', methods=['POST'])
+def commit_upload(upload_id):
+    """Assemble a complete upload session into the shared folder"""
+    def destination_for(upload):
+        return unique_file_path(upload_directory(upload['subpath']), upload['filename'])
+
+    data = upload_request_json()
+    result = upload_sessions.commit(upload_id, destination_for, data.get('sha256'))
+    filename = os.path.basename(result['path'])
+
+    user_id = get_or_create_user_session()
+    update_user_activity(user_id, 'upload', filename)
+
+    response = {
+        'filename': filename,
+        'size': result['size'],
+        'sha256': result['sha256'],
+        'status': 'success'
+    }
+    response.update(deduplicate_upload(result['path'], result['sha256']))
+    file_added(result['path'])
+    return jsonify(response)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """Abandon an upload session"""
+    upload_sessions.discard(upload_id)
+    return jsonify({'success': True})
+
 # New API endpoints for user management and real-time features
 
 @app.route('/api/set_username', methods=['POST'])
 def set_username():
     """Set username for current session"""
-    data = request.get_json()
-    username = data.get('username', '').strip()
+    data = request.get_json(silent=True)
+    username = data.get('username') if isinstance(data, dict) else None
+    if not isinstance(username, str):
+        return jsonify({'error': 'Expected a JSON object with a username'}), 400
+    username = username.strip()
 
     if not username:
         return jsonify({'error': 'Username cannot be empty'}), 400
@@ -312,9 +1279,8 @@ def set_username():
     session['user_name'] = username
 
     # Update connected users
-    if user_id in connected_users:
-        old_name = connected_users[user_id].get('name', 'Anonymous User')
-        connected_users[user_id]['name'] = username
+    old_name = presence.rename(user_id, username)
+    if old_name is not None:
         update_user_activity(user_id, 'username_changed', f'Changed name from "{old_name}" to "{username}"')
 
     return jsonify({'success': True, 'username': username})
@@ -322,18 +1288,16 @@ def set_username():
 @app.route('/api/connected_users')
 def get_connected_users():
     """Get list of currently connected users"""
-    cleanup_inactive_users()
-
-    users_list = []
-    for user_id, user_data in connected_users.items():
-        users_list.append({
-            'id': user_id,
-            'name': user_data['name'],
-            'ip': user_data['ip'],
-            'current_page': user_data['current_page'],
-            'connected_at': user_data['connected_at'],
-            'last_seen': user_data['last_seen']
-        })
+    presence.expire()
+    users_list = presence.users()
+    downloads = download_shaper.stats()['users']
+    uploads = upload_shaper.stats()['users']
+    for user in users_list:
+        # Transfers are keyed by user id, or by IP for clients without a session
+        for direction, shaped in (('download', downloads), ('upload', uploads)):
+            counters = shaped.get(user['id']) or shaped.get(user.get('ip')) or {}
+            user[f'{direction}_rate'] = counters.get('throughput', 0)
+            user[f'active_{direction}s'] = counters.get('active_transfers', 0)
 
     return jsonify({
         'users': users_list,
@@ -342,33 +1306,180 @@ def get_connected_users():
 
 @app.route('/api/user_activities')
 def get_user_activities():
-    """Get recent user activities"""
+    """Query the activity log, newest first, by user, action and time range"""
+    try:
+        since = parse_time(request.args['since']) if request.args.get('since') else None
+        until = parse_time(request.args['until']) if request.args.get('until') else None
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'Invalid since, until or limit'}), 400
+
+    filters = {
+        'user_id': request.args.get('user_id') or None,
+        'user_name': request.args.get('user') or None,
+        'action': request.args.get('action') or None,
+        'since': since,
+        'until': until
+    }
+    # Include activities still waiting for the background writer
+    activity_log.flush()
+    try:
+        activities, next_cursor = activity_log.query(cursor=request.args.get('cursor'), limit=limit, **filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     return jsonify({
-        'activities': user_activities[:20],
-        'total_count': len(user_activities)
+        'activities': activities,
+        'next_cursor': next_cursor,
+        'total_count': activity_log.count(**filters)
     })
 
 @app.route('/api/server_stats')
 def get_server_stats():
     """Get server statistics"""
-    cleanup_inactive_users()
+    presence.expire()
 
     return jsonify({
-        'connected_users_count': len(connected_users),
-        'total_activities': len(user_activities),
+        'connected_users_count': presence.user_count(),
+        'total_activities': activity_log.count(),
         'shared_folder': shared_folder,
-        'server_uptime': time.time(),  # You can calculate actual uptime
+        'server_started': request_metrics.started_at,
+        'server_uptime': round(request_metrics.uptime(), 3),
         'local_ip': local_ip,
-        'port': port
+        'port': port,
+        'requests': request_metrics.stats(),
+        'listing_cache': listing_cache.stats(),
+        'qr_cache': qr_code_png.cache_info()._asdict(),
+        'compression': compression_cache.stats(),
+        'signatures': signature_cache.stats(),
+        'bandwidth': {
+            'download': download_shaper.stats(),
+            'upload': upload_shaper.stats()
+        },
+        'peer_proxy': {
+            'sessions': peer_sessions.stats(),
+            'listings': remote_listings.stats(),
+            'files': remote_files.stats()
+        },
+        'thumbnails': thumbnail_cache.stats(),
+        'events': dict(event_broker.stats(), open_streams=open_event_streams,
+                       max_streams=max_event_streams),
+        'discovery': discovery.directory.stats() if discovery is not None else None,
+        'search_index': search_index.stats() if search_index is not None else None
     })
 
+def cache_counters():
+    """Hits and misses of every cache, by name"""
+    qr = qr_code_png.cache_info()
+    listings = listing_cache.stats()
+    peer_listings = remote_listings.stats()
+    caches = {
+        # A listing rescanned and found unchanged is reused, like a hit
+        'listing': {'hits': listings['hits'] + listings['revalidations'], 'misses': listings['misses']},
+        'qr': {'hits': qr.hits, 'misses': qr.misses},
+        'compression': compression_cache.stats(),
+        'signatures': signature_cache.stats(),
+        'thumbnails': thumbnail_cache.stats(),
+        # A listing revalidated with a 304 was still served from the cache
+        'peer_listings': {'hits': peer_listings['hits'] + peer_listings['revalidated'],
+                          'misses': peer_listings['misses']},
+        'peer_files': remote_files.stats()
+    }
+    return {name: (stats['hits'], stats['misses']) for name, stats in caches.items()}
+
+def worker_metrics():
+    """This process's counters and gauges, in the form workers share through the state backend"""
+    return {
+        'requests': request_metrics.snapshot(),
+        'shaped_bytes': {'download': download_shaper.total_bytes, 'upload': upload_shaper.total_bytes},
+        'active_transfers': {'download': download_shaper.active_transfers,
+                             'upload': upload_shaper.active_transfers},
+        'caches': cache_counters(),
+        'updated_at': time.time()
+    }
+
+def flush_metrics():
+    """Copy this worker's metrics into the shared state every metrics_flush_interval seconds"""
+    while True:
+        time.sleep(metrics_flush_interval)
+        if not state.shared:
+            continue
+        try:
+            state.put_metrics(metrics_worker, worker_metrics())
+        except Exception as e:
+            print(f"Error storing metrics: {e}")
+
+def start_metrics_flusher():
+    """Start flush_metrics once in each worker process"""
+    global metrics_worker, metrics_worker_pid
+
+    with metrics_worker_lock:
+        if metrics_worker_pid == os.getpid():
+            return
+        # Unique per process lifetime, so a reused pid never overwrites an exited worker's totals
+        metrics_worker = f"{os.getpid()}-{time.time():.6f}"
+        metrics_worker_pid = os.getpid()
+    threading.Thread(target=flush_metrics, name='metrics-flush', daemon=True).start()
+
+def all_worker_metrics():
+    """Metrics of every worker: this one's current values and the others' last flushed ones
+
+    Exited workers keep their last totals, so summed counters never go back.
+    """
+    current = worker_metrics()
+    if not state.shared:
+        return [current]
+    start_metrics_flusher()
+    state.put_metrics(metrics_worker, current)
+    return state.worker_metrics()
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, transfer, cache and uptime metrics of all workers in the Prometheus text format"""
+    presence.expire()
+    workers = all_worker_metrics()
+    # Gauges only count workers that reported recently; exited ones stop flushing
+    live = [worker for worker in workers if time.time() - worker['updated_at'] <= 3 * metrics_flush_interval]
+    combined = RequestMetrics.combined([worker['requests'] for worker in workers], request_metrics.buckets)
+    caches = {}
+    for worker in workers:
+        for name, (hits, misses) in worker['caches'].items():
+            total = caches.setdefault(name, [0, 0])
+            total[0] += hits
+            total[1] += misses
+    caches = sorted(caches.items())
+
+    lines = combined.render()
+    lines += metric('filesharing_bytes_sent_total', 'counter', 'Response body bytes sent',
+                    [({}, combined.bytes_sent + sum(worker['shaped_bytes']['download'] for worker in workers))])
+    lines += metric('filesharing_bytes_received_total', 'counter', 'Request body bytes received',
+                    [({}, combined.bytes_received + sum(worker['shaped_bytes']['upload'] for worker in workers))])
+    lines += metric('filesharing_active_transfers', 'gauge', 'Downloads and uploads in progress',
+                    [({'direction': direction}, sum(worker['active_transfers'][direction] for worker in live))
+                     for direction in ('download', 'upload')])
+    lines += metric('filesharing_workers', 'gauge', 'Worker processes that reported metrics recently',
+                    [({}, len(live))])
+    lines += metric('filesharing_cache_hits_total', 'counter', 'Lookups answered from a cache',
+                    [({'cache': name}, hits) for name, (hits, _) in caches])
+    lines += metric('filesharing_cache_misses_total', 'counter', 'Lookups a cache could not answer',
+                    [({'cache': name}, misses) for name, (_, misses) in caches])
+    lines += metric('filesharing_cache_hit_ratio', 'gauge', 'Share of lookups answered from a cache',
+                    [({'cache': name}, hits / (hits + misses) if hits + misses else 0.0)
+                     for name, (hits, misses) in caches])
+    lines += metric('filesharing_connected_users', 'gauge', 'Users seen in the last five minutes',
+                    [({}, presence.user_count())])
+    lines += metric('filesharing_start_time_seconds', 'gauge', 'Unix time the first worker process started',
+                    [({}, combined.started_at)])
+    lines += metric('filesharing_uptime_seconds', 'gauge', 'Seconds since the first worker process started',
+                    [({}, combined.uptime())])
+    return Response('\n'.join(lines) + '\n', content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/api/heartbeat', methods=['POST'])
 def heartbeat():
     """Update user's last seen timestamp"""
     user_id = get_or_create_user_session()
 
-    if user_id in connected_users:
-        connected_users[user_id]['last_seen'] = datetime.now().isoformat()
+    presence.heartbeat(user_id)
 
     return jsonify({'success': True})
 
@@ -446,4 +1557,6 @@ if __name__ == '__main__':
     print(f"Port: {port}")
     print(f"Access URL: http://{local_ip}:{port}")
 
-    app.run(host='0.0.0.0', port=port, debug=True)
+    if os.environ.get('FLASK_DEBUG') != '1' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        configure_discovery().start()
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG') == '1')
@@ -0,0 +1,148 @@
+import os
+import time
+import tarfile
+import zipfile
+from utils import is_partial_upload
+
+# Read size used when copying files into an archive
+chunk_size = 256 * 1024
+
+ARCHIVE_FORMATS = ('zip', 'tar')
+
+class StreamBuffer:
+    """Write-only, non-seekable file object that hands written bytes to a generator
+
+    zipfile detects that it cannot seek and writes data descriptors after
+    each member instead of patching headers, so archives can be produced
+    front to back while only one chunk is ever held in memory.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+            self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return and forget everything written since the last drain"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_tree(base_path, arc_prefix):
+    """Yield (path, arcname) for a file or for every file and folder under a directory"""
+    if not os.path.isdir(base_path):
+        yield base_path, arc_prefix
+        return
+
+    yield base_path, arc_prefix + '/'
+    for root, dirs, files in os.walk(base_path):
+        dirs.sort()
+        relative_root = os.path.relpath(root, base_path)
+        for name in dirs:
+            arcname = os.path.normpath(os.path.join(arc_prefix, relative_root, name)).replace('\\', '/')
+            yield os.path.join(root, name), arcname + '/'
+        for name in sorted(files):
+            if is_partial_upload(name):
+                continue
+            arcname = os.path.normpath(os.path.join(arc_prefix, relative_root, name)).replace('\\', '/')
+            yield os.path.join(root, name), arcname
+
+def iter_zip(entries, deflate=False):
+    """Yield a ZIP archive of (path, arcname) entries as it is generated"""
+    for data in _iter_zip(entries, deflate):
+        # An empty chunk would end a chunked response early
+        if data:
+            yield data
+
+def _iter_zip(entries, deflate):
+    buffer = StreamBuffer()
+    compression = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+    with zipfile.ZipFile(buffer, 'w', compression=compression, allowZip64=True) as archive:
+        for path, arcname in entries:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            info = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[:6])
+            if arcname.endswith('/'):
+                info.external_attr = 0o40775 << 16 | 0x10
+                archive.writestr(info, b'')
+            else:
+                info.external_attr = (st.st_mode & 0xFFFF) << 16
+                info.compress_type = compression
+                # A known size lets zipfile decide up front whether ZIP64 is needed
+                info.file_size = st.st_size
+                try:
+                    with open(path, 'rb') as src, archive.open(info, 'w') as dst:
+                        for data in iter(lambda: src.read(chunk_size), b''):
+                            dst.write(data)
+                            yield buffer.drain()
+                except OSError:
+                    continue
+            yield buffer.drain()
+    yield buffer.drain()
+
+def iter_tar(entries):
+    """Yield a POSIX (pax) TAR archive of (path, arcname) entries as it is generated"""
+    written = 0
+    for path, arcname in entries:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+
+        info = tarfile.TarInfo(arcname.rstrip('/'))
+        info.mtime = int(st.st_mtime)
+        info.mode = st.st_mode & 0o7777
+        if arcname.endswith('/'):
+            info.type = tarfile.DIRTYPE
+        else:
+            info.size = st.st_size
+
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        yield header
+        written += len(header)
+
+        if info.type == tarfile.DIRTYPE:
+            continue
+
+        # The header promised st_size bytes, so pad or cut to exactly that
+        remaining = st.st_size
+        try:
+            with open(path, 'rb') as src:
+                while remaining > 0:
+                    data = src.read(min(chunk_size, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+        except OSError:
+            pass
+        while remaining > 0:
+            # File shrank while being read
+            filler = min(chunk_size, remaining)
+            remaining -= filler
+            yield b'\0' * filler
+        written += st.st_size
+
+        padding = -st.st_size % tarfile.BLOCKSIZE
+        if padding:
+            yield b'\0' * padding
+            written += padding
+
+    # End-of-archive marker, padded to a whole record like tarfile does
+    trailer = tarfile.BLOCKSIZE * 2
+    trailer += -(written + trailer) % tarfile.RECORDSIZE
+    yield b'\0' * trailer
@@ -0,0 +1,325 @@
+"""
+ASGI entry point for the LAN File Sharing Web App
+
+Run with an ASGI server, e.g. `uvicorn asgi:application`, or through
+`start_server.py --asgi`. Every request still goes through the Flask app, so
+routes, sessions and path checks are the same as under WSGI, but the views run
+in a bounded thread pool and only for as long as it takes to build the
+response:
+
+- file bodies (downloads, resumed ranges, compressed variants) are streamed
+  from the event loop in stream_chunk_size pieces, each sent only once the client
+  has taken the previous one;
+- /upload bodies are received on the event loop and fed to the multipart
+  parser as they arrive, before the view runs;
+- /api/events streams wait for events on the event loop, so open pages hold
+  no thread;
+- any other body is handed over through a queue of max_buffered_chunks, so a
+  page render frees its thread as soon as it is done.
+
+Only folder archives, which the app builds as it streams, keep a thread for
+their whole length.
+"""
+
+import sys
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import app as server
+from downloads import FileBody
+from events import EventStream
+from uploads import MultipartUpload, UploadError
+from utils import unique_file_path
+
+# Threads that run Flask views
+wsgi_threads = 32
+
+# Chunks a streamed response may produce ahead of a slow client
+max_buffered_chunks = 4
+
+# Bytes read per step when streaming a file body; each slow client holds
+# about one step plus the server's write buffer (64 KB in uvicorn)
+stream_chunk_size = 16 * 1024
+
+executor = None
+
+def get_executor():
+    """Return the thread pool that runs Flask views, creating it on first use"""
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=wsgi_threads, thread_name_prefix='asgi-view')
+    return executor
+
+class RequestBody:
+    """Request body fed by ASGI receive(), readable from the loop or as a blocking wsgi.input"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b''
+        self.complete = False
+
+    async def next_chunk(self):
+        """Return the next piece of the body, or b'' once it has all been read"""
+        while not self.complete:
+            message = await self._receive()
+            if message['type'] == 'http.disconnect':
+                self.complete = True
+                break
+            self.complete = not message.get('more_body', False)
+            if message.get('body'):
+                return message['body']
+        return b''
+
+    async def drain(self):
+        """Discard whatever the view did not read"""
+        while await self.next_chunk():
+            pass
+
+    def read(self, size=-1):
+        # Called from view threads
+        if not self._buffer:
+            self._buffer = asyncio.run_coroutine_threadsafe(self.next_chunk(), self._loop).result()
+        if size is None or size < 0:
+            data = self._buffer + b''.join(iter(lambda: asyncio.run_coroutine_threadsafe(
+                self.next_chunk(), self._loop).result(), b''))
+            self._buffer = b''
+            return data
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope into a WSGI environ"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def run_view(environ):
+    """Call the Flask app and return (status, headers, body iterable)"""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]), headers]
+
+    body = server.app(environ, start_response)
+    return started[0], started[1], body
+
+async def receive_upload(environ, body, send):
+    """Parse an /upload body as it arrives; return False if an error response was sent
+
+    The parser's disk writes run in the default executor one received chunk
+    at a time, and the next chunk is not asked for until the previous one is
+    written, so a fast client is held back by the disk rather than buffered.
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(get_executor(), server.sync_shared_folder)
+    if not server.shared_folder:
+        return True
+    try:
+        upload = MultipartUpload(environ.get('CONTENT_TYPE'), server.shared_folder, unique_file_path,
+                                 server.max_upload_file_size, server.max_upload_size)
+    except UploadError:
+        # The view reports it
+        return True
+
+    with server.app.request_context(environ):
+        transfer = server.upload_shaper.open(server.transfer_key())
+    try:
+        while True:
+            data = await body.next_chunk()
+            await throttle(transfer, len(data))
+            if await loop.run_in_executor(None, upload.feed, data) or not data:
+                break
+    except UploadError as e:
+        await loop.run_in_executor(None, upload.abort)
+        await send_json(send, {'error': e.message}, e.status)
+        return False
+    except Exception:
+        await loop.run_in_executor(None, upload.abort)
+        raise
+    finally:
+        transfer.close()
+        results = upload.close()
+    environ['filesharing.upload_results'] = results
+    return True
+
+async def send_json(send, data, status):
+    """Send a complete JSON response"""
+    payload = json.dumps(data).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(payload)).encode())]})
+    await send({'type': 'http.response.body', 'body': payload})
+
+def read_at(f, position, size):
+    """Read size bytes at position; runs in the default executor"""
+    f.seek(position)
+    return f.read(size)
+
+async def throttle(transfer, nbytes):
+    """Wait as long as a shaped transfer's limits require, without blocking the loop"""
+    if transfer is not None:
+        delay = transfer.consume(nbytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+async def send_file_body(file_body, send, disconnected):
+    """Stream a FileBody from the event loop, one chunk in flight at a time"""
+    loop = asyncio.get_running_loop()
+    transfer = file_body.shaper.open(file_body.shaping_key) if file_body.shaper is not None else None
+    try:
+        for part in file_body.parts:
+            if isinstance(part, bytes):
+                await throttle(transfer, len(part))
+                await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+                continue
+            path, start, end = part
+            f = await loop.run_in_executor(None, file_body.open, path)
+            try:
+                position = start
+                while position <= end:
+                    if disconnected.is_set():
+                        return
+                    data = await loop.run_in_executor(None, read_at, f, position,
+                                                      min(stream_chunk_size, end - position + 1))
+                    if not data:
+                        break
+                    position += len(data)
+                    await throttle(transfer, len(data))
+                    # Waits while the client's socket buffer is full
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+            finally:
+                f.close()
+    finally:
+        if transfer is not None:
+            transfer.close()
+        file_body.close()
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def send_event_stream(event_stream, send, disconnected):
+    """Send an EventStream from the event loop until it ends or the client goes away"""
+    stream = event_stream.aiter()
+    gone = asyncio.ensure_future(disconnected.wait())
+    try:
+        while True:
+            chunk = asyncio.ensure_future(stream.__anext__())
+            await asyncio.wait({chunk, gone}, return_when=asyncio.FIRST_COMPLETED)
+            if not chunk.done():
+                chunk.cancel()
+                try:
+                    await chunk
+                except (asyncio.CancelledError, StopAsyncIteration):
+                    pass
+                return
+            try:
+                data = chunk.result()
+            except StopAsyncIteration:
+                break
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+    finally:
+        gone.cancel()
+        await stream.aclose()
+        event_stream.close()
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def send_iterable(app_iter, send, disconnected):
+    """Send a WSGI body produced in a view thread through a bounded queue"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(max_buffered_chunks)
+
+    def produce():
+        try:
+            for data in app_iter:
+                if disconnected.is_set():
+                    break
+                if data:
+                    asyncio.run_coroutine_threadsafe(queue.put(data), loop).result()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+            asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+    producer = loop.run_in_executor(get_executor(), produce)
+    while True:
+        data = await queue.get()
+        if data is None:
+            break
+        # Keep draining after a disconnect so the producer can finish
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+    await producer
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def lifespan(receive, send):
+    """Answer ASGI lifespan messages, stopping the view threads on shutdown"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if executor is not None:
+                executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    """ASGI application serving the Flask app"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    loop = asyncio.get_running_loop()
+    body = RequestBody(receive, loop)
+    environ = build_environ(scope, body)
+    if scope['method'] == 'POST' and scope['path'] == '/upload':
+        if not await receive_upload(environ, body, send):
+            return
+
+    status, headers, app_iter = await loop.run_in_executor(get_executor(), run_view, environ)
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        await body.drain()
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers]})
+        if isinstance(app_iter, FileBody):
+            await send_file_body(app_iter, send, disconnected)
+        elif isinstance(app_iter, EventStream):
+            await send_event_stream(app_iter, send, disconnected)
+        else:
+            await send_iterable(app_iter, send, disconnected)
+    finally:
+        watcher.cancel()
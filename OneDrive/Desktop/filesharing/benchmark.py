@@ -0,0 +1,928 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the LAN File Sharing Web App
+This script measures the hot paths of the server against their previous implementations.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import socket
+import threading
+import multiprocessing
+import subprocess
+import http.client
+import importlib.util
+import asyncio
+import statistics
+from datetime import datetime, timedelta
+import base64
+import qrcode
+from io import BytesIO
+from werkzeug.utils import secure_filename
+from werkzeug.wrappers import Request
+from utils import scan_directory, get_file_size, unique_file_path
+from uploads import stream_multipart_upload
+from downloads import read_ranges
+from presence import PresenceRegistry
+from activity_log import ActivityLog, encode_cursor
+from delta import compute_signature, parse_signature, match_blocks, missing_ranges
+from mirror import Mirror
+from shaping import BandwidthShaper
+from metrics import RequestMetrics
+import requests
+from urllib.parse import urljoin
+
+def legacy_scan_directory(directory_path):
+    """Original os.listdir + isfile/isdir/getsize implementation"""
+    items = []
+    for item in os.listdir(directory_path):
+        item_path = os.path.join(directory_path, item)
+        if os.path.isfile(item_path):
+            items.append({
+                'name': item,
+                'type': 'file',
+                'size': get_file_size(item_path),
+                'path': item_path
+            })
+        elif os.path.isdir(item_path):
+            items.append({
+                'name': item,
+                'type': 'directory',
+                'path': item_path
+            })
+    return sorted(items, key=lambda x: (x['type'] == 'file', x['name'].lower()))
+
+def make_directory(root, count):
+    """Create a directory with count small files and a few subfolders"""
+    path = os.path.join(root, f"dir_{count}")
+    os.makedirs(path)
+    for i in range(count):
+        if i % 100 == 0:
+            os.mkdir(os.path.join(path, f"folder_{i:06d}"))
+        else:
+            with open(os.path.join(path, f"file_{i:06d}.txt"), 'wb') as f:
+                f.write(b"x" * (i % 512))
+    return path
+
+def time_best(func, arg, repeat):
+    """Return the best wall time of func(arg) over repeat runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_listing(args):
+    """Compare scan_directory with the legacy listing on large folders"""
+    print("📂 DIRECTORY LISTING")
+    print("-" * 60)
+    print(f"{'entries':>10} {'legacy (ms)':>14} {'scandir (ms)':>14} {'speedup':>10}")
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    try:
+        for count in args.sizes:
+            path = make_directory(root, count)
+            legacy = time_best(legacy_scan_directory, path, args.repeat)
+            current = time_best(scan_directory, path, args.repeat)
+            print(f"{count:>10} {legacy * 1000:>14.1f} {current * 1000:>14.1f} {legacy / current:>9.1f}x")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def legacy_generate_qr_code(url):
+    """Original per-request QR encode, PIL render, PNG encode and base64"""
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(url)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+
+def bench_index(args):
+    """Compare index page latency with and without the per-request QR render"""
+    import app as server
+    print("🏠 INDEX PAGE")
+    print("-" * 60)
+    print(f"{'version':>10} {'mean (ms)':>12} {'p95 (ms)':>12}")
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    try:
+        server.shared_folder = root
+        client = server.app.test_client()
+        server_url = f"http://{server.local_ip}:{server.port}"
+        client.get('/')
+
+        def legacy():
+            # The QR code used to be rendered inline on every request
+            legacy_generate_qr_code(server_url)
+            client.get('/')
+
+        def memoized():
+            client.get('/')
+            client.get('/qr.png', headers={'If-None-Match': f'"{server.qr_code_version()}"'})
+
+        for name, request in (('legacy', legacy), ('memoized', memoized)):
+            samples = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                request()
+                samples.append(time.perf_counter() - start)
+            samples.sort()
+            mean = sum(samples) / len(samples)
+            p95 = samples[int(len(samples) * 0.95) - 1]
+            print(f"{name:>10} {mean * 1000:>12.2f} {p95 * 1000:>12.2f}")
+        print("memoized includes the browser's revalidation of /qr.png (304)")
+    finally:
+        server.shared_folder = None
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def legacy_presence_request(users, activities, user_id):
+    """Original per-request presence bookkeeping: rebuild, full scan, insert and slice"""
+    now = datetime.now()
+    users[user_id] = {'name': 'Anonymous User', 'last_seen': now.isoformat()}
+    cutoff = now - timedelta(minutes=5)
+    inactive = [uid for uid, data in users.items() if datetime.fromisoformat(data['last_seen']) < cutoff]
+    for uid in inactive:
+        del users[uid]
+    activities.insert(0, {'user_id': user_id, 'timestamp': now.isoformat()})
+    if len(activities) > 50:
+        activities[:] = activities[:50]
+
+def bench_presence(args):
+    """Compare per-request presence tracking cost as the number of clients grows"""
+    print("👥 PRESENCE TRACKING")
+    print("-" * 60)
+    print(f"{'clients':>10} {'legacy (µs)':>14} {'registry (µs)':>14} {'speedup':>10}")
+    for count in args.clients:
+        ids = [f"user-{i}" for i in range(count)]
+        requests_per_run = max(count, 10000)
+
+        users, activities = {}, []
+        for user_id in ids:
+            legacy_presence_request(users, activities, user_id)
+        start = time.perf_counter()
+        for i in range(requests_per_run):
+            legacy_presence_request(users, activities, ids[i % count])
+        legacy = (time.perf_counter() - start) / requests_per_run
+
+        registry = PresenceRegistry(timeout=300, max_activities=50)
+        for user_id in ids:
+            registry.touch(user_id, None, '127.0.0.1', 'home')
+        start = time.perf_counter()
+        for i in range(requests_per_run):
+            user_id = ids[i % count]
+            registry.touch(user_id, None, '127.0.0.1', 'home')
+            registry.expire()
+            registry.record_activity(user_id, 'browsing')
+        current = (time.perf_counter() - start) / requests_per_run
+
+        print(f"{count:>10} {legacy * 1e6:>14.1f} {current * 1e6:>14.1f} {legacy / current:>9.1f}x")
+    print()
+
+def make_multipart_body(path, size, boundary):
+    """Write a multipart/form-data body holding one file of size bytes"""
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        f.write(f'--{boundary}\r\n'
+                'Content-Disposition: form-data; name="file"; filename="payload.bin"\r\n'
+                'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+        f.write(f'\r\n--{boundary}--\r\n'.encode())
+
+def legacy_upload(body, content_type, length, destination):
+    """Original path: Werkzeug spools each part, then file.save() copies it"""
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(length),
+        'wsgi.input': body
+    }
+    for file in Request(environ).files.getlist('file'):
+        file.save(unique_file_path(destination, secure_filename(file.filename)))
+
+def streaming_upload(body, content_type, length, destination):
+    """Streaming path used by /upload"""
+    stream_multipart_upload(body, content_type, destination, unique_file_path)
+
+def run_upload(mode, body_path, content_type, destination, results):
+    """Run one upload path in a fresh process and report time and peak RSS growth"""
+    func = legacy_upload if mode == 'legacy' else streaming_upload
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    length = os.path.getsize(body_path)
+    start = time.perf_counter()
+    with open(body_path, 'rb') as body:
+        func(body, content_type, length, destination)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed, rss_after - rss_before))
+
+def bench_upload(args):
+    """Compare the streaming /upload ingestion with Werkzeug's spooled parsing"""
+    size = args.upload_size * 1024 * 1024
+    print("📤 UPLOAD INGESTION")
+    print("-" * 60)
+    print(f"{'path':>10} {'MB/s':>10} {'peak RSS growth (MB)':>24}")
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    try:
+        boundary = 'benchmarkboundary'
+        body_path = os.path.join(root, 'body.bin')
+        make_multipart_body(body_path, size, boundary)
+        content_type = f'multipart/form-data; boundary={boundary}'
+
+        context = multiprocessing.get_context('fork')
+        for mode in ('legacy', 'streaming'):
+            destination = os.path.join(root, mode)
+            os.mkdir(destination)
+            results = context.Queue()
+            worker = context.Process(target=run_upload,
+                                     args=(mode, body_path, content_type, destination, results))
+            worker.start()
+            elapsed, rss_growth_kb = results.get()
+            worker.join()
+            print(f"{mode:>10} {size / elapsed / 1024 / 1024:>10.1f} {rss_growth_kb / 1024:>24.1f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def drain_socket(sock, peer):
+    """Read and discard everything from sock until the peer closes it"""
+    # The forked reader holds a copy of the sending end, which must be closed
+    # for recv to see end of stream
+    peer.close()
+    while sock.recv(1024 * 1024):
+        pass
+
+def send_python(sock, file_path, size):
+    """Copy the file through userspace like the 'python' serve mode"""
+    for data in read_ranges(file_path, [(0, size - 1)]):
+        sock.sendall(data)
+
+def send_zero_copy(sock, file_path, size):
+    """Send the file with os.sendfile like the 'sendfile' serve mode"""
+    with open(file_path, 'rb') as f:
+        offset = 0
+        while offset < size:
+            offset += os.sendfile(sock.fileno(), f.fileno(), offset, size - offset)
+
+def bench_serving(args):
+    """Measure server CPU time per GB for each download serving mode"""
+    size = args.download_size * 1024 * 1024
+    print("⬇️  DOWNLOAD SERVING")
+    print("-" * 60)
+    print(f"{'mode':>10} {'CPU s/GB':>10} {'wall MB/s':>12}")
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    try:
+        file_path = os.path.join(root, 'payload.bin')
+        block = os.urandom(1024 * 1024)
+        with open(file_path, 'wb') as f:
+            for _ in range(args.download_size):
+                f.write(block)
+
+        context = multiprocessing.get_context('fork')
+        for mode, sender in (('python', send_python), ('sendfile', send_zero_copy)):
+            server_sock, client_sock = socket.socketpair()
+            reader = context.Process(target=drain_socket, args=(client_sock, server_sock))
+            reader.start()
+            client_sock.close()
+
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            sender(server_sock, file_path, size)
+            server_sock.close()
+            cpu = time.process_time() - cpu_start
+            wall = time.perf_counter() - wall_start
+            reader.join()
+            print(f"{mode:>10} {cpu / (size / 1024 ** 3):>10.2f} {size / wall / 1024 / 1024:>12.1f}")
+        print("x-sendfile and x-accel hand the copy to the front proxy, so the")
+        print("app only spends the time to build the response headers.")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def hammer(port, path, duration, counts):
+    """Send requests over one keep-alive connection for duration seconds"""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    done = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        conn.request('GET', path)
+        conn.getresponse().read()
+        done += 1
+    conn.close()
+    counts.put(done)
+
+def wait_for_server(port, timeout=30):
+    """Return once the server on port answers, or raise RuntimeError"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/browse')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+def bench_workers(args):
+    """Measure /api/browse requests per second against the number of worker processes"""
+    print("🏭 MULTI-WORKER THROUGHPUT")
+    print("-" * 60)
+    if importlib.util.find_spec('gunicorn') is None:
+        print("skipped: --workers needs gunicorn (pip install gunicorn)")
+        print()
+        return
+    print(f"{os.cpu_count()} CPU(s), {args.connections} keep-alive connections, {args.duration}s per run")
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8}")
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'start_server.py')
+    context = multiprocessing.get_context('fork')
+    baseline = None
+    try:
+        make_directory(root, 1000)
+        for port, workers in enumerate(args.workers, start=18700):
+            server = subprocess.Popen(
+                [sys.executable, script, '--port', str(port), '--host', '127.0.0.1',
+                 '--workers', str(workers), '--folder', root,
+                 '--state-db', os.path.join(root, f'state-{port}.sqlite3')],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_server(port)
+                counts = context.Queue()
+                clients = [context.Process(target=hammer, args=(port, '/api/browse', args.duration, counts))
+                           for _ in range(args.connections)]
+                for client in clients:
+                    client.start()
+                total = sum(counts.get() for _ in clients)
+                for client in clients:
+                    client.join()
+            finally:
+                server.terminate()
+                server.wait()
+            rate = total / args.duration
+            baseline = baseline or rate
+            print(f"{workers:>8} {rate:>10.0f} {rate / baseline:>7.2f}x")
+        print("Throughput stops growing once workers plus load generator use every core.")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+async def slow_download(port, path, rate, deadline, received):
+    """Download path at about rate bytes/s through a small receive buffer until deadline"""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket()
+    # A small buffer keeps the kernel from soaking up the file on the client's behalf
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+    sock.setblocking(False)
+    total = 0
+    try:
+        await loop.sock_connect(sock, ('127.0.0.1', port))
+        await loop.sock_sendall(sock, f'GET {path} HTTP/1.1\r\nHost: bench\r\n\r\n'.encode())
+        while loop.time() < deadline:
+            data = await loop.sock_recv(sock, 4096)
+            if not data:
+                break
+            total += len(data)
+            await asyncio.sleep(len(data) / rate)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+        received.append(total)
+
+async def probe(port, path, timeout):
+    """Return the seconds one request on a fresh connection takes, or None on timeout"""
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n'.encode())
+        await asyncio.wait_for(reader.read(), timeout)
+        writer.close()
+    except (OSError, asyncio.TimeoutError):
+        return None
+    return time.perf_counter() - start
+
+async def slow_client_load(port, clients, rate, duration):
+    """Hold clients slow downloads open while probing /api/browse; return (received, probe times)"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    received = []
+    downloads = []
+    for i in range(clients):
+        downloads.append(asyncio.ensure_future(slow_download(port, '/download/slow.bin', rate, deadline, received)))
+        if i % 100 == 99:
+            # Stay within the listen backlog
+            await asyncio.sleep(0.05)
+    probes = []
+    while loop.time() < deadline:
+        probes.append(await probe(port, '/api/browse', max(deadline - loop.time(), 1)))
+        await asyncio.sleep(0.5)
+    await asyncio.gather(*downloads)
+    return received, probes
+
+async def event_stream(port, deadline, opened):
+    """Hold an /api/events stream open until deadline, as an open page does"""
+    loop = asyncio.get_running_loop()
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /api/events?path= HTTP/1.1\r\nHost: bench\r\n\r\n')
+        await asyncio.wait_for(reader.readuntil(b'retry:'), max(deadline - loop.time(), 0.1))
+        opened.append(True)
+        while loop.time() < deadline:
+            try:
+                await asyncio.wait_for(reader.read(4096), max(deadline - loop.time(), 0.1))
+            except asyncio.TimeoutError:
+                break
+        writer.close()
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        pass
+
+async def event_stream_load(port, clients, duration):
+    """Open clients event streams and probe /api/browse while they are open; return (opened, probe times)"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    opened = []
+    streams = []
+    for i in range(clients):
+        streams.append(asyncio.ensure_future(event_stream(port, deadline, opened)))
+        if i % 100 == 99:
+            await asyncio.sleep(0.05)
+    # Give the streams time to connect before probing
+    await asyncio.sleep(min(2, duration / 4))
+    probes = []
+    while loop.time() < deadline - 1:
+        probes.append(await probe(port, '/api/browse', max(deadline - loop.time(), 1)))
+        await asyncio.sleep(0.5)
+    await asyncio.gather(*streams)
+    return len(opened), probes
+
+def process_tree(pid):
+    """Return (thread count, RSS in MB) of a process and its children, from /proc"""
+    pids = [pid]
+    try:
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+        threads = rss = 0
+        for child in pids:
+            with open(f'/proc/{child}/status') as f:
+                for line in f:
+                    if line.startswith('Threads:'):
+                        threads += int(line.split()[1])
+                    elif line.startswith('VmRSS:'):
+                        rss += int(line.split()[1])
+    except OSError:
+        return None, None
+    return threads, rss / 1024
+
+def bench_slow_clients(args):
+    """Compare the Flask servers and the ASGI entry point under many slow downloads"""
+    print("🐢 SLOW CLIENTS")
+    print("-" * 60)
+    modes = [('flask', [])]
+    if importlib.util.find_spec('gunicorn') is not None:
+        modes.append(('gunicorn', ['--workers', '1', '--threads', '32']))
+    if importlib.util.find_spec('uvicorn') is not None:
+        modes.append(('asgi', ['--asgi']))
+    # A client counts as served once it got a quarter of what its rate allows
+    served = args.slow_rate * 1024 * args.duration / 4
+    rate = args.slow_rate * 1024
+    print(f"{args.slow_clients} clients downloading at {args.slow_rate} KB/s for {args.duration}s, "
+          f"/api/browse probed every 0.5s")
+    print(f"{'server':>9} {'served':>8} {'MB sent':>8} {'probe p50':>10} {'probe max':>10} "
+          f"{'failed':>7} {'threads':>8} {'RSS MB':>7}")
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.slow_clients * 2 + 256)), hard))
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'start_server.py')
+    try:
+        make_directory(root, 100)
+        with open(os.path.join(root, 'slow.bin'), 'wb') as f:
+            f.truncate(64 * 1024 * 1024)
+        for port, (mode, options) in enumerate(modes, start=18800):
+            server = subprocess.Popen(
+                [sys.executable, script, '--port', str(port), '--host', '127.0.0.1', '--folder', root] + options,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_server(port)
+                sampled = []
+
+                def sample():
+                    time.sleep(args.duration * 0.8)
+                    sampled.extend(process_tree(server.pid))
+
+                sampler = threading.Thread(target=sample)
+                sampler.start()
+                received, probes = asyncio.run(slow_client_load(port, args.slow_clients, rate, args.duration))
+                sampler.join()
+            finally:
+                server.terminate()
+                server.wait()
+            answered = [p for p in probes if p is not None]
+            p50 = f"{statistics.median(answered) * 1000:.0f} ms" if answered else '-'
+            worst = f"{max(answered) * 1000:.0f} ms" if answered else '-'
+            threads, rss = sampled
+            print(f"{mode:>9} {sum(1 for r in received if r >= served):>8} {sum(received) / 1024 / 1024:>8.0f} "
+                  f"{p50:>10} {worst:>10} {len(probes) - len(answered):>7} "
+                  f"{threads if threads is not None else '-':>8} {f'{rss:.0f}' if rss is not None else '-':>7}")
+        print("served: clients that got at least a quarter of their rate; failed: probes not answered in time")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def bench_event_streams(args):
+    """Check that pages holding /api/events open do not starve other requests"""
+    print("📡 EVENT STREAMS")
+    print("-" * 60)
+    modes = [('flask', [])]
+    if importlib.util.find_spec('gunicorn') is not None:
+        modes.append(('gunicorn', ['--workers', '1', '--threads', '32']))
+    if importlib.util.find_spec('uvicorn') is not None:
+        modes.append(('asgi', ['--asgi', '--threads', '32']))
+    print(f"{args.sse_clients} open event streams for {args.duration}s, /api/browse probed every 0.5s; "
+          f"gunicorn and asgi run 32 threads")
+    print(f"{'server':>9} {'opened':>7} {'probe p50':>10} {'probe max':>10} {'failed':>7} {'threads':>8}")
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.sse_clients * 2 + 256)), hard))
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'start_server.py')
+    try:
+        make_directory(root, 100)
+        for port, (mode, options) in enumerate(modes, start=18810):
+            server = subprocess.Popen(
+                [sys.executable, script, '--port', str(port), '--host', '127.0.0.1', '--folder', root,
+                 '--no-discovery'] + options,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_server(port)
+                sampled = []
+
+                def sample():
+                    time.sleep(args.duration * 0.8)
+                    sampled.extend(process_tree(server.pid))
+
+                sampler = threading.Thread(target=sample)
+                sampler.start()
+                opened, probes = asyncio.run(event_stream_load(port, args.sse_clients, args.duration))
+                sampler.join()
+            finally:
+                server.terminate()
+                server.wait()
+            answered = [p for p in probes if p is not None]
+            p50 = f"{statistics.median(answered) * 1000:.0f} ms" if answered else '-'
+            worst = f"{max(answered) * 1000:.0f} ms" if answered else '-'
+            threads = sampled[0]
+            print(f"{mode:>9} {opened:>7} {p50:>10} {worst:>10} {len(probes) - len(answered):>7} "
+                  f"{threads if threads is not None else '-':>8}")
+        print("opened: streams that got their first bytes; failed: probes not answered in time")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def bench_activity(args):
+    """Measure activity log appends and queries on a large log"""
+    rows = args.activity_rows
+    print("📜 ACTIVITY LOG")
+    print("-" * 60)
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    try:
+        log = ActivityLog(os.path.join(root, 'activity.sqlite3'))
+        appends = 100000
+        activity = {'user_id': 'u1', 'user_name': 'User 1', 'action': 'download',
+                    'details': 'Downloaded: file.bin', 'timestamp': datetime.now().isoformat(), 'ip': '10.0.0.1'}
+        start = time.perf_counter()
+        for _ in range(appends):
+            log.append(activity)
+        queued = time.perf_counter() - start
+        log.flush(timeout=600)
+        written = time.perf_counter() - start
+        print(f"append: {queued / appends * 1e6:.1f} µs on the request path, "
+              f"{appends / written:,.0f} activities/s written")
+
+        # Fill the log directly; spread over 30 days, 1000 users and 4 actions
+        now = time.time()
+        actions = ('download', 'upload', 'connected', 'disconnected')
+        db = log._connection()
+        with db:
+            db.executemany('INSERT INTO activities (time, timestamp, user_id, user_name, action, details, ip) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           ((now - 30 * 86400 + i * 30 * 86400 / rows, '', f'u{i % 1000}', f'User {i % 1000}',
+                             actions[i % 4], f'file{i}.bin', '10.0.0.1') for i in range(rows)))
+        total = log.count()
+        middle = db.execute('SELECT time, id FROM activities ORDER BY time LIMIT 1 OFFSET ?',
+                            (total // 2,)).fetchone()
+
+        queries = [
+            ('newest page', {}),
+            ('one user', {'user_id': 'u42'}),
+            ('user name', {'user_name': 'User 7'}),
+            ('action, last day', {'action': 'upload', 'since': now - 86400}),
+            ('user, week ago', {'user_id': 'u42', 'since': now - 8 * 86400, 'until': now - 7 * 86400}),
+            ('page mid-log', {'cursor': encode_cursor(*middle)}),
+        ]
+        print(f"{total:,} activities")
+        print(f"{'query':>18} {'page ms':>9} {'count ms':>9} {'matches':>10}")
+        for label, filters in queries:
+            page_time = time_best(lambda f: log.query(**f, limit=50), filters, args.repeat)
+            counted = {k: v for k, v in filters.items() if k != 'cursor'}
+            count_time = time_best(lambda f: log.count(**f), counted, args.repeat)
+            print(f"{label:>18} {page_time * 1000:>9.2f} {count_time * 1000:>9.2f} {log.count(**counted):>10,}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def bench_delta(args):
+    """Measure signature hashing and how much of an edited file delta sync reuses"""
+    size = args.delta_size * 1024 * 1024
+    print("🧩 DELTA SYNC")
+    print("-" * 60)
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    try:
+        old_path = os.path.join(root, 'old.bin')
+        new_path = os.path.join(root, 'new.bin')
+        with open(old_path, 'wb') as f:
+            for _ in range(args.delta_size):
+                f.write(os.urandom(1024 * 1024))
+
+        with open(old_path, 'rb') as f:
+            data = bytearray(f.read())
+        edits = {
+            'unchanged': data,
+            '4 MB rewritten': data[:size // 2] + os.urandom(4 * 1024 * 1024) + data[size // 2 + 4 * 1024 * 1024:],
+            '100 B inserted': data[:1000] + os.urandom(100) + data[1000:],
+        }
+        print(f"{'edit':>16} {'sign MB/s':>10} {'match s':>8} {'fetched':>10} {'of file':>8}")
+        for label, new_data in edits.items():
+            with open(new_path, 'wb') as f:
+                f.write(new_data)
+            start = time.perf_counter()
+            compute_signature(new_path, new_path + '.sig', '"bench"')
+            signing = time.perf_counter() - start
+            with open(new_path + '.sig', 'rb') as f:
+                header, blocks = parse_signature(f.read())
+            start = time.perf_counter()
+            found = match_blocks(old_path, header, blocks)
+            matching = time.perf_counter() - start
+            fetched = sum(end - start + 1 for start, end in missing_ranges(header, len(blocks), found))
+            print(f"{label:>16} {len(new_data) / signing / 1024 / 1024:>10.0f} {matching:>8.2f} "
+                  f"{fetched / 1024:>8.0f} KB {fetched / len(new_data):>8.2%}")
+        print("A full download would fetch 100% every time.")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def legacy_mirror(port, paths, destination):
+    """Download every path with a one-off requests.get, one file at a time"""
+    for path in paths:
+        response = requests.get(f"http://127.0.0.1:{port}/download/{path}", timeout=60)
+        with open(os.path.join(destination, path), 'wb') as f:
+            f.write(response.content)
+
+def bench_mirror(args):
+    """Measure mirroring a peer's share: one-off requests vs pooled parallel downloads"""
+    print("🪞 MIRROR")
+    print("-" * 60)
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    share = os.path.join(root, 'share')
+    os.makedirs(share)
+    paths = []
+    for i in range(args.mirror_files):
+        paths.append(f'file_{i:05d}.bin')
+        with open(os.path.join(share, paths[-1]), 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+    total = args.mirror_files * 64 * 1024
+    port = 18790
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'start_server.py')
+    server = subprocess.Popen([sys.executable, script, '--port', str(port), '--host', '127.0.0.1',
+                               '--folder', share],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(port)
+        print(f"{args.mirror_files} files of 64 KB from a second instance on port {port}")
+        print(f"{'client':>20} {'seconds':>8} {'files/s':>8} {'MB/s':>7}")
+        destination = os.path.join(root, 'legacy')
+        os.makedirs(destination)
+        start = time.perf_counter()
+        legacy_mirror(port, paths, destination)
+        elapsed = time.perf_counter() - start
+        print(f"{'one-off requests':>20} {elapsed:>8.2f} {len(paths) / elapsed:>8.0f} "
+              f"{total / elapsed / 1024 / 1024:>7.1f}")
+
+        for workers in (1, 4, 8):
+            destination = os.path.join(root, f'mirror-{workers}')
+            result = Mirror(f"http://127.0.0.1:{port}", destination, workers=workers).run()
+            elapsed = result['elapsed']
+            print(f"{f'mirror, {workers} worker(s)':>20} {elapsed:>8.2f} {result['files_done'] / elapsed:>8.0f} "
+                  f"{total / elapsed / 1024 / 1024:>7.1f}")
+        result = Mirror(f"http://127.0.0.1:{port}", destination, workers=8).run()
+        print(f"{'mirror, unchanged':>20} {result['elapsed']:>8.2f} "
+              f"({result['files_skipped']} files skipped, {result['bytes_done']} bytes fetched)")
+        print("Parallel downloads pay off when the peer has spare cores or the network adds latency.")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def bench_proxy(args):
+    """Measure browsing and downloading a peer through this server's caching proxy"""
+    print("🌐 PEER PROXY")
+    print("-" * 60)
+    root = tempfile.mkdtemp(prefix="fs_bench_")
+    share = os.path.join(root, 'share')
+    make_directory(share, 1000)
+    with open(os.path.join(share, 'popular.bin'), 'wb') as f:
+        f.write(os.urandom(args.proxy_size * 1024 * 1024))
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'start_server.py')
+    servers = [
+        subprocess.Popen([sys.executable, script, '--port', str(port), '--host', '127.0.0.1',
+                          '--no-discovery'] + extra,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for port, extra in ((18791, ['--folder', share]), (18792, []))
+    ]
+    try:
+        wait_for_server(18791)
+        wait_for_server(18792)
+        session = requests.Session()
+        response = session.post('http://127.0.0.1:18792/connect_to', allow_redirects=False,
+                                data={'remote_ip': '127.0.0.1', 'remote_port': '18791', 'proxy': '1'})
+        proxy = urljoin('http://127.0.0.1:18792/', response.headers['Location']).rsplit('/browse/', 1)[0]
+
+        def timed(url):
+            start = time.perf_counter()
+            body = session.get(url).content
+            return (time.perf_counter() - start) * 1000, len(body)
+
+        print(f"1001-entry folder and a {args.proxy_size} MB file on a second instance")
+        print(f"{'request':>28} {'ms':>8}")
+        print(f"{'listing, direct':>28} {timed('http://127.0.0.1:18791/browse')[0]:>8.1f}")
+        print(f"{'listing via proxy, cold':>28} {timed(proxy + '/browse/')[0]:>8.1f}")
+        print(f"{'listing via proxy, cached':>28} {timed(proxy + '/browse/')[0]:>8.1f}")
+        print(f"{'download, direct':>28} {timed('http://127.0.0.1:18791/download/popular.bin')[0]:>8.1f}")
+        print(f"{'download via proxy, cold':>28} {timed(proxy + '/download/popular.bin')[0]:>8.1f}")
+        print(f"{'download via proxy, cached':>28} {timed(proxy + '/download/popular.bin')[0]:>8.1f}")
+        stats = session.get('http://127.0.0.1:18792/api/server_stats').json()['peer_proxy']
+        print(f"Listings: {stats['listings']['hits']} hit(s), {stats['listings']['misses']} fetch(es); "
+              f"files: {stats['files']['hits']} served from the disk cache")
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(root, ignore_errors=True)
+    print()
+
+def shaped_sender(shaper, key, deadline, chunk, sent, index):
+    """Push chunks through a shaper until deadline, as a download thread would"""
+    transfer = shaper.open(key)
+    try:
+        while time.monotonic() < deadline:
+            transfer.throttle(chunk)
+            sent[index] += chunk
+    finally:
+        transfer.close()
+
+def bench_shaping(args):
+    """Measure bandwidth shaper overhead and how fairly a global cap is shared"""
+    print("🚦 BANDWIDTH SHAPING")
+    print("-" * 60)
+    chunk = 64 * 1024
+    for label, shaper in (('unlimited', BandwidthShaper()),
+                          ('limited', BandwidthShaper(rate=10 ** 15, user_rate=10 ** 15))):
+        transfer = shaper.open('bench')
+        start = time.perf_counter()
+        for _ in range(100000):
+            transfer.consume(chunk)
+        elapsed = time.perf_counter() - start
+        transfer.close()
+        print(f"{label:>10}: {elapsed / 100000 * 1e6:.2f} µs per 64 KB chunk")
+
+    rate = 16 * 1024 * 1024
+    shaper = BandwidthShaper(rate=rate)
+    senders = [('greedy', 8), ('single', 1), ('pair', 2)]
+    sent = [0] * sum(count for _, count in senders)
+    deadline = time.monotonic() + args.shaping_duration
+    threads = []
+    for key, count in senders:
+        for _ in range(count):
+            threads.append(threading.Thread(target=shaped_sender,
+                                            args=(shaper, key, deadline, chunk, sent, len(threads))))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f"Global cap {rate / 1024 / 1024:.0f} MB/s for {args.shaping_duration:.0f} s:")
+    print(f"{'user':>10} {'transfers':>10} {'MB/s':>7} {'share':>7}")
+    total = sum(sent)
+    index = 0
+    for key, count in senders:
+        user_bytes = sum(sent[index:index + count])
+        index += count
+        print(f"{key:>10} {count:>10} {user_bytes / args.shaping_duration / 1024 / 1024:>7.2f} "
+              f"{user_bytes / total:>7.1%}")
+    print(f"{'total':>10} {len(threads):>10} {total / args.shaping_duration / 1024 / 1024:>7.2f}")
+    print()
+
+def bench_metrics(args):
+    """Measure the cost of recording a request and of rendering /metrics"""
+    print("📈 REQUEST METRICS")
+    print("-" * 60)
+    metrics = RequestMetrics()
+    routes = [f"/route/{index}" for index in range(args.metrics_routes)]
+    count = 100000
+    start = time.perf_counter()
+    for index in range(count):
+        metrics.observe(routes[index % len(routes)], 'GET', 200, (index % 1000) / 10000, 1024)
+    elapsed = time.perf_counter() - start
+    print(f"Record: {elapsed / count * 1e6:.2f} µs per request")
+
+    start = time.perf_counter()
+    lines = metrics.render()
+    elapsed = time.perf_counter() - start
+    print(f"Render: {elapsed * 1000:.2f} ms for {len(routes)} routes ({len(lines)} lines)")
+    print()
+
+BENCHMARKS = {
+    'index': bench_index,
+    'presence': bench_presence,
+    'listing': bench_listing,
+    'upload': bench_upload,
+    'serving': bench_serving,
+    'workers': bench_workers,
+    'slow-clients': bench_slow_clients,
+    'event-streams': bench_event_streams,
+    'activity': bench_activity,
+    'delta': bench_delta,
+    'mirror': bench_mirror,
+    'proxy': bench_proxy,
+    'shaping': bench_shaping,
+    'metrics': bench_metrics,
+}
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='LAN File Sharing benchmarks')
+    parser.add_argument('benchmark', nargs='*',
+                        help=f"Benchmarks to run: {', '.join(sorted(BENCHMARKS))} (default: all)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Directory sizes for the listing benchmark')
+    parser.add_argument('--upload-size', type=int, default=256, metavar='MB',
+                        help='Size of the file used by the upload benchmark')
+    parser.add_argument('--download-size', type=int, default=1024, metavar='MB',
+                        help='Size of the file used by the serving benchmark')
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 1000, 5000],
+                        help='Connected client counts for the presence benchmark')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Requests per version for the index benchmark')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='Worker process counts for the workers benchmark')
+    parser.add_argument('--connections', type=int, default=16,
+                        help='Concurrent client connections for the workers benchmark')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds of load per worker count in the workers benchmark')
+    parser.add_argument('--slow-clients', type=int, default=1000,
+                        help='Concurrent downloads in the slow-clients benchmark')
+    parser.add_argument('--slow-rate', type=int, default=16, metavar='KB',
+                        help='Download speed of each slow client in KB/s')
+    parser.add_argument('--sse-clients', type=int, default=500,
+                        help='Open /api/events streams in the event-streams benchmark')
+    parser.add_argument('--activity-rows', type=int, default=1000000,
+                        help='Activities in the log for the activity benchmark')
+    parser.add_argument('--delta-size', type=int, default=256, metavar='MB',
+                        help='Size of the file used by the delta benchmark')
+    parser.add_argument('--mirror-files', type=int, default=500,
+                        help='Files in the share mirrored by the mirror benchmark')
+    parser.add_argument('--proxy-size', type=int, default=64, metavar='MB',
+                        help='Size of the file downloaded by the proxy benchmark')
+    parser.add_argument('--shaping-duration', type=float, default=5, metavar='SECONDS',
+                        help='Seconds of simulated transfers in the shaping benchmark')
+    parser.add_argument('--metrics-routes', type=int, default=50,
+                        help='Routes recorded in the metrics benchmark (default: 50)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per measurement, best time is reported')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmark if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    print("=" * 60)
+    print("⏱️  LAN FILE SHARING BENCHMARKS")
+    print("=" * 60)
+    for name in args.benchmark or sorted(BENCHMARKS):
+        BENCHMARKS[name](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
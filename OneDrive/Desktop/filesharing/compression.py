@@ -0,0 +1,177 @@
+import os
+import gzip
+import time
+import shutil
+import hashlib
+import mimetypes
+import threading
+from utils import DiskLRU
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Files smaller than this are not worth compressing
+min_compress_size = 1024
+
+# Files larger than this are sent as they are rather than compressed on first request
+max_compress_size = 256 * 1024 * 1024
+
+# MIME types that compress well, besides text/*
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'application/x-ndjson',
+    'application/x-sh',
+    'application/sql',
+    'application/x-yaml',
+    'image/svg+xml',
+}
+
+# Read size used when compressing files
+io_buffer_size = 1024 * 1024
+
+# Log files are plain text but have no registered type
+mimetypes.add_type('text/plain', '.log')
+
+def available_encodings():
+    """Return the supported content codings, most preferred first"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+def is_compressible(file_path):
+    """Check whether a file's MIME type is worth compressing"""
+    mimetype = mimetypes.guess_type(file_path)[0]
+    if mimetype is None:
+        # Unknown types may well be binary, so leave them alone
+        return False
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+def compress_file(source_path, target_path, encoding):
+    """Compress source_path into target_path with the given content coding"""
+    with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+        if encoding == 'gzip':
+            with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=6, mtime=0) as out:
+                shutil.copyfileobj(src, out, io_buffer_size)
+        elif encoding == 'zstd':
+            zstandard.ZstdCompressor(level=3).copy_stream(src, dst, read_size=io_buffer_size)
+        elif encoding == 'br':
+            compressor = brotli.Compressor(quality=5)
+            for data in iter(lambda: src.read(io_buffer_size), b''):
+                dst.write(compressor.process(data))
+            dst.write(compressor.finish())
+        else:
+            raise ValueError(f'Unsupported encoding: {encoding}')
+
+class CompressionCache:
+    """Size-bounded on-disk cache of precompressed file variants
+
+    Variants are keyed by the source file's identity (device, inode, size,
+    mtime) and the encoding, so an edited file gets a new key and a hot file
+    is compressed only once. The least recently served variants are evicted
+    when the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.compression_seconds = 0.0
+        self._files = DiskLRU(cache_dir, max_bytes)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def negotiate(self, request, file_path, st):
+        """Pick a content coding for this request and file, or None to send it as is"""
+        if st.st_size < min_compress_size or st.st_size > max_compress_size:
+            return None
+        if not is_compressible(file_path):
+            return None
+        encoding = request.accept_encodings.best_match(available_encodings())
+        return encoding if encoding in available_encodings() else None
+
+    def get(self, file_path, st, encoding):
+        """Return the path of the compressed variant, compressing it on first use
+
+        Returns None when the variant is not smaller than the file itself.
+        """
+        identity = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:{encoding}"
+        name = hashlib.sha1(identity.encode()).hexdigest() + '.' + encoding
+
+        path = self._files.get(name)
+        if path is not None:
+            return self._hit(name, path, st)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+
+        # Concurrent requests for the same variant wait for one compression
+        with key_lock:
+            path = self._files.get(name)
+            if path is not None:
+                return self._hit(name, path, st)
+
+            tmp_path = self._files.temp_path(name)
+            start = time.perf_counter()
+            try:
+                compress_file(file_path, tmp_path, encoding)
+                path = self._files.add(name, tmp_path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            finally:
+                with self._lock:
+                    self._key_locks.pop(name, None)
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.misses += 1
+                self.compression_seconds += elapsed
+                # A variant larger than the whole cache is evicted straight away
+                size = self._files.size(name)
+                if path is None or size is None or size >= st.st_size:
+                    return None
+                self.bytes_saved += st.st_size - size
+        return path
+
+    def discard(self, path):
+        """Unindex a variant that turned out to be missing, e.g. evicted by another worker"""
+        self._files.discard(os.path.basename(path))
+
+    def _hit(self, name, path, st):
+        """Record a cache hit; variants that did not shrink are not served"""
+        size = self._files.size(name)
+        with self._lock:
+            self.hits += 1
+            if size is None or size >= st.st_size:
+                return None
+            self.bytes_saved += st.st_size - size
+        return path
+
+    def stats(self):
+        """Return cache size, hit/miss counters, bytes saved and compression time"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._files),
+                'bytes': self._files.total_bytes,
+                'max_bytes': self._files.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'compression_seconds': round(self.compression_seconds, 3),
+                'encodings': available_encodings()
+            }
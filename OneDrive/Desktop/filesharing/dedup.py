@@ -0,0 +1,188 @@
+import os
+import sys
+import sqlite3
+import hashlib
+import threading
+from utils import try_process_lock, is_partial_upload
+
+# Files smaller than this are not worth deduplicating
+min_dedup_size = 64 * 1024
+
+# Read size used when hashing files
+io_buffer_size = 1024 * 1024
+
+# Linux FICLONE ioctl, clones a file's extents on filesystems that support it
+FICLONE = 0x40049409
+
+def hash_file(path):
+    """Return the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(io_buffer_size), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+def reflink(source, target):
+    """Clone source into target sharing extents (copy-on-write), if supported"""
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+
+def link_duplicate(existing, path):
+    """Replace path with a reflink or hardlink to existing; return the method used"""
+    tmp_path = f"{path}.{threading.get_ident()}.dedup"
+    method = None
+    if reflink(existing, tmp_path):
+        method = 'reflink'
+    else:
+        try:
+            os.link(existing, tmp_path)
+            method = 'hardlink'
+        except OSError:
+            return None
+    os.replace(tmp_path, path)
+    return method
+
+class ContentIndex:
+    """SQLite index of content hashes over the shared folder
+
+    Rows record each file's size and mtime next to its SHA-256, so a stale
+    row (file edited or removed) is detected with one stat and dropped when
+    it is looked up. Paths are stored relative to the shared folder.
+    """
+
+    def __init__(self, db_path, root):
+        self.root = os.path.abspath(root)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            )''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256, size)')
+        self._db.commit()
+
+    def _relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root).replace('\\', '/')
+
+    def record(self, path, sha256, st=None):
+        """Remember the hash of a file in the share"""
+        st = st or os.stat(path)
+        if st.st_size < min_dedup_size:
+            return
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)',
+                             (self._relative(path), st.st_size, st.st_mtime_ns, sha256))
+            self._db.commit()
+
+    def forget(self, path):
+        """Drop a file from the index"""
+        with self._lock:
+            self._db.execute('DELETE FROM files WHERE path = ?', (self._relative(path),))
+            self._db.commit()
+
+    def find(self, sha256, size, exclude=None):
+        """Return the absolute path of an unchanged file with this content, or None"""
+        with self._lock:
+            rows = self._db.execute('SELECT path, mtime_ns FROM files WHERE sha256 = ? AND size = ?',
+                                    (sha256, size)).fetchall()
+        exclude = os.path.abspath(exclude) if exclude else None
+        for relative, mtime_ns in rows:
+            path = os.path.join(self.root, relative)
+            if path == exclude:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or st.st_size != size or st.st_mtime_ns != mtime_ns:
+                self.forget(path)
+                continue
+            return path
+        return None
+
+    def deduplicate(self, path, sha256):
+        """Record a newly written file, linking it to an identical copy if one exists
+
+        Returns (duplicate_of, method): the existing file's path relative to
+        the share and 'reflink' or 'hardlink', or (None, None) if the file is
+        new or could not be linked.
+        """
+        st = os.stat(path)
+        if st.st_size < min_dedup_size:
+            return None, None
+
+        existing = self.find(sha256, st.st_size, exclude=path)
+        method = link_duplicate(existing, path) if existing else None
+        self.record(path, sha256)
+        if method is None:
+            return None, None
+        return self._relative(existing), method
+
+    def scan(self):
+        """Hash files not yet indexed or changed since they were, and drop vanished ones
+
+        With several worker processes sharing the index only one of them
+        scans; the others return straight away.
+        """
+        lock = try_process_lock(self.db_path + '.lock')
+        if lock is None:
+            return
+        try:
+            self._scan()
+        finally:
+            lock.close()
+
+    def _scan(self):
+        with self._lock:
+            known = {path: (size, mtime_ns) for path, size, mtime_ns
+                     in self._db.execute('SELECT path, size, mtime_ns FROM files')}
+        seen = set()
+        for directory, dirs, files in os.walk(self.root):
+            for name in files:
+                if is_partial_upload(name):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_size < min_dedup_size:
+                    continue
+                relative = self._relative(path)
+                seen.add(relative)
+                if known.get(relative) == (st.st_size, st.st_mtime_ns):
+                    continue
+                try:
+                    self.record(path, hash_file(path), st)
+                except OSError:
+                    continue
+        with self._lock:
+            self._db.executemany('DELETE FROM files WHERE path = ?',
+                                 [(path,) for path in known if path not in seen])
+            self._db.commit()
+
+    def stats(self):
+        """Return the number of indexed files and distinct contents"""
+        with self._lock:
+            files, contents = self._db.execute('SELECT COUNT(*), COUNT(DISTINCT sha256) FROM files').fetchone()
+        return {'files': files, 'distinct_contents': contents}
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,230 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from utils import DiskLRU
+
+# Smallest block of a signature; files are split into at most max_blocks blocks
+min_block_size = 4 * 1024
+max_blocks = 64 * 1024
+
+# Strong hash of a block: BLAKE2b truncated to this many bytes
+strong_size = 16
+
+# Read size used when hashing files
+io_buffer_size = 1024 * 1024
+
+MAGIC = b'FSSIG1'
+RECORD = struct.Struct(f'>I{strong_size}s')
+
+# Adler-32 modulus, for rolling the weak hash one byte at a time
+ADLER_MOD = 65521
+
+def block_size_for(size):
+    """Pick a power-of-two block size giving at most max_blocks blocks"""
+    block_size = min_block_size
+    while block_size * max_blocks < size:
+        block_size *= 2
+    return block_size
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=strong_size).digest()
+
+def compute_signature(file_path, target_path, etag):
+    """Write the block signature manifest of a file to target_path
+
+    The manifest is MAGIC, a JSON header line (size, block_size, sha256 of
+    the whole file and the file's ETag) and one RECORD per block holding its
+    Adler-32 weak hash and truncated BLAKE2b strong hash.
+    """
+    size = os.path.getsize(file_path)
+    block_size = block_size_for(size)
+    digest = hashlib.sha256()
+    records = []
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+            records.append(RECORD.pack(zlib.adler32(block), strong_hash(block)))
+
+    header = {'size': size, 'block_size': block_size, 'sha256': digest.hexdigest(), 'etag': etag}
+    with open(target_path, 'wb') as f:
+        f.write(MAGIC + json.dumps(header).encode() + b'\n')
+        f.write(b''.join(records))
+
+def parse_signature(data):
+    """Return (header, [(weak, strong), ...]) from manifest bytes, raising ValueError if malformed"""
+    if not data.startswith(MAGIC):
+        raise ValueError('Not a signature manifest')
+    end = data.find(b'\n')
+    if end < 0:
+        raise ValueError('Truncated signature manifest')
+    header = json.loads(data[len(MAGIC):end])
+    if not (isinstance(header, dict) and type(header.get('size')) is int and header['size'] >= 0
+            and type(header.get('block_size')) is int and header['block_size'] > 0
+            and isinstance(header.get('sha256'), str) and isinstance(header.get('etag'), str)):
+        raise ValueError('Invalid signature header')
+    body = memoryview(data)[end + 1:]
+    # A manifest cut at a record boundary still has too few records for the size
+    if len(body) != -(-header['size'] // header['block_size']) * RECORD.size:
+        raise ValueError('Truncated signature manifest')
+    return header, list(RECORD.iter_unpack(body))
+
+def match_blocks(old_path, header, blocks):
+    """Find blocks of the new file inside an old copy, returning {block index: old offset}
+
+    Aligned windows are checked first at C speed, so unchanged stretches
+    cost one Adler-32 per block. Where a window does not match, the weak
+    hash is rolled forward a byte at a time (about a microsecond per byte in
+    Python) until the data lines up again, which is what makes inserted or
+    deleted bytes cheap: only the blocks around the edit are lost.
+    """
+    block_size = header['block_size']
+    # The last block may be short; it is only compared in place
+    full_blocks = header['size'] // block_size
+    candidates = {}
+    for index in range(full_blocks):
+        weak, strong = blocks[index]
+        candidates.setdefault(weak, {}).setdefault(strong, []).append(index)
+
+    found = {}
+    old_size = os.path.getsize(old_path)
+    if old_size == 0:
+        return found
+
+    def check(window, position, weak):
+        indices = candidates.get(weak, {}).get(strong_hash(window))
+        if not indices:
+            return False
+        for index in indices:
+            found.setdefault(index, position)
+        return True
+
+    with open(old_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        position = 0
+        while position + block_size <= old_size:
+            window = data[position:position + block_size]
+            weak = zlib.adler32(window)
+            if weak in candidates and check(window, position, weak):
+                position += block_size
+                continue
+
+            # Roll the weak hash until some block of the new file lines up
+            a = weak & 0xffff
+            b = weak >> 16
+            matched = False
+            while position + block_size < old_size:
+                out_byte = data[position]
+                in_byte = data[position + block_size]
+                a = (a - out_byte + in_byte) % ADLER_MOD
+                b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+                position += 1
+                weak = (b << 16) | a
+                if weak in candidates and check(data[position:position + block_size], position, weak):
+                    position += block_size
+                    matched = True
+                    break
+            if not matched:
+                break
+
+        tail = header['size'] - full_blocks * block_size
+        if tail and full_blocks < len(blocks):
+            start = full_blocks * block_size
+            if start + tail <= old_size and strong_hash(data[start:start + tail]) == blocks[full_blocks][1]:
+                found[full_blocks] = start
+    return found
+
+def missing_ranges(header, block_count, found):
+    """Group blocks not found locally into inclusive (start, end) byte ranges"""
+    block_size = header['block_size']
+    ranges = []
+    for index in range(block_count):
+        if index in found:
+            continue
+        start = index * block_size
+        end = min(start + block_size, header['size']) - 1
+        if ranges and ranges[-1][1] == start - 1:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+class SignatureCache:
+    """Size-bounded on-disk cache of block signature manifests
+
+    Manifests are keyed by the file's identity (device, inode, size, mtime),
+    so each version of a file is hashed once; concurrent requests for the
+    same version wait for a single computation. The least recently served
+    manifests are evicted when the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024):
+        self.hits = 0
+        self.misses = 0
+        self.hashing_seconds = 0.0
+        # The newest manifest is kept even if it alone exceeds the limit
+        self._files = DiskLRU(cache_dir, max_bytes, keep_newest=True)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, file_path, st, etag):
+        """Return the path of the file's manifest, computing it on first use
+
+        A manifest another worker evicted is computed again.
+        """
+        identity = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+        name = hashlib.sha1(identity.encode()).hexdigest() + '.sig'
+
+        with self._lock:
+            path = self._files.get(name)
+            if path is not None:
+                self.hits += 1
+                return path
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                path = self._files.get(name)
+                if path is not None:
+                    self.hits += 1
+                    return path
+
+            tmp_path = self._files.temp_path(name)
+            start = time.perf_counter()
+            try:
+                compute_signature(file_path, tmp_path, etag)
+                path = self._files.add(name, tmp_path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            finally:
+                with self._lock:
+                    self._key_locks.pop(name, None)
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.misses += 1
+                self.hashing_seconds += elapsed
+        return path
+
+    def discard(self, path):
+        """Unindex a manifest that turned out to be missing"""
+        self._files.discard(os.path.basename(path))
+
+    def stats(self):
+        """Return cache size, hit/miss counters and hashing time"""
+        with self._lock:
+            return {
+                'entries': len(self._files),
+                'bytes': self._files.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hashing_seconds': round(self.hashing_seconds, 3)
+            }
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Delta sync client for the LAN File Sharing Web App
+Updates a local copy of a shared file by downloading only the blocks that changed.
+"""
+
+import os
+import sys
+import mmap
+import time
+import hashlib
+import argparse
+from urllib.parse import quote
+import requests
+from delta import parse_signature, match_blocks, missing_ranges
+
+# Read size used when copying local blocks and streaming fetched ones
+io_buffer_size = 1024 * 1024
+
+class DeltaSyncError(Exception):
+    """Raised when the remote file cannot be reconstructed"""
+
+def fetch_signature(session, base_url, remote_path):
+    """Download and parse the block signature manifest of a remote file"""
+    response = session.get(f"{base_url}/api/signature/{quote(remote_path)}", timeout=600)
+    if response.status_code != 200:
+        raise DeltaSyncError(f"Signature request failed: HTTP {response.status_code}")
+    try:
+        return parse_signature(response.content)
+    except ValueError as e:
+        raise DeltaSyncError(str(e))
+
+def delta_sync(base_url, remote_path, local_path, output_path=None, session=None):
+    """Bring output_path up to date with the remote file, reusing blocks of local_path
+
+    Returns a dict with the bytes reused from the local copy, the bytes
+    downloaded, the number of range requests and the elapsed time. The result
+    is checked against the SHA-256 in the manifest before it replaces
+    output_path (local_path by default).
+    """
+    start = time.perf_counter()
+    session = session or requests.Session()
+    output_path = output_path or local_path
+    header, blocks = fetch_signature(session, base_url.rstrip('/'), remote_path)
+    block_size = header['block_size']
+
+    found = match_blocks(local_path, header, blocks) if os.path.isfile(local_path) else {}
+    ranges = missing_ranges(header, len(blocks), found)
+    fetched = {start: end for start, end in ranges}
+
+    digest = hashlib.sha256()
+    downloaded = 0
+    tmp_path = f"{output_path}.delta-tmp"
+    old = open(local_path, 'rb') if found else None
+    old_data = None
+    try:
+        if old:
+            old_data = mmap.mmap(old.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(tmp_path, 'wb') as out:
+            index = 0
+            while index < len(blocks):
+                position = index * block_size
+                if position in fetched:
+                    end = fetched[position]
+                    # If-Range makes the server send the whole file instead if it changed
+                    response = session.get(f"{base_url.rstrip('/')}/download/{quote(remote_path)}",
+                                           headers={'Range': f'bytes={position}-{end}',
+                                                    'If-Range': header['etag'],
+                                                    'Accept-Encoding': 'identity'},
+                                           stream=True, timeout=60)
+                    if response.status_code != 206:
+                        response.close()
+                        raise DeltaSyncError('The remote file changed during the sync; run it again')
+                    for data in response.iter_content(io_buffer_size):
+                        digest.update(data)
+                        out.write(data)
+                        downloaded += len(data)
+                    index = end // block_size + 1
+                else:
+                    old_offset = found[index]
+                    length = min(block_size, header['size'] - position)
+                    data = old_data[old_offset:old_offset + length]
+                    digest.update(data)
+                    out.write(data)
+                    index += 1
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        if old_data is not None:
+            old_data.close()
+        if old:
+            old.close()
+
+    if digest.hexdigest() != header['sha256']:
+        os.remove(tmp_path)
+        raise DeltaSyncError('Checksum mismatch after applying the delta')
+    os.replace(tmp_path, output_path)
+    return {
+        'size': header['size'],
+        'block_size': block_size,
+        'reused_bytes': header['size'] - downloaded,
+        'downloaded_bytes': downloaded,
+        'requests': len(ranges),
+        'seconds': round(time.perf_counter() - start, 3)
+    }
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Update a local copy of a shared file by fetching only changed blocks')
+    parser.add_argument('server', help='Server URL, e.g. http://192.168.1.10:8080')
+    parser.add_argument('remote_path', help='Path of the file inside the share')
+    parser.add_argument('local_path', help='Local copy to update (created if missing)')
+    parser.add_argument('--output', '-o', help='Write the new version here instead of over local_path')
+    args = parser.parse_args()
+
+    try:
+        result = delta_sync(args.server, args.remote_path, args.local_path, args.output)
+    except (DeltaSyncError, requests.RequestException, OSError) as e:
+        print(f"❌ {e}")
+        return 1
+
+    size = max(result['size'], 1)
+    print(f"✅ {args.output or args.local_path} is up to date and verified")
+    print(f"   Reused:     {result['reused_bytes']:,} bytes ({result['reused_bytes'] / size:.1%})")
+    print(f"   Downloaded: {result['downloaded_bytes']:,} bytes in {result['requests']} range request(s)")
+    print(f"   Time:       {result['seconds']} s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
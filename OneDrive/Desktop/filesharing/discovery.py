@@ -0,0 +1,236 @@
+import os
+import math
+import atexit
+import json
+import time
+import uuid
+import socket
+import struct
+import tempfile
+import threading
+from utils import try_process_lock
+
+# Where announcements are sent: a multicast group, or a broadcast address
+# such as 255.255.255.255 on networks that drop multicast
+discovery_address = '239.255.42.99'
+discovery_port = 45454
+
+# Seconds between announcements
+announce_interval = 2
+
+# Peers not heard from for this long are dropped from the table
+peer_ttl = 3 * announce_interval + 1
+
+# Announcements larger than this are ignored
+max_datagram = 2048
+
+# Tag carried by every announcement, so unrelated traffic on the port is ignored
+PROTOCOL = 'lan-filesharing/1'
+
+def is_multicast(address):
+    try:
+        return 224 <= socket.inet_aton(address)[0] <= 239
+    except OSError:
+        return False
+
+def parse_announcement(data, sender_ip):
+    """Turn a datagram into a peer record, or None if it is not a valid announcement"""
+    try:
+        message = json.loads(data)
+        if message.get('protocol') != PROTOCOL:
+            return None
+        peer_port = int(message['port'])
+        if not 0 < peer_port < 65536:
+            return None
+        load = float(message.get('load') or 0)
+        # json accepts NaN and Infinity, which pages could not parse back
+        if not math.isfinite(load):
+            return None
+        return {
+            'id': str(message['id'])[:64],
+            'name': str(message.get('name') or sender_ip)[:100],
+            'ip': sender_ip,
+            'port': peer_port,
+            'url': f"http://{sender_ip}:{peer_port}",
+            'share': str(message['share'])[:200] if message.get('share') else None,
+            'users': int(message.get('users') or 0),
+            'load': load,
+            'bye': bool(message.get('bye'))
+        }
+    except (ValueError, TypeError, KeyError, AttributeError, OverflowError):
+        return None
+
+class PeerDirectory:
+    """Peers heard on the network, each dropped ttl seconds after its last announcement"""
+
+    def __init__(self, ttl=peer_ttl):
+        self.ttl = ttl
+        self.announcements = 0
+        self._peers = {}
+        self._lock = threading.Lock()
+
+    def update(self, peer, now=None):
+        """Record an announcement from a peer"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.announcements += 1
+            self._peers[peer['id']] = (now, peer)
+
+    def remove(self, peer_id):
+        """Forget a peer that said goodbye"""
+        with self._lock:
+            self._peers.pop(peer_id, None)
+
+    def expire(self, now=None):
+        """Drop peers that have gone quiet"""
+        deadline = (time.monotonic() if now is None else now) - self.ttl
+        with self._lock:
+            for peer_id in [peer_id for peer_id, (seen, _) in self._peers.items() if seen < deadline]:
+                del self._peers[peer_id]
+
+    def get(self, peer_id):
+        """Return a live peer by id, or None"""
+        self.expire()
+        with self._lock:
+            entry = self._peers.get(peer_id)
+        return dict(entry[1]) if entry else None
+
+    def find(self, ip, peer_port):
+        """Return the live peer at ip:port, or None"""
+        for peer in self.peers():
+            if peer['ip'] == ip and peer['port'] == peer_port:
+                return peer
+        return None
+
+    def peers(self):
+        """Return the live peers by name, with seconds since each was heard"""
+        now = time.monotonic()
+        self.expire(now)
+        with self._lock:
+            entries = list(self._peers.values())
+        peers = [dict(peer, age=round(now - seen, 1)) for seen, peer in entries]
+        for peer in peers:
+            peer.pop('bye', None)
+        return sorted(peers, key=lambda peer: (peer['name'].lower(), peer['ip'], peer['port']))
+
+    def stats(self):
+        """Return the number of live peers and announcements received"""
+        self.expire()
+        with self._lock:
+            return {'peers': len(self._peers), 'announcements': self.announcements}
+
+class Discovery:
+    """Zero-config peer discovery over UDP multicast (or broadcast)
+
+    Every server process listens for announcements and keeps a PeerDirectory,
+    so pages read the peer list from memory without probing anyone. One
+    process per port announces this server every announce_interval seconds
+    with its name, share and load; status() supplies those fields. Several
+    instances on one machine each announce their own port and hear each
+    other, since every listener binds the port with SO_REUSEADDR.
+    """
+
+    def __init__(self, port, status, address=None, udp_port=None):
+        self.port = port
+        self.status = status
+        self.address = address or discovery_address
+        self.udp_port = udp_port or discovery_port
+        self.instance_id = uuid.uuid4().hex
+        self.directory = PeerDirectory()
+        self.enabled = True
+        self.error = None
+        self._pid = None
+        self._announcer = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start listening and announcing in this process (once per process)"""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            try:
+                listener = self._listen_socket()
+            except OSError as e:
+                self.error = f"Discovery unavailable: {e}"
+                print(f"⚠️  {self.error}")
+                return
+            threading.Thread(target=self._listen, args=(listener,), name='discovery-listen', daemon=True).start()
+            self._announcer = threading.Thread(target=self._announce, name='discovery-announce', daemon=True)
+            self._announcer.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop announcing and tell peers this server is gone"""
+        self._stop.set()
+        if self._announcer is not None and self._pid == os.getpid():
+            self._announcer.join(1)
+
+    def _listen_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.udp_port))
+        if is_multicast(self.address):
+            membership = struct.pack('4s4s', socket.inet_aton(self.address), socket.inet_aton('0.0.0.0'))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.settimeout(announce_interval)
+        return sock
+
+    def _send_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        if is_multicast(self.address):
+            # Stay on the local network, and let instances on this machine hear us
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        return sock
+
+    def _listen(self, sock):
+        while not self._stop.is_set():
+            try:
+                data, (sender_ip, _) = sock.recvfrom(max_datagram)
+            except OSError:
+                # Timeouts included; the loop only wakes to notice stop()
+                continue
+            peer = parse_announcement(data, sender_ip)
+            if peer is None or peer['id'] == self.instance_id:
+                continue
+            if peer['bye']:
+                self.directory.remove(peer['id'])
+            else:
+                self.directory.update(peer)
+        sock.close()
+
+    def announcement(self, bye=False):
+        """Return the datagram announcing this server"""
+        message = dict(self.status(), protocol=PROTOCOL, id=self.instance_id, port=self.port)
+        if bye:
+            message['bye'] = True
+        return json.dumps(message).encode()
+
+    def _announce(self):
+        lock_path = os.path.join(tempfile.gettempdir(), 'filesharing-discovery', f'{self.port}.lock')
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        sock = self._send_socket()
+        lock = None
+        while True:
+            # Worker processes of one server take turns; only the lock holder announces
+            if lock is None:
+                lock = try_process_lock(lock_path)
+            if lock is not None:
+                try:
+                    sock.sendto(self.announcement(bye=self._stop.is_set()), (self.address, self.udp_port))
+                except OSError:
+                    pass
+            if self._stop.is_set():
+                break
+            self._stop.wait(announce_interval)
+        sock.close()
+        if lock is not None:
+            lock.close()
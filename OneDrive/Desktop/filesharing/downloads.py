@@ -0,0 +1,297 @@
+import os
+import mimetypes
+import uuid
+from urllib.parse import quote
+from flask import Response
+from werkzeug.http import parse_range_header, http_date, is_resource_modified
+from werkzeug.wsgi import wrap_file
+
+# Read size used when streaming file bodies
+chunk_size = 64 * 1024
+
+# Requests asking for more ranges than this get the whole file instead
+max_ranges = 64
+
+# How file bodies are delivered:
+#   'python'     - read and yield chunks from Python (works everywhere)
+#   'sendfile'   - hand the open file to the server's wsgi.file_wrapper, which
+#                  servers such as gunicorn turn into os.sendfile (falls back
+#                  to 'python' when the server has no file wrapper)
+#   'x-sendfile' - empty body with an X-Sendfile header for Apache/lighttpd
+#   'x-accel'    - empty body with an X-Accel-Redirect header for nginx
+SERVE_MODES = ('python', 'sendfile', 'x-sendfile', 'x-accel')
+serve_mode = 'python'
+
+# Internal nginx location that maps to the shared folder, used by 'x-accel'
+accel_redirect_prefix = '/protected-files/'
+
+def file_etag(st, encoding=None):
+    """Build a strong ETag from a file's inode, size, mtime and content coding"""
+    suffix = f'-{encoding}' if encoding else ''
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}{suffix}"'
+
+def not_modified_response(request, etag, mtime, headers=None):
+    """Return a 304 response if If-None-Match/If-Modified-Since match, else None
+
+    If-None-Match takes precedence over If-Modified-Since, as required by
+    RFC 9110; only GET and HEAD are answered with 304.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if not (request.headers.get('If-None-Match') or request.headers.get('If-Modified-Since')):
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=http_date(int(mtime))):
+        return None
+    response = Response(status=304, headers=headers or {})
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(int(mtime))
+    return response
+
+def content_disposition(filename):
+    """Build an attachment Content-Disposition header that survives non-ASCII names"""
+    ascii_name = filename.encode('ascii', 'replace').decode().replace('"', '')
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+def resolve_ranges(range_header, size):
+    """Turn a Range header into a list of inclusive (start, end) byte ranges
+
+    Returns None when the header should be ignored and the whole file sent,
+    and an empty list when none of the ranges can be satisfied.
+    """
+    parsed = parse_range_header(range_header)
+    if parsed is None or parsed.units != 'bytes' or len(parsed.ranges) > max_ranges:
+        return None
+
+    ranges = []
+    for start, stop in parsed.ranges:
+        if start < 0:
+            # Suffix range: the last -start bytes
+            start = max(size + start, 0)
+            stop = size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            ranges.append((start, stop - 1))
+    return ranges
+
+def if_range_matches(if_range, etag, st):
+    """Check an If-Range validator against the current file version"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Weak validators never match for range requests
+        return if_range == etag
+    return if_range == http_date(int(st.st_mtime))
+
+def read_ranges(file_path, ranges):
+    """Yield the bytes of each inclusive (start, end) range of a file"""
+    with open(file_path, 'rb') as f:
+        yield from read_file_ranges(f, ranges)
+
+def read_file_ranges(f, ranges):
+    """Yield the bytes of each inclusive (start, end) range of an open file"""
+    for start, end in ranges:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+
+class FileBody:
+    """Response body made of literal byte strings and (path, start, end) file ranges
+
+    Iterating it reads the ranges like read_ranges(), so any WSGI server can
+    send it. The ASGI entry point recognises it and streams the ranges from
+    the event loop instead of holding a thread for the whole transfer.
+
+    files maps paths to files already opened for them. Cache entries that
+    another worker process may delete are opened before the headers are
+    sent, so the body cannot go missing once the response has started.
+    """
+
+    def __init__(self, parts, files=None):
+        self.parts = parts
+        self.files = files or {}
+        self.shaper = None
+        self.shaping_key = None
+
+    def open(self, path):
+        """Return a file object for path, reopening the one opened up front if there is one"""
+        f = self.files.get(path)
+        # A duplicate descriptor, so every range of a multipart body can read it
+        return open(os.dup(f.fileno()), 'rb') if f is not None else open(path, 'rb')
+
+    def close(self):
+        """Close files opened up front that were never read, e.g. for HEAD"""
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+    def shape(self, shaper, key):
+        """Send the body no faster than a BandwidthShaper allows key"""
+        self.shaper = shaper
+        self.shaping_key = key
+
+    def __iter__(self):
+        transfer = self.shaper.open(self.shaping_key) if self.shaper is not None else None
+        try:
+            for part in self.parts:
+                if isinstance(part, bytes):
+                    if transfer is not None:
+                        transfer.throttle(len(part))
+                    yield part
+                    continue
+                with self.open(part[0]) as f:
+                    for data in read_file_ranges(f, [part[1:]]):
+                        if transfer is not None:
+                            transfer.throttle(len(data))
+                        yield data
+        finally:
+            if transfer is not None:
+                transfer.close()
+
+def multipart_body(file_path, ranges, size, content_type, boundary, files=None):
+    """Return a multipart/byteranges body for the given ranges"""
+    parts = []
+    for start, end in ranges:
+        parts.append(multipart_part_header(start, end, size, content_type, boundary))
+        parts.append((file_path, start, end))
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return FileBody(parts, files)
+
+def multipart_part_header(start, end, size, content_type, boundary):
+    """Return the encoded header block that precedes one part"""
+    return (f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode()
+
+def multipart_length(ranges, size, content_type, boundary):
+    """Compute the exact Content-Length of a multipart/byteranges body"""
+    length = len(f'--{boundary}--\r\n')
+    for start, end in ranges:
+        length += len(multipart_part_header(start, end, size, content_type, boundary))
+        length += end - start + 1 + 2
+    return length
+
+def file_body(request, file_path, start, end, size, files=None):
+    """Return the body for one byte range, zero-copy when the server allows it
+
+    Generic file wrappers send from the current offset to end of file, so the
+    wrapper is only used for ranges that run to the end (full downloads and
+    resumed downloads). files are passed on to FileBody.
+    """
+    body = FileBody([(file_path, start, end)], files)
+    if serve_mode == 'sendfile' and end == size - 1 and 'wsgi.file_wrapper' in request.environ:
+        f = body.open(file_path)
+        body.close()
+        f.seek(start)
+        return wrap_file(request.environ, f, chunk_size)
+    return body
+
+def open_cached(path):
+    """Open a cache entry and return (file, size), or (None, None) if it is gone"""
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None, None
+    return f, os.fstat(f.fileno()).st_size
+
+def offload_response(file_path, relative_path, headers, content_type):
+    """Let the front proxy send the file, which also handles Range itself"""
+    if serve_mode == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(file_path)
+    else:
+        headers['X-Accel-Redirect'] = accel_redirect_prefix.rstrip('/') + '/' + quote(relative_path.lstrip('/'))
+    return Response(status=200, headers=headers, mimetype=content_type)
+
+def send_file_ranges(request, file_path, download_name=None, relative_path=None, compressor=None,
+                     offload=True, file=None):
+    """Serve a file honouring Range and If-Range, including multi-range requests
+
+    relative_path is the file's path inside the shared folder, needed when
+    serve_mode hands the transfer to a proxy via X-Accel-Redirect; pass
+    offload=False for files outside it. When a compressor (a CompressionCache)
+    is given, whole-file requests may be answered with a cached compressed
+    variant. file is file_path already opened, for cache entries that
+    another worker process may delete; the caller closes it.
+    """
+    st = os.fstat(file.fileno()) if file is not None else os.stat(file_path)
+    files = {file_path: file} if file is not None else None
+    size = st.st_size
+    content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+    encoding = None
+    offloaded = offload and serve_mode in ('x-sendfile', 'x-accel')
+    if compressor is not None and not offloaded and not request.headers.get('Range'):
+        encoding = compressor.negotiate(request, file_path, st)
+    etag = file_etag(st, encoding)
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': http_date(int(st.st_mtime)),
+        # Clients may keep a copy but must revalidate it, which is a cheap 304
+        'Cache-Control': 'no-cache',
+        'Content-Disposition': content_disposition(download_name or os.path.basename(file_path))
+    }
+
+    if compressor is not None:
+        headers['Vary'] = 'Accept-Encoding'
+
+    not_modified = not_modified_response(request, etag, st.st_mtime, {'Cache-Control': 'no-cache'})
+    if not_modified is not None:
+        return not_modified
+
+    if encoding:
+        variant_path = compressor.get(file_path, st, encoding)
+        variant, variant_size = open_cached(variant_path) if variant_path is not None else (None, None)
+        if variant is not None:
+            headers['Content-Encoding'] = encoding
+            headers['Content-Length'] = str(variant_size)
+            return Response(FileBody([(variant_path, 0, variant_size - 1)], {variant_path: variant}),
+                            status=200, headers=headers, mimetype=content_type,
+                            direct_passthrough=True)
+        if variant_path is not None:
+            # Evicted by another worker since it was looked up; the next
+            # request compresses it again
+            compressor.discard(variant_path)
+        # Send the file as it is
+        etag = headers['ETag'] = file_etag(st)
+
+    if offloaded:
+        return offload_response(file_path, relative_path or os.path.basename(file_path),
+                                headers, content_type)
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header and if_range_matches(request.headers.get('If-Range'), etag, st):
+        ranges = resolve_ranges(range_header, size)
+
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        return Response(file_body(request, file_path, 0, size - 1, size, files) if size else [],
+                        status=200, headers=headers, mimetype=content_type,
+                        direct_passthrough=True)
+
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        headers['Content-Length'] = str(end - start + 1)
+        return Response(file_body(request, file_path, start, end, size, files), status=206, headers=headers,
+                        mimetype=content_type, direct_passthrough=True)
+
+    boundary = uuid.uuid4().hex
+    headers['Content-Length'] = str(multipart_length(ranges, size, content_type, boundary))
+    return Response(multipart_body(file_path, ranges, size, content_type, boundary, files),
+                    status=206, headers=headers,
+                    content_type=f'multipart/byteranges; boundary={boundary}',
+                    direct_passthrough=True)
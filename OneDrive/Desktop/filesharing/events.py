@@ -0,0 +1,236 @@
+import json
+import time
+import asyncio
+import threading
+from collections import deque
+
+# Events kept for clients that reconnect with Last-Event-ID
+history_size = 1000
+
+# Reconnect delay suggested to EventSource clients, in milliseconds
+retry_ms = 3000
+
+def format_event(event_id, event, data):
+    """Encode one Server-Sent Event"""
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+class EventBroker:
+    """Fan-out of server events to Server-Sent Events subscribers
+
+    Published events get increasing ids and are kept in a ring buffer, so a
+    client that reconnects with Last-Event-ID is sent what it missed. When
+    the id has already fallen out of the buffer the client is told to
+    reset and reload its state instead.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._history = deque(maxlen=history_size)
+        self._last_id = 0
+        self._subscribers_lock = threading.Lock()
+        self._listeners = set()
+        self.subscribers = 0
+
+    # Seconds between checks for events published by other processes (None:
+    # every event is published in this process and wakes streams directly)
+    poll_interval = None
+
+    def publish(self, event, data):
+        """Send an event to every subscriber and return its id"""
+        payload = json.dumps(data, separators=(',', ':'))
+        with self._condition:
+            self._last_id += 1
+            self._history.append((self._last_id, event, payload))
+            self._condition.notify_all()
+            event_id = self._last_id
+        self._notify()
+        return event_id
+
+    def _notify(self):
+        """Wake the streams running on an event loop"""
+        with self._subscribers_lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def last_id(self):
+        """Return the id of the most recent event"""
+        with self._condition:
+            return self._last_id
+
+    def _since(self, last_id):
+        """Return buffered events after last_id, or None if some were dropped"""
+        with self._condition:
+            if not self._history or last_id >= self._last_id:
+                return []
+            if last_id < self._history[0][0] - 1:
+                return None
+            return [entry for entry in self._history if entry[0] > last_id]
+
+    def _wait(self, last_id, timeout):
+        """Block until an event after last_id is published or timeout passes"""
+        with self._condition:
+            if self._last_id == last_id:
+                self._condition.wait(timeout)
+
+    def stream(self, last_event_id=None, heartbeat=15, on_heartbeat=None, on_close=None):
+        """Return an SSE stream, replaying from last_event_id and pinging every heartbeat seconds
+
+        on_heartbeat is called on each ping, which lets the caller treat an
+        open stream as a sign of life; on_close is called once when the
+        stream ends.
+        """
+        # Position is taken now rather than on first iteration, so nothing
+        # published while the response is being set up is missed
+        latest = self.last_id()
+        restarted = False
+        try:
+            last_id = int(last_event_id) if last_event_id else latest
+        except ValueError:
+            last_id = latest
+        if last_id > latest:
+            # The server restarted and ids began again
+            last_id = latest
+            restarted = True
+        return EventStream(self, last_id, restarted, heartbeat, on_heartbeat, on_close)
+
+    def _advance(self, last_id, pending):
+        """Return the new position and the text to send for pending events (None if nothing)"""
+        if pending is None:
+            last_id = self.last_id()
+            return last_id, format_event(last_id, 'reset', '{}')
+        if pending:
+            return pending[-1][0], ''.join(format_event(*entry) for entry in pending)
+        return last_id, None
+
+    def _stream(self, last_id, restarted, heartbeat, on_heartbeat):
+        with self._subscribers_lock:
+            self.subscribers += 1
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            if restarted:
+                yield format_event(last_id, 'reset', '{}')
+            next_ping = time.monotonic() + heartbeat
+            while True:
+                pending = self._since(last_id)
+                if pending == []:
+                    self._wait(last_id, max(0, next_ping - time.monotonic()))
+                    pending = self._since(last_id)
+
+                last_id, data = self._advance(last_id, pending)
+                if data:
+                    yield data
+
+                if time.monotonic() >= next_ping:
+                    next_ping = time.monotonic() + heartbeat
+                    if on_heartbeat is not None:
+                        on_heartbeat()
+                    # A comment line keeps proxies and the connection alive
+                    yield ": ping\n\n"
+        finally:
+            with self._subscribers_lock:
+                self.subscribers -= 1
+
+    async def _astream(self, last_id, restarted, heartbeat, on_heartbeat):
+        """The same stream as _stream, waiting on the event loop instead of in a thread"""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def listener():
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # The loop has been closed
+                pass
+
+        with self._subscribers_lock:
+            self.subscribers += 1
+            self._listeners.add(listener)
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            if restarted:
+                yield format_event(last_id, 'reset', '{}')
+            next_ping = time.monotonic() + heartbeat
+            while True:
+                wakeup.clear()
+                pending = await self._asince(last_id)
+                if pending == []:
+                    timeout = max(0, next_ping - time.monotonic())
+                    if self.poll_interval is not None:
+                        timeout = min(timeout, self.poll_interval)
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    pending = await self._asince(last_id)
+
+                last_id, data = self._advance(last_id, pending)
+                if data:
+                    yield data
+
+                if time.monotonic() >= next_ping:
+                    next_ping = time.monotonic() + heartbeat
+                    if on_heartbeat is not None:
+                        await loop.run_in_executor(None, on_heartbeat)
+                    yield ": ping\n\n"
+        finally:
+            with self._subscribers_lock:
+                self.subscribers -= 1
+                self._listeners.discard(listener)
+
+    async def _asince(self, last_id):
+        if self.poll_interval is None:
+            return self._since(last_id)
+        # Reads shared storage; keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self._since, last_id)
+
+    def stats(self):
+        """Return the subscriber count and the id of the last event"""
+        return {'subscribers': self.subscribers, 'last_event_id': self.last_id()}
+
+class EventStream:
+    """SSE response body, iterated in a thread by WSGI servers or on the event loop by asgi.py
+
+    Iterating it blocks the calling thread between events, so under a
+    threaded server every open page holds a thread. asgi.py instead drives
+    aiter(), which waits on the event loop and holds no thread at all.
+    on_data(nbytes), if set, is called for every chunk either way produces.
+    """
+
+    def __init__(self, broker, last_id, restarted, heartbeat, on_heartbeat=None, on_close=None):
+        self.broker = broker
+        self.last_id = last_id
+        self.restarted = restarted
+        self.heartbeat = heartbeat
+        self.on_heartbeat = on_heartbeat
+        self.on_close = on_close
+        self.on_data = None
+        self._iterator = None
+
+    def _sent(self, data):
+        if self.on_data is not None:
+            self.on_data(len(data))
+        return data
+
+    def __iter__(self):
+        self._iterator = self.broker._stream(self.last_id, self.restarted, self.heartbeat, self.on_heartbeat)
+        return (self._sent(data.encode()) for data in self._iterator)
+
+    def aiter(self):
+        """Return the stream as an async generator of bytes"""
+        async def encoded():
+            stream = self.broker._astream(self.last_id, self.restarted, self.heartbeat, self.on_heartbeat)
+            try:
+                async for data in stream:
+                    yield self._sent(data.encode())
+            finally:
+                await stream.aclose()
+        return encoded()
+
+    def close(self):
+        if self._iterator is not None:
+            self._iterator.close()
+            self._iterator = None
+        if self.on_close is not None:
+            on_close, self.on_close = self.on_close, None
+            on_close()
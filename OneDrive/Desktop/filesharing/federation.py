@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
+from utils import DiskLRU
+
+# Seconds a remote listing is served without asking the peer again; after
+# that it is revalidated with its ETag, which costs a 304 when nothing changed
+listing_ttl = 5
+
+# Keep-alive connections kept open to each peer
+connections_per_peer = 8
+
+# Bytes read from a peer per step when streaming a download through
+stream_chunk_size = 64 * 1024
+
+# Largest remote file copied into the disk cache on its first download
+max_cached_file_size = 256 * 1024 * 1024
+
+# Request headers passed on to the peer, and response headers passed back
+FORWARDED_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+FORWARDED_RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges',
+                              'ETag', 'Last-Modified', 'Content-Disposition', 'Cache-Control')
+
+class PeerError(Exception):
+    """Raised when a peer cannot be reached or answers with an error"""
+
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+class PeerSessions:
+    """One pooled keep-alive requests.Session per peer"""
+
+    def __init__(self, max_connections=connections_per_peer):
+        self.max_connections = max_connections
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, base_url):
+        with self._lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[base_url] = session
+            return session
+
+    def stats(self):
+        with self._lock:
+            return {'peers': len(self._sessions)}
+
+class RemoteListingCache:
+    """Bounded LRU cache of remote directory listings with TTL and ETag revalidation
+
+    A listing younger than ttl seconds is served from memory. An older one
+    is revalidated with If-None-Match, so an unchanged folder costs the peer
+    one stat and a 304 rather than a full listing.
+    """
+
+    def __init__(self, sessions, ttl=listing_ttl, max_entries=256):
+        self.sessions = sessions
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, base_url, path):
+        """Return the entries of a remote folder, raising PeerError if it cannot be listed"""
+        key = (base_url, path)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and time.monotonic() - cached['fetched'] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached['items']
+
+        headers = {'Accept-Encoding': 'identity'}
+        if cached is not None and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        url = f"{base_url}/api/browse/{quote(path)}" if path else f"{base_url}/api/browse"
+        try:
+            response = self.sessions.get(base_url).get(url, params={'stream': '1'}, headers=headers,
+                                                       stream=True, timeout=30)
+            with response:
+                if response.status_code == 304 and cached is not None:
+                    items = cached['items']
+                elif response.status_code == 200:
+                    items = [json.loads(line) for line in response.iter_lines() if line]
+                    items = [item for item in items if 'error' not in item]
+                elif response.status_code in (403, 404):
+                    raise PeerError('Path not found on the peer', 404)
+                else:
+                    raise PeerError(f'The peer answered HTTP {response.status_code}')
+        except (requests.RequestException, ValueError) as e:
+            raise PeerError(f'Could not reach the peer: {e}')
+
+        with self._lock:
+            if response.status_code == 304:
+                self.revalidated += 1
+            else:
+                self.misses += 1
+            self._entries[key] = {'items': items, 'etag': response.headers.get('ETag'),
+                                  'fetched': time.monotonic()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return items
+
+    def find(self, base_url, path):
+        """Return the listing entry of a remote file, or None"""
+        directory, _, name = path.rpartition('/')
+        for item in self.get(base_url, directory):
+            if item['name'] == name:
+                return item
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses
+            }
+
+class RemoteFileCache:
+    """Size-bounded on-disk LRU cache of files downloaded from peers
+
+    Files are keyed by peer, path, size and mtime as seen in the peer's
+    listing, so a file that changes on the peer is simply fetched again and
+    the old copy ages out. The least recently served files are evicted when
+    the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.hits = 0
+        self.misses = 0
+        self._files = DiskLRU(cache_dir, max_bytes)
+        self._lock = threading.Lock()
+
+    def name_for(self, base_url, path, size, mtime):
+        identity = f"{base_url}\n{path}\n{size}\n{mtime}"
+        # Keep the extension so the cached copy is served with the right type
+        return hashlib.sha1(identity.encode()).hexdigest() + os.path.splitext(path)[1][:16]
+
+    def open(self, name):
+        """Open a cached file and return (path, file), or (None, None) if it is not cached
+
+        The file is opened here because another worker process may evict it
+        at any moment; an open file stays readable after it is deleted.
+        """
+        path = self._files.get(name)
+        f = None
+        if path is not None:
+            try:
+                f = open(path, 'rb')
+            except OSError:
+                self._files.discard(name)
+        with self._lock:
+            if f is None:
+                self.misses += 1
+                return None, None
+            self.hits += 1
+        return path, f
+
+    def temp_path(self, name):
+        return self._files.temp_path(name)
+
+    def add(self, name, tmp_path):
+        """Move a completely downloaded file into the cache"""
+        self._files.add(name, tmp_path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._files),
+                'bytes': self._files.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+def open_remote_file(sessions, base_url, path, request_headers, method='GET'):
+    """Start a streamed download (or a HEAD request) to a peer, raising PeerError if it fails
+
+    The caller must close() the response; until then it holds one of the
+    peer's pooled connections.
+    """
+    headers = {name: request_headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request_headers}
+    # Bytes are relayed and cached as they are, never re-encoded
+    headers['Accept-Encoding'] = 'identity'
+    try:
+        response = sessions.get(base_url).request(method, f"{base_url}/download/{quote(path)}",
+                                                  headers=headers, stream=True, timeout=60)
+    except requests.RequestException as e:
+        raise PeerError(f'Could not reach the peer: {e}')
+    if response.status_code in (403, 404):
+        response.close()
+        raise PeerError('File not found on the peer', 404)
+    if response.status_code >= 400 and response.status_code != 416:
+        response.close()
+        raise PeerError(f'The peer answered HTTP {response.status_code}')
+    return response
+
+def relay(response, cache=None, cache_name=None, expected_size=None):
+    """Yield a peer's response body one chunk at a time, copying it into the cache
+
+    Only one chunk is held at a time, so a slow client slows the transfer
+    from the peer instead of filling memory. The copy is added to the cache
+    only if the whole file arrived. A generator's cleanup only runs once it
+    has started, so callers also close the response when theirs is closed.
+    """
+    tmp_path = cache.temp_path(cache_name) if cache is not None else None
+    out = open(tmp_path, 'wb') if tmp_path else None
+    received = 0
+    complete = False
+    try:
+        for data in response.iter_content(stream_chunk_size):
+            if out is not None:
+                out.write(data)
+            received += len(data)
+            yield data
+        complete = True
+    finally:
+        response.close()
+        if out is not None:
+            out.close()
+            if complete and received == expected_size:
+                cache.add(cache_name, tmp_path)
+            else:
+                os.remove(tmp_path)
@@ -0,0 +1,157 @@
+import time
+import bisect
+import threading
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+def metric(name, kind, help_text, samples):
+    """Render one metric family as Prometheus text lines; samples are (labels, value) pairs"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples]
+    return lines
+
+class RequestMetrics:
+    """Per-route request counts, latency histograms and bytes moved, kept in memory
+
+    Recording a request costs one lock, a bisect and a few additions, so it
+    can run on every request. Latency is the time taken to build the
+    response; the streaming of a download body is not included, since that
+    is bounded by the client's bandwidth rather than by the server.
+    Counters belong to one process, like every other in-memory cache here.
+    """
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = tuple(buckets)
+        self.started_at = time.time()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._requests = {}
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, method, status, seconds, sent=0, received=0):
+        """Record one request that took seconds and moved sent/received body bytes"""
+        index = bisect.bisect_left(self.buckets, seconds)
+        key = (route, method, status)
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + 1
+            latency = self._latency.get(route)
+            if latency is None:
+                # One count per bucket plus +Inf, then the sum of seconds
+                latency = self._latency[route] = [0] * (len(self.buckets) + 1) + [0.0]
+            latency[index] += 1
+            latency[-1] += seconds
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def count_sent(self, nbytes):
+        """Add body bytes of a streamed response as they are sent"""
+        with self._lock:
+            self.bytes_sent += nbytes
+
+    def snapshot(self):
+        """Return the counters as plain data that can be stored and combined with other processes'"""
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'requests': [[route, method, status, count] for (route, method, status), count in self._requests.items()],
+                'latency': {route: list(counts) for route, counts in self._latency.items()}
+            }
+
+    @classmethod
+    def combined(cls, snapshots, buckets=latency_buckets):
+        """Return a RequestMetrics holding the sum of several processes' snapshots
+
+        started_at becomes the earliest start among them.
+        """
+        metrics = cls(buckets)
+        for snapshot in snapshots:
+            metrics.started_at = min(metrics.started_at, snapshot['started_at'])
+            metrics.bytes_sent += snapshot['bytes_sent']
+            metrics.bytes_received += snapshot['bytes_received']
+            for route, method, status, count in snapshot['requests']:
+                key = (route, method, status)
+                metrics._requests[key] = metrics._requests.get(key, 0) + count
+            for route, counts in snapshot['latency'].items():
+                total = metrics._latency.setdefault(route, [0] * (len(metrics.buckets) + 1) + [0.0])
+                for index, count in enumerate(counts):
+                    total[index] += count
+        return metrics
+
+    def uptime(self):
+        return time.time() - self.started_at
+
+    def render(self):
+        """Return request counts and latency histograms as Prometheus text lines"""
+        with self._lock:
+            requests = sorted(self._requests.items())
+            latency = {route: list(counts) for route, counts in self._latency.items()}
+
+        lines = metric('filesharing_http_requests_total', 'counter', 'Requests handled, by route, method and status',
+                       [({'route': route, 'method': method, 'status': status}, count)
+                        for (route, method, status), count in requests])
+        lines += ['# HELP filesharing_http_request_duration_seconds Time taken to build the response, by route',
+                  '# TYPE filesharing_http_request_duration_seconds histogram']
+        for route in sorted(latency):
+            counts = latency[route]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"filesharing_http_request_duration_seconds_bucket"
+                             f"{format_labels({'route': route, 'le': format_value(float(bound))})} {cumulative}")
+            labels = format_labels({'route': route})
+            lines.append(f"filesharing_http_request_duration_seconds_sum{labels} {format_value(counts[-1])}")
+            lines.append(f"filesharing_http_request_duration_seconds_count{labels} {cumulative}")
+        return lines
+
+    def stats(self):
+        """Return request totals and per-route counts and mean latency"""
+        with self._lock:
+            routes = {}
+            for route, counts in self._latency.items():
+                count = sum(counts[:-1])
+                routes[route] = {'requests': count, 'mean_latency': round(counts[-1] / count, 6)}
+            return {
+                'requests': sum(self._requests.values()),
+                'errors': sum(count for (_, _, status), count in self._requests.items() if status >= 500),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'routes': routes
+            }
+
+class CountedBody:
+    """Streamed response body that adds the bytes it yields to RequestMetrics.bytes_sent"""
+
+    def __init__(self, body, metrics):
+        self.body = body
+        self.metrics = metrics
+
+    def __iter__(self):
+        for data in self.body:
+            self.metrics.count_sent(len(data))
+            yield data
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
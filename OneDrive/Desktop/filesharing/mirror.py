@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Mirror client for the LAN File Sharing Web App
+Pulls a remote peer's share (or one folder of it) onto this machine, downloading only new or changed files.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import quote
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.http import http_date
+from utils import is_safe_path, format_size
+
+# Parallel downloads per mirror
+default_workers = 4
+
+# Read size used when streaming downloads to disk
+io_buffer_size = 1024 * 1024
+
+# Local files whose mtime is this close to the remote one count as unchanged
+mtime_tolerance = 0.001
+
+class MirrorError(Exception):
+    """Raised when the remote share cannot be listed"""
+
+class Mirror:
+    """Pull a remote share onto a local folder over pooled keep-alive connections
+
+    The remote tree is walked through the NDJSON /api/browse feed and files
+    are queued for download as they are found, so transfers start before
+    the walk ends. A file is skipped when a local copy with the same size
+    and mtime exists; downloaded files get the remote mtime. Downloads go to
+    a .<mtime>.part file first and an interrupted one is resumed with a Range
+    request, guarded by If-Range so a file changed in the meantime is
+    fetched again from the start. Local files missing on the peer are left
+    alone.
+
+    on_file(path), if given, is called for every file written.
+    """
+
+    def __init__(self, base_url, local_dir, remote_path='', workers=default_workers, on_file=None):
+        self.base_url = base_url.rstrip('/')
+        self.local_dir = os.path.abspath(local_dir)
+        self.remote_path = remote_path.strip('/')
+        self.workers = max(workers, 1)
+        self.on_file = on_file
+        self.session = requests.Session()
+        # One keep-alive connection per worker, reused for every file
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self.state = 'pending'
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.files_found = 0
+        self.files_skipped = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.bytes_resumed = 0
+        self.failures = []
+
+    def _url(self, endpoint, path):
+        return f"{self.base_url}/{endpoint}/{quote(path)}" if path else f"{self.base_url}/{endpoint}"
+
+    def _local_path(self, relative):
+        path = os.path.join(self.local_dir, *relative.split('/'))
+        if not is_safe_path(self.local_dir, os.path.relpath(path, self.local_dir)):
+            raise MirrorError(f"Refusing to write outside the mirror folder: {relative}")
+        return path
+
+    def walk(self):
+        """Yield (relative path, size, mtime) for every file under the remote path"""
+        pending = [self.remote_path]
+        while pending and not self._cancel.is_set():
+            directory = pending.pop()
+            # Closing the response hands its connection back to the pool
+            with self.session.get(self._url('api/browse', directory), params={'stream': '1'},
+                                  stream=True, timeout=30) as response:
+                if response.status_code != 200:
+                    raise MirrorError(f"Listing {directory or '/'} failed: HTTP {response.status_code}")
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    if not isinstance(entry, dict):
+                        raise MirrorError(f"Listing {directory or '/'} is not a file listing")
+                    name = entry.get('name', '')
+                    if 'error' in entry or not name or name in ('.', '..') or '/' in name or '\\' in name:
+                        continue
+                    relative = f"{directory}/{name}" if directory else name
+                    if entry['type'] == 'directory':
+                        pending.append(relative)
+                    elif entry['type'] == 'file':
+                        yield relative, int(entry['size']), float(entry['mtime'])
+
+    def _unchanged(self, path, size, mtime):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return st.st_size == size and abs(st.st_mtime - mtime) <= mtime_tolerance
+
+    def _download(self, relative, size, mtime):
+        """Download one file into place, resuming a partial download; False if cancelled"""
+        path = self._local_path(relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The partial file is named after the version it holds, so a resume
+        # only ever asks the peer to continue that same version
+        part_path = f"{path}.{int(mtime)}.part"
+        for stale in glob.glob(glob.escape(path) + '.*.part'):
+            if stale != part_path and stale[len(path) + 1:-5].isdigit():
+                os.remove(stale)
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Accept-Encoding': 'identity'}
+        if 0 < offset < size:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = http_date(int(mtime))
+        else:
+            offset = 0
+
+        with self.session.get(self._url('download', relative), headers=headers,
+                              stream=True, timeout=60) as response:
+            if response.status_code == 200:
+                # No Range sent, or the file changed since the partial download
+                offset = 0
+            elif response.status_code != 206:
+                raise MirrorError(f"HTTP {response.status_code}")
+            with self._lock:
+                self.bytes_resumed += offset
+                self.bytes_done += offset
+            with open(part_path, 'r+b' if offset else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+                for data in response.iter_content(io_buffer_size):
+                    if self._cancel.is_set():
+                        return False
+                    f.write(data)
+                    with self._lock:
+                        self.bytes_done += len(data)
+
+        if os.path.getsize(part_path) != size:
+            raise MirrorError('Size does not match the listing; the file changed while mirroring')
+        os.utime(part_path, (mtime, mtime))
+        os.replace(part_path, path)
+        if self.on_file is not None:
+            self.on_file(path)
+        return True
+
+    def _run_one(self, relative, size, mtime):
+        if self._cancel.is_set():
+            return
+        try:
+            if not self._download(relative, size, mtime):
+                return
+        except (requests.RequestException, OSError, MirrorError) as e:
+            with self._lock:
+                self.files_failed += 1
+                self.failures.append({'path': relative, 'error': str(e)})
+            return
+        with self._lock:
+            self.files_done += 1
+
+    def run(self):
+        """Mirror the remote tree, returning progress() at the end"""
+        self.state = 'running'
+        self.started_at = time.time()
+        try:
+            os.makedirs(self.local_dir, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='mirror') as pool:
+                futures = set()
+                for relative, size, mtime in self.walk():
+                    if self._cancel.is_set():
+                        break
+                    with self._lock:
+                        self.files_found += 1
+                    if self._unchanged(self._local_path(relative), size, mtime):
+                        with self._lock:
+                            self.files_skipped += 1
+                        continue
+                    with self._lock:
+                        self.bytes_total += size
+                    # Keep the queue short so the walk does not run far ahead
+                    if len(futures) >= self.workers * 4:
+                        _, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    futures.add(pool.submit(self._run_one, relative, size, mtime))
+            self.state = 'cancelled' if self._cancel.is_set() else 'done'
+        except (requests.RequestException, MirrorError, OSError) as e:
+            self.state = 'failed'
+            self.error = str(e)
+        except (ValueError, KeyError, TypeError) as e:
+            # JSON that is not a listing, e.g. from something that is not a peer
+            self.state = 'failed'
+            self.error = f"Invalid listing from the peer: {e!r}"
+        finally:
+            if self.state == 'running':
+                # Never leave a job looking busy after its thread is gone
+                self.state = 'failed'
+                self.error = self.error or 'Mirror stopped unexpectedly'
+            self.finished_at = time.time()
+            self.session.close()
+        return self.progress()
+
+    def cancel(self):
+        """Stop after the chunks being written; partial files are kept for resuming"""
+        self._cancel.set()
+
+    def progress(self):
+        """Return counters, throughput and failures so far"""
+        with self._lock:
+            elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else 0
+            transferred = self.bytes_done - self.bytes_resumed
+            return {
+                'source': self.base_url + ('/' + self.remote_path if self.remote_path else ''),
+                'target': self.local_dir,
+                'state': self.state,
+                'error': self.error,
+                'files_found': self.files_found,
+                'files_skipped': self.files_skipped,
+                'files_done': self.files_done,
+                'files_failed': self.files_failed,
+                'bytes_total': self.bytes_total,
+                'bytes_done': self.bytes_done,
+                'elapsed': round(elapsed, 3),
+                'throughput': round(transferred / elapsed) if elapsed else 0,
+                'failures': list(self.failures[-20:])
+            }
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Mirror a remote LAN File Sharing peer onto this machine')
+    parser.add_argument('server', help='Peer URL, e.g. http://192.168.1.10:8080')
+    parser.add_argument('local_dir', help='Folder to mirror into (created if missing)')
+    parser.add_argument('--path', default='', help='Mirror only this folder of the remote share')
+    parser.add_argument('--workers', '-w', type=int, default=default_workers,
+                        help=f'Parallel downloads (default: {default_workers})')
+    args = parser.parse_args()
+
+    mirror = Mirror(args.server, args.local_dir, args.path, args.workers)
+    worker = threading.Thread(target=mirror.run, daemon=True)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(0.5)
+            p = mirror.progress()
+            print(f"\r📥 {p['files_done'] + p['files_skipped']}/{p['files_found']} files, "
+                  f"{format_size(p['bytes_done'])} of {format_size(p['bytes_total'])}, "
+                  f"{format_size(p['throughput'])}/s   ", end='', flush=True)
+    except KeyboardInterrupt:
+        mirror.cancel()
+        worker.join()
+        print("\n⏹️  Cancelled; run again to resume")
+        return 1
+    print()
+
+    p = mirror.progress()
+    if p['state'] == 'failed':
+        print(f"❌ {p['error']}")
+        return 1
+    print(f"✅ {p['files_done']} downloaded, {p['files_skipped']} unchanged, {p['files_failed']} failed "
+          f"in {p['elapsed']} s ({format_size(p['throughput'])}/s)")
+    for failure in p['failures']:
+        print(f"   ⚠️  {failure['path']}: {failure['error']}")
+    return 1 if p['files_failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import time
+import heapq
+import threading
+from collections import deque
+from datetime import datetime
+from itertools import islice
+
+class PresenceRegistry:
+    """Thread-safe registry of connected users and their recent activities
+
+    Liveness is tracked with monotonic timestamps. Each user has at most one
+    entry in an expiry heap; when that entry comes due and the user has been
+    seen since, it is pushed back with the new deadline instead of expiring
+    them. Expiring is therefore O(log n) per user actually leaving rather
+    than a scan of everyone on every request. Activities go into a ring
+    buffer, so recording one never copies the log.
+
+    on_event, if given, is called as on_event(kind, data) for every change:
+    'presence' with {'action': 'joined'|'updated'|'left', 'user': ...} and
+    'activity' with the new activity.
+    """
+
+    def __init__(self, timeout=300, max_activities=50, on_event=None):
+        self.timeout = timeout
+        self.max_activities = max_activities
+        self.on_event = on_event
+        self._lock = threading.Lock()
+        self._users = {}
+        self._seen = {}
+        self._expiry = []
+        self._activities = deque(maxlen=max_activities)
+
+    def touch(self, user_id, name, ip, current_page, connected_at=None):
+        """Record that a user is connected and what they are looking at"""
+        now = time.monotonic()
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                action = 'joined'
+                user = self._users[user_id] = {'id': user_id}
+                heapq.heappush(self._expiry, (now + self.timeout, user_id))
+            elif (user['name'], user['current_page']) != (name or 'Anonymous User', current_page):
+                action = 'updated'
+            else:
+                action = None
+            user.update({
+                'name': name or 'Anonymous User',
+                'ip': ip,
+                'current_page': current_page,
+                'connected_at': connected_at,
+                'last_seen': datetime.now().isoformat()
+            })
+            self._seen[user_id] = now
+            if action:
+                self._emit('presence', {'action': action, 'user': dict(user)})
+
+    def heartbeat(self, user_id):
+        """Refresh a connected user's last-seen time; return False if unknown"""
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return False
+            user['last_seen'] = datetime.now().isoformat()
+            self._seen[user_id] = time.monotonic()
+            return True
+
+    def rename(self, user_id, name):
+        """Change a connected user's name, returning the old one (None if not connected)"""
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return None
+            old_name = user['name']
+            user['name'] = name
+            self._emit('presence', {'action': 'updated', 'user': dict(user)})
+            return old_name
+
+    def expire(self):
+        """Drop users not seen within the timeout and return their ids"""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, user_id = heapq.heappop(self._expiry)
+                seen = self._seen.get(user_id)
+                if seen is None:
+                    continue
+                if seen + self.timeout > now:
+                    # Seen since this deadline was set; check again later
+                    heapq.heappush(self._expiry, (seen + self.timeout, user_id))
+                    continue
+                user = self._users.pop(user_id)
+                del self._seen[user_id]
+                expired.append(user_id)
+                self._emit('presence', {'action': 'left', 'user': user})
+                self._append_activity(user_id, user['name'], 'disconnected', None, user['ip'])
+        return expired
+
+    def record_activity(self, user_id, action, details=None, ip='Unknown'):
+        """Add an activity to the front of the log and return it"""
+        with self._lock:
+            user = self._users.get(user_id)
+            name = user['name'] if user else 'Anonymous User'
+            return self._append_activity(user_id, name, action, details, ip)
+
+    def _append_activity(self, user_id, name, action, details, ip):
+        activity = {
+            'user_id': user_id,
+            'user_name': name,
+            'action': action,
+            'details': details,
+            'timestamp': datetime.now().isoformat(),
+            'ip': ip
+        }
+        self._activities.appendleft(activity)
+        self._emit('activity', activity)
+        return activity
+
+    def _emit(self, kind, data):
+        # Called with the lock held so listeners see changes in order
+        if self.on_event is not None:
+            self.on_event(kind, data)
+
+    def users(self):
+        """Return a snapshot of the connected users"""
+        with self._lock:
+            return [dict(user) for user in self._users.values()]
+
+    def user_count(self):
+        """Return the number of connected users"""
+        return len(self._users)
+
+    def activities(self, limit=None):
+        """Return the most recent activities, newest first"""
+        with self._lock:
+            return list(islice(self._activities, limit))
+
+    def activity_count(self):
+        """Return the number of activities currently kept"""
+        return len(self._activities)
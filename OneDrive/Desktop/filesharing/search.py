@@ -0,0 +1,325 @@
+import os
+import time
+import sqlite3
+import threading
+from utils import try_process_lock, is_partial_upload
+
+# How often the background indexer looks for changes, in seconds
+refresh_interval = 30
+
+# Every this many refreshes, files in unchanged folders are re-stat'ed too,
+# catching edits that do not touch the folder's own mtime
+full_refresh_every = 10
+
+# Text files up to this size get their contents indexed for full-text search
+max_text_size = 1024 * 1024
+
+# Broad queries rank at most this many matching entries
+max_matches = 10000
+
+# Extensions whose contents are indexed for full-text search
+TEXT_EXTENSIONS = {
+    '.txt', '.md', '.rst', '.log', '.csv', '.tsv', '.json', '.xml', '.yaml', '.yml',
+    '.ini', '.cfg', '.conf', '.py', '.js', '.ts', '.html', '.css', '.c', '.h', '.cpp',
+    '.java', '.go', '.rs', '.rb', '.php', '.sh', '.sql', '.tex'
+}
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS entries (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        parent TEXT NOT NULL,
+        name TEXT NOT NULL,
+        type TEXT NOT NULL,
+        size INTEGER,
+        mtime_ns INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+    CREATE INDEX IF NOT EXISTS entries_name ON entries (name COLLATE NOCASE);
+    CREATE TABLE IF NOT EXISTS folders (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL
+    );
+'''
+
+def fts_query(query):
+    """Quote each whitespace-separated term so user input is matched literally"""
+    terms = query.split()
+    return ' AND '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+def like_escape(text):
+    """Escape LIKE wildcards so text is matched literally"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+class SearchIndex:
+    """Persistent filename and full-text search index of the shared folder
+
+    File names go into an FTS5 table with the trigram tokenizer, so any
+    substring of three or more characters is found through the index. Text
+    files can additionally have their contents indexed. The index is caught
+    up incrementally: a folder whose mtime is unchanged since the last pass
+    is not listed again.
+    """
+
+    def __init__(self, db_path, root, full_text=True):
+        self.root = os.path.abspath(root)
+        self.db_path = db_path
+        self.full_text = full_text
+        self.ready = False
+        self.last_refresh = None
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._pending = set()
+        self._refreshes = 0
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        db = self._connection()
+        db.executescript(SCHEMA)
+        try:
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(name, tokenize='trigram')")
+            self.trigram = True
+        except sqlite3.OperationalError:
+            # SQLite older than 3.34 has no trigram tokenizer; fall back to LIKE
+            self.trigram = False
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS contents USING fts5(body)")
+        db.commit()
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _relative(self, path):
+        relative = os.path.relpath(path, self.root).replace('\\', '/')
+        return '' if relative == '.' else relative
+
+    def _remove(self, db, relative):
+        """Drop an entry and everything below it"""
+        below = like_escape(relative) + '/%'
+        rows = db.execute("SELECT id FROM entries WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                          (relative, below)).fetchall()
+        for (entry_id,) in rows:
+            if self.trigram:
+                db.execute('DELETE FROM names WHERE rowid = ?', (entry_id,))
+            db.execute('DELETE FROM contents WHERE rowid = ?', (entry_id,))
+            db.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
+        db.execute("DELETE FROM folders WHERE path = ? OR path LIKE ? ESCAPE '\\'", (relative, below))
+
+    def _index_text(self, db, entry_id, path, name):
+        if not self.full_text or os.path.splitext(name)[1].lower() not in TEXT_EXTENSIONS:
+            return
+        try:
+            with open(path, 'rb') as f:
+                body = f.read(max_text_size).decode('utf-8', 'replace')
+        except OSError:
+            return
+        db.execute('DELETE FROM contents WHERE rowid = ?', (entry_id,))
+        db.execute('INSERT INTO contents (rowid, body) VALUES (?, ?)', (entry_id, body))
+
+    def _upsert(self, db, relative, parent, name, kind, size, mtime_ns, path):
+        row = db.execute('SELECT id, size, mtime_ns FROM entries WHERE path = ?', (relative,)).fetchone()
+        if row is not None:
+            entry_id, old_size, old_mtime = row
+            if (old_size, old_mtime) == (size, mtime_ns):
+                return
+            db.execute('UPDATE entries SET size = ?, mtime_ns = ?, type = ? WHERE id = ?',
+                       (size, mtime_ns, kind, entry_id))
+        else:
+            entry_id = db.execute(
+                'INSERT INTO entries (path, parent, name, type, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?)',
+                (relative, parent, name, kind, size, mtime_ns)).lastrowid
+            if self.trigram:
+                db.execute('INSERT INTO names (rowid, name) VALUES (?, ?)', (entry_id, name))
+        if kind == 'file':
+            self._index_text(db, entry_id, path, name)
+
+    def _sync_folder(self, db, path, full):
+        """Bring one folder's direct entries up to date; return its subfolders"""
+        relative = self._relative(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._remove(db, relative)
+            return []
+
+        row = db.execute('SELECT mtime_ns FROM folders WHERE path = ?', (relative,)).fetchone()
+        if row is not None and row[0] == st.st_mtime_ns and not full:
+            # Nothing was added, removed or renamed here since the last pass
+            return [os.path.join(self.root, sub) for (sub,) in
+                    db.execute("SELECT path FROM entries WHERE parent = ? AND type = 'directory'", (relative,))]
+
+        seen = set()
+        subfolders = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if is_partial_upload(entry.name):
+                        continue
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        if not is_dir and not entry.is_file():
+                            continue
+                        entry_st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    child = f"{relative}/{entry.name}" if relative else entry.name
+                    seen.add(child)
+                    kind = 'directory' if is_dir else 'file'
+                    size = None if is_dir else entry_st.st_size
+                    self._upsert(db, child, relative, entry.name, kind, size,
+                                 entry_st.st_mtime_ns, entry.path)
+                    if is_dir:
+                        subfolders.append(entry.path)
+        except OSError:
+            return []
+
+        for (child,) in db.execute('SELECT path FROM entries WHERE parent = ?', (relative,)).fetchall():
+            if child not in seen:
+                self._remove(db, child)
+        db.execute('INSERT OR REPLACE INTO folders (path, mtime_ns) VALUES (?, ?)', (relative, st.st_mtime_ns))
+        return subfolders
+
+    def refresh(self, full=False, start=None):
+        """Walk the share (or one subtree) and apply what changed since the last pass"""
+        db = self._connection()
+        stack = [start or self.root]
+        with self._write_lock:
+            while stack and not self._stop.is_set():
+                path = stack.pop()
+                stack.extend(self._sync_folder(db, path, full))
+                # Short transactions keep readers from waiting on a long build
+                db.commit()
+        self.last_refresh = time.time()
+        self.ready = True
+
+    def notify_changed(self, directory):
+        """Ask the background indexer to rescan a folder soon"""
+        self._pending.add(os.path.abspath(directory))
+        self._wake.set()
+
+    def run(self):
+        """Build the index, then keep it current until stop() is called
+
+        With several worker processes only the one holding the index lock
+        walks the share; the others answer queries from the same database,
+        rescan folders they received uploads in, and take over the walk if
+        the lock holder exits.
+        """
+        lock = None
+        while not self._stop.is_set():
+            if lock is None:
+                lock = try_process_lock(self.db_path + '.lock')
+            if lock is not None:
+                full = self._refreshes % full_refresh_every == 0 and self._refreshes > 0
+                try:
+                    self.refresh(full=full)
+                except sqlite3.Error as e:
+                    print(f"Error refreshing search index: {e}")
+                self._refreshes += 1
+            elif not self.ready:
+                self.ready = self._connection().execute(
+                    "SELECT 1 FROM folders WHERE path = ''").fetchone() is not None
+
+            deadline = time.monotonic() + refresh_interval
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                if self._wake.wait(max(0, deadline - time.monotonic())):
+                    self._wake.clear()
+                    while self._pending:
+                        try:
+                            self.refresh(start=self._pending.pop())
+                        except (sqlite3.Error, KeyError):
+                            pass
+        if lock is not None:
+            lock.close()
+
+    def start(self):
+        """Run the indexer in a daemon thread"""
+        threading.Thread(target=self.run, name='search-index', daemon=True).start()
+
+    def stop(self):
+        """Stop the background indexer"""
+        self._stop.set()
+        self._wake.set()
+
+    def search(self, query, limit=50, offset=0, content=False, kind=None):
+        """Return (results, total) for a ranked, paginated name or content search
+
+        Names equal to the query, then names starting with it, are looked up
+        through the name index and always ranked first. Only the first
+        max_matches other substring hits are ranked, which keeps very broad
+        queries (a single common syllable on a huge share) fast; total is
+        capped accordingly.
+        """
+        db = self._connection()
+        query = query.strip()
+        if not query:
+            return [], 0
+
+        if content:
+            # Only files have indexed contents, so the type filter does not apply
+            match = fts_query(query)
+            total = db.execute('SELECT COUNT(*) FROM (SELECT rowid FROM contents WHERE contents MATCH ? LIMIT ?)',
+                               (match, max_matches)).fetchone()[0]
+            rows = db.execute(
+                "SELECT e.path, e.name, e.type, e.size, e.mtime_ns, "
+                "snippet(contents, 0, '[', ']', '…', 12) "
+                "FROM contents c JOIN entries e ON e.id = c.rowid WHERE contents MATCH ? "
+                "ORDER BY rank LIMIT ? OFFSET ?", (match, limit, offset)).fetchall()
+        else:
+            # Tier 0 is an exact name, 1 a prefix, 2 any other substring match
+            exact = 'SELECT id AS rowid, 0 AS tier, 0 AS score FROM entries WHERE name = ? COLLATE NOCASE'
+            prefix = ('SELECT id AS rowid, 1 AS tier, 0 AS score FROM entries '
+                      'WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE LIMIT ?')
+            if self.trigram and all(len(term) >= 3 for term in query.split()):
+                substring = 'SELECT rowid, 2 AS tier, bm25(names) AS score FROM names WHERE names MATCH ? LIMIT ?'
+                match = fts_query(query)
+            else:
+                # Terms shorter than a trigram cannot use the index
+                substring = ("SELECT id AS rowid, 2 AS tier, 0 AS score FROM entries "
+                             "WHERE lower(name) LIKE ? ESCAPE '\\' LIMIT ?")
+                match = '%' + like_escape(query.lower()) + '%'
+            hits = (f'SELECT rowid, min(tier) AS tier, min(score) AS score FROM ('
+                    f'{exact} UNION ALL SELECT * FROM ({prefix}) UNION ALL SELECT * FROM ({substring})'
+                    f') GROUP BY rowid')
+            base = f'WITH hits AS ({hits}) SELECT {{}} FROM hits JOIN entries e ON e.id = hits.rowid'
+            # U+10FFFF sorts after every character, so this bounds the names starting with query
+            params = [query, query, query + '\U0010ffff', max_matches, match, max_matches]
+            if kind in ('file', 'directory'):
+                base += ' WHERE e.type = ?'
+                params.append(kind)
+
+            total = db.execute(base.format('COUNT(*)'), params).fetchone()[0]
+            rows = db.execute(
+                base.format('e.path, e.name, e.type, e.size, e.mtime_ns, NULL') +
+                ' ORDER BY hits.tier, hits.score, length(e.path) LIMIT ? OFFSET ?',
+                params + [limit, offset]).fetchall()
+
+        results = []
+        for path, name, kind_, size, mtime_ns, snippet in rows:
+            result = {
+                'path': path,
+                'name': name,
+                'type': kind_,
+                'size': size,
+                'mtime': mtime_ns / 1e9
+            }
+            if snippet is not None:
+                result['snippet'] = snippet
+            results.append(result)
+        return results, total
+
+    def stats(self):
+        """Return the number of indexed entries and indexer state"""
+        count = self._connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {
+            'entries': count,
+            'ready': self.ready,
+            'last_refresh': self.last_refresh,
+            'trigram': self.trigram
+        }
@@ -0,0 +1,211 @@
+import time
+import threading
+from collections import deque
+
+# Seconds of full-rate traffic a user may send in one burst after being idle
+burst_seconds = 0.25
+
+# Seconds over which per-user throughput is averaged for stats
+throughput_window = 5
+
+# Users with no open transfer are forgotten after this many idle seconds
+idle_timeout = 60
+
+class Transfer:
+    """One open download or upload counted against a user's share"""
+
+    def __init__(self, shaper, key):
+        self.shaper = shaper
+        self.key = key
+        self.closed = False
+        shaper._begin(key)
+
+    def consume(self, nbytes):
+        """Account for nbytes; return the seconds to wait before sending more"""
+        return self.shaper._consume(self.key, nbytes)
+
+    def throttle(self, nbytes):
+        """Account for nbytes and sleep as long as the limits require"""
+        delay = self.shaper._consume(self.key, nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.shaper._end(self.key)
+
+class BandwidthShaper:
+    """Token-bucket bandwidth limits for one direction of traffic, shared fairly by user
+
+    rate caps all transfers together and user_rate caps each user (session
+    user_id, or IP for clients without a session), both in bytes per second;
+    None means unlimited. The global rate is split evenly between the users
+    that have a transfer open, and each user's transfers draw from that
+    user's single bucket, so opening more connections gains nothing. A user
+    may run up a debt of one chunk; the caller then waits until it is paid
+    off, which keeps chunks large without letting anyone exceed their rate.
+
+    Throughput per user is measured whether or not any limit is set. The
+    limits only see this process's transfers; start_server.py gives each
+    worker an equal slice of the configured rates.
+    """
+
+    def __init__(self, rate=None, user_rate=None):
+        self.rate = rate
+        self.user_rate = user_rate
+        self.total_bytes = 0
+        self.active_transfers = 0
+        self._users = {}
+        self._active_users = 0
+        self._pruned_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return bool(self.rate or self.user_rate)
+
+    def open(self, key):
+        """Start a transfer for key; close() it when done"""
+        return Transfer(self, key)
+
+    def _user(self, key):
+        user = self._users.get(key)
+        if user is None:
+            user = self._users[key] = {'tokens': 0.0, 'updated': time.monotonic(), 'active': 0,
+                                       'bytes': 0, 'slots': deque(), 'last_used': time.monotonic()}
+        return user
+
+    def _prune(self, now):
+        """Forget users idle for idle_timeout; called with the lock held"""
+        self._pruned_at = now
+        for key in [key for key, user in self._users.items()
+                    if not user['active'] and now - user['last_used'] > idle_timeout]:
+            del self._users[key]
+
+    def _begin(self, key):
+        with self._lock:
+            now = time.monotonic()
+            # Every new transfer may prune, but the full scan runs at most once per idle_timeout
+            if now - self._pruned_at > idle_timeout:
+                self._prune(now)
+            user = self._user(key)
+            if user['active'] == 0:
+                self._active_users += 1
+            user['active'] += 1
+            self.active_transfers += 1
+            user['last_used'] = time.monotonic()
+
+    def _end(self, key):
+        with self._lock:
+            user = self._users.get(key)
+            if user is None:
+                return
+            user['active'] -= 1
+            self.active_transfers -= 1
+            if user['active'] == 0:
+                self._active_users -= 1
+            user['last_used'] = time.monotonic()
+
+    def user_limit(self):
+        """Return the rate each active user currently gets, or None if unlimited"""
+        limits = [limit for limit in (self.user_rate,
+                                      self.rate / max(self._active_users, 1) if self.rate else None)
+                  if limit]
+        return min(limits) if limits else None
+
+    def _consume(self, key, nbytes):
+        now = time.monotonic()
+        with self._lock:
+            user = self._user(key)
+            user['bytes'] += nbytes
+            user['last_used'] = now
+            self.total_bytes += nbytes
+
+            second = int(now)
+            slots = user['slots']
+            if slots and slots[-1][0] == second:
+                slots[-1][1] += nbytes
+            else:
+                slots.append([second, nbytes])
+                while slots[0][0] <= second - throughput_window:
+                    slots.popleft()
+
+            limit = self.user_limit()
+            if limit is None:
+                return 0
+            # Refill at the user's current share, up to one burst
+            user['tokens'] = min(user['tokens'] + (now - user['updated']) * limit, limit * burst_seconds)
+            user['updated'] = now
+            user['tokens'] -= nbytes
+            return -user['tokens'] / limit if user['tokens'] < 0 else 0
+
+    def throughput(self, key):
+        """Return key's average bytes per second over the last throughput_window seconds"""
+        with self._lock:
+            user = self._users.get(key)
+            return self._throughput(user, int(time.monotonic())) if user else 0
+
+    def _throughput(self, user, second):
+        recent = sum(count for slot, count in user['slots'] if slot > second - throughput_window)
+        return round(recent / throughput_window)
+
+    def stats(self):
+        """Return limits, total bytes and per-user active transfers and throughput"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            users = {key: {'active_transfers': user['active'], 'bytes': user['bytes'],
+                           'throughput': self._throughput(user, int(now))}
+                     for key, user in self._users.items()}
+            return {
+                'rate_limit': self.rate,
+                'user_rate_limit': self.user_rate,
+                'fair_share': self.user_limit(),
+                'active_users': self._active_users,
+                'active_transfers': self.active_transfers,
+                'total_bytes': self.total_bytes,
+                'throughput': sum(user['throughput'] for user in users.values()),
+                'users': users
+            }
+
+class ShapedBody:
+    """Response body that is sent no faster than the shaper allows"""
+
+    def __init__(self, body, shaper, key):
+        self.body = body
+        self.shaper = shaper
+        self.key = key
+
+    def __iter__(self):
+        transfer = self.shaper.open(self.key)
+        try:
+            for data in self.body:
+                transfer.throttle(len(data))
+                yield data
+        finally:
+            transfer.close()
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+class ShapedInput:
+    """Request body stream that is read no faster than the shaper allows"""
+
+    def __init__(self, stream, transfer):
+        self.stream = stream
+        self.transfer = transfer
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.transfer.throttle(len(data))
+        return data
+
+    def readline(self, size=-1):
+        data = self.stream.readline(size)
+        self.transfer.throttle(len(data))
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
@@ -7,7 +7,9 @@ This script provides a user-friendly way to start the server with options.
 import os
 import sys
 import argparse
+import tempfile
 from utils import get_local_ip
+from downloads import SERVE_MODES
 
 def print_banner():
     """Print application banner"""
@@ -37,6 +39,53 @@ def print_server_info(ip, port):
     print("   so they can access your shared files!")
     print()
 
+def per_worker_rates(rate_limit, user_rate_limit, workers):
+    """Turn MB/s limits for the whole server into bytes per second for each of workers processes
+
+    Every process shapes only its own transfers, so each one enforces an
+    equal slice and together they never exceed the limits given
+    """
+    share = max(workers, 1)
+    return tuple(int(limit * 1024 * 1024 / share) if limit else None
+                 for limit in (rate_limit, user_rate_limit))
+
+def run_workers(app, args, on_fork=None):
+    """Serve the app from a gunicorn master with args.workers worker processes, calling on_fork() in each"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("❌ --workers needs gunicorn: pip install gunicorn")
+        sys.exit(1)
+
+    class WorkerApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{args.host}:{args.port}")
+            self.cfg.set('workers', args.workers)
+            # Threaded workers, so open /api/events streams don't tie up a process
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', args.threads)
+            # Import the app once in the master and fork workers from it
+            self.cfg.set('preload_app', True)
+            if on_fork is not None:
+                self.cfg.set('post_fork', lambda arbiter, worker: on_fork())
+
+        def load(self):
+            return app
+
+    WorkerApplication().run()
+
+def run_asgi(args):
+    """Serve the app through asgi.py with uvicorn"""
+    try:
+        import uvicorn
+    except ImportError:
+        print("❌ --asgi needs uvicorn: pip install uvicorn")
+        sys.exit(1)
+    import asgi
+
+    asgi.wsgi_threads = max(args.threads, 1)
+    uvicorn.run(asgi.application, host=args.host, port=args.port, log_level='warning')
+
 def main():
     """Main function"""
     parser = argparse.ArgumentParser(description='LAN File Sharing Web App')
@@ -48,8 +97,54 @@ def main():
                        help='Run in debug mode')
     parser.add_argument('--folder', '-f', type=str,
                        help='Folder to share immediately on startup')
+    parser.add_argument('--serve-mode', choices=SERVE_MODES, default='python',
+                       help='How downloads are sent: python, sendfile (zero-copy on servers '
+                            'with wsgi.file_wrapper), x-sendfile or x-accel (front proxy)')
+    parser.add_argument('--accel-prefix', default='/protected-files/',
+                       help='Internal proxy location for --serve-mode x-accel')
+    parser.add_argument('--max-file-size', type=int, metavar='MB',
+                       help='Reject uploaded files larger than this many megabytes')
+    parser.add_argument('--max-upload-size', type=int, metavar='MB',
+                       help='Reject upload requests larger than this many megabytes')
+    parser.add_argument('--event-heartbeat', type=int, default=15, metavar='SECONDS',
+                       help='Keep-alive interval of the /api/events stream (default: 15)')
+    parser.add_argument('--thumbnail-workers', type=int, default=2, metavar='N',
+                       help='Worker processes used to render image thumbnails (default: 2)')
+    parser.add_argument('--workers', '-w', type=int, default=0, metavar='N',
+                       help='Serve from N gunicorn worker processes instead of the '
+                            'development server (needs gunicorn)')
+    parser.add_argument('--threads', type=int, default=32, metavar='N',
+                       help='Threads per worker process with --workers, or threads running '
+                            'views with --asgi (default: 32); with --workers every open page '
+                            'holds one for its /api/events stream')
+    parser.add_argument('--max-event-streams', type=int, metavar='N',
+                       help='Open /api/events streams per worker process before further pages '
+                            'poll instead (default with --workers: half of --threads)')
+    parser.add_argument('--activity-log', metavar='PATH',
+                       help='SQLite file the activity log is kept in '
+                            '(default: instance/activity.sqlite3 next to the app)')
+    parser.add_argument('--asgi', action='store_true',
+                       help='Serve through the ASGI entry point with uvicorn, streaming '
+                            'downloads and uploads from an event loop (needs uvicorn)')
+    parser.add_argument('--state-db', metavar='PATH',
+                       help='SQLite database holding state shared by worker processes '
+                            '(default with --workers: a file in the temp directory)')
+    parser.add_argument('--rate-limit', type=float, metavar='MB',
+                       help='Cap all downloads together, and all uploads together, at this many '
+                            'megabytes per second, shared evenly between users; with --workers each '
+                            'worker enforces an equal slice of it')
+    parser.add_argument('--user-rate-limit', type=float, metavar='MB',
+                       help="Cap each user's downloads, and uploads, at this many megabytes per second; "
+                            'with --workers each worker enforces an equal slice of it')
+    parser.add_argument('--no-discovery', action='store_true',
+                       help='Do not announce this server or listen for others on the LAN')
+    parser.add_argument('--discovery-address', metavar='ADDRESS',
+                       help='Multicast group or broadcast address for peer discovery '
+                            '(default: 239.255.42.99)')
     
     args = parser.parse_args()
+    if args.asgi and args.workers:
+        parser.error('--asgi runs a single process; use it without --workers')
     
     print_banner()
     
@@ -63,6 +158,9 @@ def main():
     if args.debug:
         os.environ['FLASK_DEBUG'] = '1'
     if args.folder:
+        if not os.path.isdir(args.folder):
+            print(f"❌ Folder not found: {args.folder}")
+            sys.exit(1)
         os.environ['INITIAL_FOLDER'] = os.path.abspath(args.folder)
     
     print("🚀 STARTING SERVER...")
@@ -72,8 +170,56 @@ def main():
     
     try:
         # Import and run the Flask app
+        import app as server
+        import downloads
         from app import app
-        app.run(host=args.host, port=args.port, debug=args.debug)
+        downloads.serve_mode = args.serve_mode
+        downloads.accel_redirect_prefix = args.accel_prefix
+        if args.max_file_size:
+            server.max_upload_file_size = args.max_file_size * 1024 * 1024
+        if args.max_upload_size:
+            server.max_upload_size = args.max_upload_size * 1024 * 1024
+        server.thumbnail_cache.workers = max(args.thumbnail_workers, 1)
+        server.event_heartbeat = max(args.event_heartbeat, 1)
+        if args.max_event_streams is not None:
+            server.max_event_streams = max(args.max_event_streams, 0)
+        elif args.workers > 0:
+            # Keep the other half of each worker's threads for downloads and pages
+            server.max_event_streams = max(args.threads // 2, 1)
+        server.port = args.port
+        shaper_rate, shaper_user_rate = per_worker_rates(args.rate_limit, args.user_rate_limit, args.workers)
+        for shaper in (server.download_shaper, server.upload_shaper):
+            shaper.rate = shaper_rate
+            shaper.user_rate = shaper_user_rate
+        if args.workers > 1 and (shaper_rate or shaper_user_rate):
+            print(f"🐢 Rate limits are split evenly over {args.workers} workers")
+        if args.activity_log:
+            from activity_log import ActivityLog
+            server.activity_log = ActivityLog(args.activity_log)
+        state_db = args.state_db
+        if state_db is None and args.workers > 0:
+            state_db = os.path.join(tempfile.gettempdir(), 'filesharing-state', f'{args.port}.sqlite3')
+        if state_db:
+            from state import SQLiteState
+            shared_state = SQLiteState(state_db)
+            shared_state.reset()
+            server.configure_state(shared_state)
+        if args.folder:
+            # Each process opens the folder on its first request
+            server.state.set('shared_folder', os.path.abspath(args.folder))
+        discovery = None
+        # The debug reloader's parent process only watches files
+        if not args.no_discovery and (not args.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+            discovery = server.configure_discovery(args.discovery_address)
+        if discovery and args.workers == 0:
+            discovery.start()
+        if args.asgi:
+            run_asgi(args)
+        elif args.workers > 0:
+            # Threads do not survive the fork, so each worker starts its own
+            run_workers(app, args, discovery.start if discovery else None)
+        else:
+            app.run(host=args.host, port=args.port, debug=args.debug)
     except KeyboardInterrupt:
         print("\n\n👋 Server stopped by user")
         print("Thank you for using LAN File Sharing!")
@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from events import EventBroker, history_size
+from presence import PresenceRegistry
+
+# How often SSE streams look for events published by other processes, in seconds
+event_poll_interval = 0.25
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        ip TEXT,
+        current_page TEXT,
+        connected_at TEXT,
+        last_seen TEXT NOT NULL,
+        seen REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS users_seen ON users (seen);
+    CREATE TABLE IF NOT EXISTS activities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS metrics (
+        worker TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+'''
+
+USER_COLUMNS = ('id', 'name', 'ip', 'current_page', 'connected_at', 'last_seen')
+
+class MemoryState:
+    """Server state kept in this process, for a single worker"""
+
+    shared = False
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return a setting"""
+        return self._values.get(key, default)
+
+    def set(self, key, value):
+        """Change a setting"""
+        with self._lock:
+            self._values[key] = value
+
+    def events(self):
+        """Return the event broker"""
+        return EventBroker()
+
+    def presence(self, timeout=300, max_activities=50, on_event=None):
+        """Return the presence registry"""
+        return PresenceRegistry(timeout, max_activities, on_event)
+
+class SQLiteState:
+    """Server state in an SQLite database shared by several worker processes
+
+    Settings, connected users, activities, events and each worker's metrics
+    live in one WAL-mode database, so a folder chosen or an event published
+    through one worker is seen by all of them. Each thread of each process has its own connection.
+    Timestamps use the system-wide monotonic clock.
+    """
+
+    shared = True
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        # Connections must not cross a fork into worker processes
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _transaction(self, statements):
+        """Run statements(db) in one write transaction and return its result"""
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(db)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return result
+
+    def reset(self):
+        """Forget everything left by a previous run; call once before workers start"""
+        db = self._connection()
+        for table in ('settings', 'users', 'activities', 'events', 'metrics'):
+            db.execute(f'DELETE FROM {table}')
+
+    def get(self, key, default=None):
+        """Return a setting"""
+        row = self._connection().execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        """Change a setting for every worker"""
+        self._connection().execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                                   (key, json.dumps(value)))
+
+    def put_metrics(self, worker, data):
+        """Store the latest metrics of one worker process"""
+        self._connection().execute('INSERT OR REPLACE INTO metrics (worker, data) VALUES (?, ?)',
+                                   (worker, json.dumps(data)))
+
+    def worker_metrics(self):
+        """Return the latest metrics stored by every worker of this run, including exited ones"""
+        rows = self._connection().execute('SELECT data FROM metrics').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def events(self):
+        """Return the event broker"""
+        return SQLiteEventBroker(self)
+
+    def presence(self, timeout=300, max_activities=50, on_event=None):
+        """Return the presence registry"""
+        return SQLitePresenceRegistry(self, timeout, max_activities, on_event)
+
+class SQLiteEventBroker(EventBroker):
+    """Event broker whose history is an SQLite table shared by all workers
+
+    Streams poll the table every event_poll_interval seconds, which is how
+    events published in one process reach subscribers of another.
+    """
+
+    def __init__(self, state):
+        super().__init__()
+        self.state = state
+        self._published = 0
+
+    def publish(self, event, data):
+        payload = json.dumps(data, separators=(',', ':'))
+        db = self.state._connection()
+        event_id = db.execute('INSERT INTO events (event, data) VALUES (?, ?)', (event, payload)).lastrowid
+        self._published += 1
+        if self._published % 100 == 0:
+            db.execute('DELETE FROM events WHERE id <= ?', (event_id - history_size,))
+        return event_id
+
+    def last_id(self):
+        row = self.state._connection().execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        return row[0] if row else 0
+
+    def _since(self, last_id):
+        rows = self.state._connection().execute(
+            'SELECT id, event, data FROM events WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+        if rows and rows[0][0] > last_id + 1:
+            # Events in between were trimmed from the table
+            return None
+        return rows
+
+    @property
+    def poll_interval(self):
+        return event_poll_interval
+
+    def _wait(self, last_id, timeout):
+        time.sleep(min(timeout, event_poll_interval))
+
+class SQLitePresenceRegistry:
+    """PresenceRegistry with users and activities stored in SQLite
+
+    An index on the last-seen time makes expiry a range delete over the
+    users who actually timed out, and the DELETE ... RETURNING hands each
+    of them to exactly one process.
+    """
+
+    def __init__(self, state, timeout=300, max_activities=50, on_event=None):
+        self.state = state
+        self.timeout = timeout
+        self.max_activities = max_activities
+        self.on_event = on_event
+
+    def _emit(self, kind, data):
+        if self.on_event is not None:
+            self.on_event(kind, data)
+
+    def touch(self, user_id, name, ip, current_page, connected_at=None):
+        """Record that a user is connected and what they are looking at"""
+        user = {
+            'id': user_id,
+            'name': name or 'Anonymous User',
+            'ip': ip,
+            'current_page': current_page,
+            'connected_at': connected_at,
+            'last_seen': datetime.now().isoformat()
+        }
+
+        def statements(db):
+            row = db.execute('SELECT name, current_page FROM users WHERE id = ?', (user_id,)).fetchone()
+            db.execute('INSERT OR REPLACE INTO users (id, name, ip, current_page, connected_at, last_seen, seen) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (user_id, user['name'], ip, current_page, connected_at, user['last_seen'], time.monotonic()))
+            if row is None:
+                return 'joined'
+            return 'updated' if row != (user['name'], current_page) else None
+
+        action = self.state._transaction(statements)
+        if action:
+            self._emit('presence', {'action': action, 'user': user})
+
+    def heartbeat(self, user_id):
+        """Refresh a connected user's last-seen time; return False if unknown"""
+        cursor = self.state._connection().execute(
+            'UPDATE users SET last_seen = ?, seen = ? WHERE id = ?',
+            (datetime.now().isoformat(), time.monotonic(), user_id))
+        return cursor.rowcount > 0
+
+    def rename(self, user_id, name):
+        """Change a connected user's name, returning the old one (None if not connected)"""
+        def statements(db):
+            row = db.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE users SET name = ? WHERE id = ?', (name, user_id))
+            return dict(zip(USER_COLUMNS, row))
+
+        user = self.state._transaction(statements)
+        if user is None:
+            return None
+        old_name = user['name']
+        user['name'] = name
+        self._emit('presence', {'action': 'updated', 'user': user})
+        return old_name
+
+    def expire(self):
+        """Drop users not seen within the timeout and return their ids"""
+        rows = self.state._connection().execute(
+            f"DELETE FROM users WHERE seen < ? RETURNING {', '.join(USER_COLUMNS)}",
+            (time.monotonic() - self.timeout,)).fetchall()
+        for row in rows:
+            user = dict(zip(USER_COLUMNS, row))
+            self._emit('presence', {'action': 'left', 'user': user})
+            self._append_activity(user['id'], user['name'], 'disconnected', None, user['ip'])
+        return [row[0] for row in rows]
+
+    def record_activity(self, user_id, action, details=None, ip='Unknown'):
+        """Add an activity to the front of the log and return it"""
+        row = self.state._connection().execute('SELECT name FROM users WHERE id = ?', (user_id,)).fetchone()
+        return self._append_activity(user_id, row[0] if row else 'Anonymous User', action, details, ip)
+
+    def _append_activity(self, user_id, name, action, details, ip):
+        activity = {
+            'user_id': user_id,
+            'user_name': name,
+            'action': action,
+            'details': details,
+            'timestamp': datetime.now().isoformat(),
+            'ip': ip
+        }
+        db = self.state._connection()
+        activity_id = db.execute('INSERT INTO activities (data) VALUES (?)', (json.dumps(activity),)).lastrowid
+        db.execute('DELETE FROM activities WHERE id <= ?', (activity_id - self.max_activities,))
+        self._emit('activity', activity)
+        return activity
+
+    def users(self):
+        """Return a snapshot of the connected users"""
+        rows = self.state._connection().execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users").fetchall()
+        return [dict(zip(USER_COLUMNS, row)) for row in rows]
+
+    def user_count(self):
+        """Return the number of connected users"""
+        return self.state._connection().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def activities(self, limit=None):
+        """Return the most recent activities, newest first"""
+        rows = self.state._connection().execute(
+            'SELECT data FROM activities ORDER BY id DESC LIMIT ?',
+            (-1 if limit is None else limit,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def activity_count(self):
+        """Return the number of activities currently kept"""
+        return self.state._connection().execute('SELECT COUNT(*) FROM activities').fetchone()[0]
+
+STATE_BACKENDS = {
+    'memory': MemoryState,
+    'sqlite': SQLiteState,
+}
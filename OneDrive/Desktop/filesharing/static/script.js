@@ -33,53 +33,43 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    function handleFiles(files) {
+    async function handleFiles(files) {
         if (files.length === 0) return;
 
         window.showLoading(); // Show loading indicator
-        const formData = new FormData();
         const totalFiles = files.length;
-
-        // Add files to form data
-        for (let i = 0; i < files.length; i++) {
-            formData.append('file', files[i]);
-        }
+        const results = [];
 
         // Show uploading status
         showUploadStatus(`Uploading ${totalFiles} file(s)...`, 'info');
 
-        // Upload files
-        fetch('/upload', {
-            method: 'POST',
-            body: formData
-        })
-        .then(response => {
-            if (!response.ok) {
-                throw new Error('Network response was not ok');
-            }
-            return response.json();
-        })
-        .then(data => {
-            window.hideLoading(); // Hide loading indicator
-            if (data.error) {
-                showUploadStatus(data.error + (data.details ? '\n' + 
-                    data.details.map(r => `${r.filename}: ${r.message}`).join('\n') : ''), 'error');
-            } else {
-                const successMsg = data.message + '\n' + 
-                    data.results.filter(r => r.status === 'success')
-                        .map(r => r.filename).join('\n');
-                showUploadStatus(successMsg, 'success');
-                
-                // Refresh page after successful upload
-                setTimeout(() => {
-                    window.location.reload();
-                }, 2000);
+        for (const file of Array.from(files)) {
+            try {
+                const result = await uploadInChunks(file, (sent) => {
+                    const percent = file.size ? Math.floor(sent * 100 / file.size) : 100;
+                    showUploadStatus(`Uploading ${file.name}: ${percent}%`, 'info');
+                });
+                results.push({ filename: result.filename, status: 'success', duplicateOf: result.duplicate_of });
+            } catch (error) {
+                results.push({ filename: file.name, status: 'error', message: error.message });
             }
-        })
-        .catch(error => {
-            window.hideLoading(); // Hide loading on error
-            showUploadStatus('Upload failed: ' + error.message, 'error');
-        });
+        }
+
+        window.hideLoading(); // Hide loading indicator
+        const succeeded = results.filter(r => r.status === 'success');
+        const failed = results.filter(r => r.status === 'error');
+
+        if (succeeded.length === 0) {
+            showUploadStatus('No files were uploaded successfully\n' +
+                failed.map(r => `${r.filename}: ${r.message}`).join('\n'), 'error');
+            return;
+        }
+
+        const successMsg = `${succeeded.length} file(s) uploaded successfully\n` +
+            succeeded.map(r => r.duplicateOf ? `${r.filename} (duplicate of ${r.duplicateOf})` : r.filename).join('\n') +
+            (failed.length ? '\n' + failed.map(r => `${r.filename}: ${r.message}`).join('\n') : '');
+        showUploadStatus(successMsg, failed.length ? 'error' : 'success');
+        // The file list updates itself when the server announces the folder change
     }
 
     function showUploadStatus(message, type) {
@@ -98,6 +88,394 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
+// Incremental file list loading for large folders
+function buildPathUrl(prefix, path) {
+    return prefix + path.split('/').map(encodeURIComponent).join('/');
+}
+
+function formatFileSize(size) {
+    if (size === null || size === undefined) return 'Unknown';
+    const units = ['B', 'KB', 'MB', 'GB'];
+    for (const unit of units) {
+        if (size < 1024) return `${size.toFixed(1)} ${unit}`;
+        size /= 1024;
+    }
+    return `${size.toFixed(1)} TB`;
+}
+
+function hasThumbnail(name) {
+    const dot = name.lastIndexOf('.');
+    return dot > 0 && (window.thumbnailExtensions || []).includes(name.slice(dot).toLowerCase());
+}
+
+// Thumbnails still being rendered answer 503; retry a few times, then show the icon
+const maxThumbnailRetries = 5;
+document.addEventListener('error', function(e) {
+    const thumb = e.target;
+    if (!(thumb instanceof HTMLImageElement) || !thumb.classList.contains('file-thumb')) return;
+    const retries = Number(thumb.dataset.retries || 0);
+    if (retries >= maxThumbnailRetries) {
+        thumb.parentElement.textContent = '📄';
+        return;
+    }
+    thumb.dataset.retries = retries + 1;
+    setTimeout(() => {
+        const url = new URL(thumb.src);
+        url.searchParams.set('retry', retries + 1);
+        thumb.src = url.toString();
+    }, 1000 * (retries + 1));
+}, true);
+
+function createFileItem(item, currentPath) {
+    const itemPath = currentPath ? `${currentPath}/${item.name}` : item.name;
+    const isDirectory = item.type === 'directory';
+
+    const element = document.createElement('div');
+    element.className = `file-item ${item.type}`;
+
+    const select = document.createElement('input');
+    select.type = 'checkbox';
+    select.className = 'file-select';
+    select.name = 'paths';
+    select.value = itemPath;
+    select.setAttribute('form', 'selectionForm');
+    select.setAttribute('aria-label', `Select ${item.name}`);
+
+    const icon = document.createElement('div');
+    icon.className = 'file-icon';
+    if (!isDirectory && hasThumbnail(item.name)) {
+        const thumb = document.createElement('img');
+        thumb.className = 'file-thumb';
+        thumb.loading = 'lazy';
+        thumb.decoding = 'async';
+        thumb.alt = '';
+        thumb.src = buildPathUrl('/thumb/', itemPath) + `?v=${Math.floor(item.mtime * 1000)}-${item.size}`;
+        icon.appendChild(thumb);
+    } else {
+        icon.textContent = isDirectory ? '📁' : '📄';
+    }
+
+    const info = document.createElement('div');
+    info.className = 'file-info';
+    const name = document.createElement('div');
+    name.className = 'file-name';
+    if (isDirectory) {
+        const link = document.createElement('a');
+        link.href = buildPathUrl('/browse/', itemPath);
+        link.className = 'folder-link';
+        link.textContent = item.name;
+        name.appendChild(link);
+    } else {
+        name.textContent = item.name;
+    }
+    info.appendChild(name);
+    if (!isDirectory) {
+        const size = document.createElement('div');
+        size.className = 'file-size';
+        size.textContent = formatFileSize(item.size);
+        info.appendChild(size);
+    }
+
+    const actions = document.createElement('div');
+    actions.className = 'file-actions';
+    const action = document.createElement('a');
+    if (isDirectory) {
+        action.href = buildPathUrl('/browse/', itemPath);
+        action.className = 'btn btn-open';
+        action.textContent = '📂 Open';
+    } else {
+        action.href = buildPathUrl('/download/', itemPath);
+        action.className = 'btn btn-download';
+        action.setAttribute('download', '');
+        action.textContent = '⬇️ Download';
+    }
+    actions.appendChild(action);
+
+    element.appendChild(select);
+    element.appendChild(icon);
+    element.appendChild(info);
+    element.appendChild(actions);
+    return element;
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const fileList = document.getElementById('fileList');
+    const sentinel = document.getElementById('fileListSentinel');
+    if (!fileList || !sentinel) return;
+
+    const currentPath = window.currentPath || '';
+    let loading = false;
+
+    const observer = 'IntersectionObserver' in window ? new IntersectionObserver(async (entries) => {
+        const nextCursor = fileList.dataset.nextCursor;
+        if (!entries.some(entry => entry.isIntersecting) || loading || !nextCursor) return;
+
+        loading = true;
+        try {
+            const url = buildPathUrl('/api/browse/', currentPath) +
+                `?cursor=${encodeURIComponent(nextCursor)}`;
+            const response = await fetch(url);
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const data = await response.json();
+
+            const fragment = document.createDocumentFragment();
+            data.items.forEach(item => fragment.appendChild(createFileItem(item, currentPath)));
+            fileList.appendChild(fragment);
+            fileList.dataset.nextCursor = data.next_cursor || '';
+        } catch (error) {
+            console.error('Error loading more files:', error);
+        } finally {
+            loading = false;
+        }
+
+        if (!fileList.dataset.nextCursor) observer.unobserve(sentinel);
+    }, { rootMargin: '400px' }) : null;
+
+    if (observer && fileList.dataset.nextCursor) observer.observe(sentinel);
+
+    // Replace the list with the folder's first page when it changed on the server
+    async function refreshFileList() {
+        try {
+            const response = await fetch(buildPathUrl('/api/browse/', currentPath), {
+                cache: 'no-store',
+                headers: window.listingEtag ? { 'If-None-Match': window.listingEtag } : {}
+            });
+            if (response.status === 304) return;
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const data = await response.json();
+            window.listingEtag = response.headers.get('ETag');
+
+            const fragment = document.createDocumentFragment();
+            data.items.forEach(item => fragment.appendChild(createFileItem(item, currentPath)));
+            fileList.replaceChildren(fragment);
+            fileList.dataset.nextCursor = data.next_cursor || '';
+
+            const filesCount = document.getElementById('filesCount');
+            if (filesCount) filesCount.textContent = `${data.total_count} items`;
+            const emptyFolder = document.getElementById('emptyFolder');
+            if (emptyFolder) emptyFolder.hidden = data.total_count > 0;
+
+            if (observer && fileList.dataset.nextCursor) observer.observe(sentinel);
+        } catch (error) {
+            console.error('Error refreshing file list:', error);
+        }
+    }
+
+    const events = getServerEvents();
+    if (!events) return;
+    events.addEventListener('folder', (e) => {
+        if (JSON.parse(e.data).path === currentPath) refreshFileList();
+    });
+    events.addEventListener('reset', refreshFileList);
+    events.addEventListener('share', () => {
+        // A different folder is being shared, so this path may no longer exist
+        window.location.href = '/browse';
+    });
+});
+
+// Milliseconds between refreshes when the server turns the event stream away
+const SERVER_EVENTS_POLL_INTERVAL = 10000;
+
+// One Server-Sent Events connection per page, shared by every listener
+function getServerEvents() {
+    if (!('EventSource' in window)) return null;
+    if (!window.serverEvents) {
+        let url = '/api/events';
+        if (window.currentPath !== undefined) {
+            url += `?path=${encodeURIComponent(window.currentPath)}`;
+        }
+        const events = window.serverEvents = new EventSource(url);
+        events.addEventListener('error', () => {
+            // Dropped connections are retried by the browser; a refusal (the
+            // server is at its stream limit) closes the stream for good, so
+            // poll instead by sending the listeners a 'reset' now and then
+            if (events.readyState !== EventSource.CLOSED || events.pollTimer) return;
+            events.dispatchEvent(new Event('reset'));
+            events.pollTimer = setInterval(() => events.dispatchEvent(new Event('reset')),
+                                           SERVER_EVENTS_POLL_INTERVAL);
+        });
+    }
+    return window.serverEvents;
+}
+
+// Chunked, resumable uploads
+const UPLOAD_CONCURRENCY = 4;
+
+async function uploadRequest(url, options) {
+    const response = await fetch(url, options);
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        const error = new Error(data.error || `HTTP ${response.status}`);
+        error.status = response.status;
+        throw error;
+    }
+    return data;
+}
+
+async function sha256Hex(blob) {
+    // crypto.subtle is only available in secure contexts (https or localhost)
+    if (!window.crypto || !window.crypto.subtle) return null;
+    const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+const SHA256_K = new Uint32Array([
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+]);
+
+// Incremental SHA-256; crypto.subtle can neither hash in pieces nor run over plain http
+class Sha256 {
+    constructor() {
+        this.state = new Uint32Array([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+                                      0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+        this.words = new Uint32Array(64);
+        this.pending = new Uint8Array(64);
+        this.pendingLength = 0;
+        this.length = 0;
+    }
+
+    update(data) {
+        this.length += data.length;
+        let offset = 0;
+        if (this.pendingLength) {
+            offset = Math.min(64 - this.pendingLength, data.length);
+            this.pending.set(data.subarray(0, offset), this.pendingLength);
+            this.pendingLength += offset;
+            if (this.pendingLength < 64) return this;
+            this.block(this.pending, 0);
+            this.pendingLength = 0;
+        }
+        for (; offset + 64 <= data.length; offset += 64) this.block(data, offset);
+        this.pending.set(data.subarray(offset));
+        this.pendingLength = data.length - offset;
+        return this;
+    }
+
+    block(data, offset) {
+        const w = this.words;
+        for (let i = 0; i < 16; i++, offset += 4) {
+            w[i] = (data[offset] << 24) | (data[offset + 1] << 16) | (data[offset + 2] << 8) | data[offset + 3];
+        }
+        for (let i = 16; i < 64; i++) {
+            const x = w[i - 15], y = w[i - 2];
+            const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+            const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+            w[i] = w[i - 16] + s0 + w[i - 7] + s1;
+        }
+        const h = this.state;
+        let a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+        for (let i = 0; i < 64; i++) {
+            const s1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+            const t1 = (k + s1 + ((e & f) ^ (~e & g)) + SHA256_K[i] + w[i]) | 0;
+            const s0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+            const t2 = (s0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            k = g; g = f; f = e; e = (d + t1) | 0; d = c; c = b; b = a; a = (t1 + t2) | 0;
+        }
+        h[0] += a; h[1] += b; h[2] += c; h[3] += d; h[4] += e; h[5] += f; h[6] += g; h[7] += k;
+    }
+
+    hex() {
+        const bits = this.length * 8;
+        const padding = new Uint8Array((this.pendingLength < 56 ? 64 : 128) - this.pendingLength);
+        padding[0] = 0x80;
+        const view = new DataView(padding.buffer);
+        view.setUint32(padding.length - 8, Math.floor(bits / 0x100000000));
+        view.setUint32(padding.length - 4, bits >>> 0);
+        this.update(padding);
+        return Array.from(this.state, word => word.toString(16).padStart(8, '0')).join('');
+    }
+}
+
+// Hash a file in order, a few MB at a time, while its chunks are uploaded
+async function hashFile(file) {
+    const hash = new Sha256();
+    const step = 4 * 1024 * 1024;
+    for (let start = 0; start < file.size; start += step) {
+        hash.update(new Uint8Array(await file.slice(start, start + step).arrayBuffer()));
+    }
+    return hash.hex();
+}
+
+async function uploadInChunks(file, onProgress) {
+    const path = window.currentPath || '';
+    const resumeKey = `upload:${path}:${file.name}:${file.size}:${file.lastModified}`;
+
+    // Resume a session left behind by a reload, or start a new one
+    let session = null;
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+        session = await uploadRequest(`/api/uploads/${savedId}`).catch(() => null);
+    }
+    if (!session) {
+        session = await uploadRequest('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, path: path })
+        });
+        localStorage.setItem(resumeKey, session.upload_id);
+    }
+
+    // The server checks the assembled file against this digest on commit
+    const digest = hashFile(file);
+
+    const received = new Set(session.received);
+    const pending = [];
+    for (let index = 0; index < session.total_chunks; index++) {
+        if (!received.has(index)) pending.push(index);
+    }
+
+    const chunkLength = (index) => Math.min(session.chunk_size, file.size - index * session.chunk_size);
+    let sent = session.received.reduce((total, index) => total + chunkLength(index), 0);
+    onProgress(sent);
+
+    async function worker() {
+        while (pending.length) {
+            const index = pending.shift();
+            const start = index * session.chunk_size;
+            const chunk = file.slice(start, start + session.chunk_size);
+            const headers = { 'Content-Type': 'application/octet-stream' };
+            const checksum = await sha256Hex(chunk);
+            if (checksum) headers['X-Chunk-SHA256'] = checksum;
+
+            let attempt = 0;
+            while (true) {
+                try {
+                    await uploadRequest(`/api/uploads/${session.upload_id}/chunks/${index}`, {
+                        method: 'PUT', headers: headers, body: chunk
+                    });
+                    break;
+                } catch (error) {
+                    if (++attempt >= 3 || (error.status && error.status < 500)) throw error;
+                    await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+                }
+            }
+            sent += chunk.size;
+            onProgress(sent);
+        }
+    }
+
+    const workers = [];
+    for (let i = 0; i < Math.min(UPLOAD_CONCURRENCY, pending.length); i++) {
+        workers.push(worker());
+    }
+    await Promise.all(workers);
+
+    const result = await uploadRequest(`/api/uploads/${session.upload_id}/commit`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ sha256: await digest })
+    });
+    localStorage.removeItem(resumeKey);
+    return result;
+}
+
 // Copy to clipboard functionality
 function copyToClipboard(text) {
     navigator.clipboard.writeText(text).then(function() {
@@ -138,17 +516,6 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
-// Auto-refresh file list every 30 seconds
-if (window.location.pathname.includes('/browse')) {
-    setInterval(() => {
-        // Only refresh if no upload is in progress
-        const uploadStatus = document.getElementById('uploadStatus');
-        if (!uploadStatus || uploadStatus.style.display === 'none') {
-            window.location.reload();
-        }
-    }, 30000);
-}
-
 // Keyboard shortcuts
 document.addEventListener('keydown', function(e) {
     // Ctrl+R or F5 for refresh
@@ -554,15 +921,15 @@ window.addEventListener('orientationchange', () => {
 // Interactive Sharing Features
 class SharingManager {
     constructor() {
-        this.updateInterval = null;
-        this.heartbeatInterval = null;
+        this.users = new Map();
+        this.activities = [];
+        this.maxActivities = 20;
         this.init();
     }
 
     init() {
         this.setupEventListeners();
         this.startRealTimeUpdates();
-        this.startHeartbeat();
         this.loadUserIdentity();
     }
 
@@ -678,6 +1045,7 @@ class SharingManager {
             const response = await fetch('/api/connected_users');
             const data = await response.json();
 
+            this.users = new Map(data.users.map(user => [user.id, user]));
             this.displayConnectedUsers(data.users);
             this.updateUsersCount(data.total_count);
         } catch (error) {
@@ -703,8 +1071,8 @@ class SharingManager {
             <div class="user-item">
                 <div class="user-info">
                     <div class="user-name">${this.escapeHtml(user.name)}</div>
-                    <div class="user-details">IP: ${user.ip}</div>
-                    <div class="user-details">${user.current_page}</div>
+                    <div class="user-details">IP: ${this.escapeHtml(user.ip)}</div>
+                    <div class="user-details">${this.escapeHtml(user.current_page)}</div>
                 </div>
                 <div class="user-status">
                     <div class="status-indicator"></div>
@@ -728,6 +1096,7 @@ class SharingManager {
             const response = await fetch('/api/user_activities');
             const data = await response.json();
 
+            this.activities = data.activities;
             this.displayActivities(data.activities);
         } catch (error) {
             console.error('Error fetching activities:', error);
@@ -758,41 +1127,49 @@ class SharingManager {
     }
 
     startRealTimeUpdates() {
-        // Update every 2 seconds
-        this.updateInterval = setInterval(() => {
+        // Only pages that show users or activities need the snapshots
+        const showsPresence = document.getElementById('usersList') || document.getElementById('activitiesList') ||
+            document.getElementById('usersCount');
+        const refresh = () => {
+            if (!showsPresence) return;
             this.updateConnectedUsers();
             this.updateActivities();
-        }, 2000);
+        };
 
-        // Initial update
-        this.updateConnectedUsers();
-        this.updateActivities();
+        const events = getServerEvents();
+        if (!events) {
+            refresh();
+            return;
+        }
 
-        // Add error recovery
-        window.addEventListener('online', () => {
-            this.updateConnectedUsers();
-            this.updateActivities();
+        // Take a snapshot once the stream is open, then apply pushed changes;
+        // reconnects resume from Last-Event-ID so no snapshot is needed then
+        let synced = false;
+        events.addEventListener('open', () => {
+            if (!synced) {
+                synced = true;
+                refresh();
+            }
         });
+        events.addEventListener('reset', refresh);
 
-        // Handle visibility change
-        document.addEventListener('visibilitychange', () => {
-            if (!document.hidden) {
-                this.updateConnectedUsers();
-                this.updateActivities();
+        events.addEventListener('presence', (e) => {
+            const change = JSON.parse(e.data);
+            if (change.action === 'left') {
+                this.users.delete(change.user.id);
+            } else {
+                this.users.set(change.user.id, change.user);
             }
+            if (!showsPresence) return;
+            this.displayConnectedUsers(Array.from(this.users.values()));
+            this.updateUsersCount(this.users.size);
         });
-    }
 
-    startHeartbeat() {
-        // Send heartbeat every 30 seconds
-        this.heartbeatInterval = setInterval(() => {
-            fetch('/api/heartbeat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                }
-            }).catch(console.error);
-        }, 30000);
+        events.addEventListener('activity', (e) => {
+            this.activities.unshift(JSON.parse(e.data));
+            this.activities.length = Math.min(this.activities.length, this.maxActivities);
+            if (showsPresence) this.displayActivities(this.activities);
+        });
     }
 
     formatTime(timestamp) {
@@ -820,11 +1197,10 @@ class SharingManager {
     }
 
     destroy() {
-        if (this.updateInterval) {
-            clearInterval(this.updateInterval);
-        }
-        if (this.heartbeatInterval) {
-            clearInterval(this.heartbeatInterval);
+        if (window.serverEvents) {
+            clearInterval(window.serverEvents.pollTimer);
+            window.serverEvents.close();
+            window.serverEvents = null;
         }
     }
 }
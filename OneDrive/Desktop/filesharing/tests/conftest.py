@@ -0,0 +1,26 @@
+import os
+import sys
+import threading
+import pytest
+from werkzeug.serving import make_server
+
+# The app's modules live next to this folder, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='module')
+def shared_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp('share')
+
+@pytest.fixture(scope='module')
+def server(shared_dir):
+    """Serve the app from a threaded server on a free port, sharing shared_dir"""
+    import app
+
+    app.apply_shared_folder(str(shared_dir))
+    app.state.set('shared_folder', str(shared_dir))
+    httpd = make_server('127.0.0.1', 0, app.app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    thread.join()
@@ -0,0 +1,143 @@
+import os
+import time
+import types
+import multiprocessing
+import pytest
+import requests
+import activity_log
+from activity_log import ActivityLog, parse_time, encode_cursor, decode_cursor
+
+def activity(action='download', user='Ann', details=None):
+    return {'user_id': user.lower(), 'user_name': user, 'action': action, 'details': details, 'ip': '10.0.0.1'}
+
+@pytest.fixture
+def log(tmp_path):
+    return ActivityLog(str(tmp_path / 'log' / 'activity.sqlite3'))
+
+def test_appends_are_written_in_batches(log, monkeypatch):
+    monkeypatch.setattr(activity_log, 'batch_size', 3)
+    for i in range(7):
+        log.append(activity(details=str(i)))
+    assert log.flush()
+    assert log.count() == 7
+    activities, next_cursor = log.query(limit=10)
+    assert [item['details'] for item in activities] == [str(i) for i in reversed(range(7))]
+    assert next_cursor is None
+
+def test_writer_flushes_on_its_own(log, monkeypatch):
+    monkeypatch.setattr(activity_log, 'flush_interval', 0.05)
+    log.append(activity())
+    deadline = time.monotonic() + 5
+    while not log.count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert log.count() == 1
+
+def test_filters_are_combined(log):
+    log.append(activity('download', 'Ann'))
+    log.append(activity('upload', 'Ann'))
+    log.append(activity('download', 'Bob'))
+    log.flush()
+    assert log.count(user_name='Ann') == 2
+    assert log.count(user_id='bob', action='download') == 1
+    assert log.count(action='delete') == 0
+    assert log.count(since=time.time() + 60) == 0
+    assert log.count(until=time.time() + 60, user_name='Bob') == 1
+
+def test_pages_with_equal_times_neither_skip_nor_repeat(log, monkeypatch):
+    # Every activity lands on the same instant, so only the id breaks ties
+    monkeypatch.setattr(activity_log, 'time', types.SimpleNamespace(time=lambda: 1000.0, monotonic=time.monotonic))
+    for i in range(25):
+        log.append(activity(details=str(i)))
+    log.flush()
+    seen, cursor = [], None
+    while True:
+        page, cursor = log.query(cursor=cursor, limit=7)
+        seen.extend(item['details'] for item in page)
+        if cursor is None:
+            break
+    assert seen == [str(i) for i in reversed(range(25))]
+
+def test_page_size_is_clamped(log, monkeypatch):
+    monkeypatch.setattr(activity_log, 'max_page_size', 3)
+    for _ in range(5):
+        log.append(activity())
+    log.flush()
+    assert len(log.query(limit=100)[0]) == 3
+    assert len(log.query(limit=-4)[0]) == 1
+
+@pytest.mark.parametrize('cursor', ['not-base64!', encode_cursor(1, 2)[:-3], 'WzFd', 'NQ', 'W1sxXSwgMl0'])
+def test_malformed_cursors_are_rejected(log, cursor):
+    # 'WzFd' is [1], 'NQ' is 5 and 'W1sxXSwgMl0' is [[1], 2]
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+    with pytest.raises(ValueError):
+        log.query(cursor=cursor)
+
+def test_cursor_round_trips():
+    assert decode_cursor(encode_cursor(1234.5678, 42)) == (1234.5678, 42)
+
+def test_times_are_epoch_seconds_or_iso_dates():
+    assert parse_time('1700000000.5') == 1700000000.5
+    assert parse_time('2024-01-02T03:04:05+00:00') == 1704164645
+    with pytest.raises(ValueError):
+        parse_time('yesterday')
+    with pytest.raises(ValueError):
+        parse_time('2024-13-40')
+
+def test_failed_write_does_not_strand_waiters(log, capsys):
+    log._connection().execute('DROP TABLE activities')
+    log.append(activity())
+    assert log.flush()
+    assert 'Error writing activity log' in capsys.readouterr().out
+
+def test_each_process_writes_through_its_own_writer(log):
+    log.append(activity(details='parent'))
+    log.flush()
+    child = multiprocessing.get_context('fork').Process(target=append_from_child, args=(log,))
+    child.start()
+    child.join(30)
+    assert child.exitcode == 0
+    assert log.count() == 2
+    assert log.query(limit=1)[0][0]['details'] == 'child'
+
+def append_from_child(log):
+    log.append(activity(details='child'))
+    if not log.flush():
+        os._exit(1)
+
+@pytest.fixture
+def app_log(tmp_path, monkeypatch):
+    import app
+
+    log = ActivityLog(str(tmp_path / 'activity.sqlite3'))
+    monkeypatch.setattr(app, 'activity_log', log)
+    return log
+
+def test_api_filters_and_pages(server, app_log):
+    for i in range(5):
+        app_log.append(activity('download', 'Ann', str(i)))
+    app_log.append(activity('upload', 'Bob'))
+    url = f"{server}/api/user_activities"
+    first = requests.get(url, params={'user': 'Ann', 'limit': 3}, timeout=30).json()
+    assert first['total_count'] == 5
+    assert [item['details'] for item in first['activities']] == ['4', '3', '2']
+    rest = requests.get(url, params={'user': 'Ann', 'limit': 3, 'cursor': first['next_cursor']}, timeout=30).json()
+    assert [item['details'] for item in rest['activities']] == ['1', '0']
+    assert rest['next_cursor'] is None
+    assert requests.get(url, params={'action': 'upload'}, timeout=30).json()['total_count'] == 1
+    assert requests.get(url, params={'since': '2000-01-01', 'until': time.time() + 60},
+                        timeout=30).json()['total_count'] == 6
+
+def test_api_records_what_users_do(server, app_log):
+    user = requests.Session()
+    user.get(f"{server}/", timeout=30)
+    user.post(f"{server}/api/set_username", json={'username': 'Cleo'}, timeout=30)
+    response = requests.get(f"{server}/api/user_activities", params={'user': 'Cleo'}, timeout=30).json()
+    assert [item['action'] for item in response['activities']] == ['username_changed']
+
+@pytest.mark.parametrize('params', [{'since': 'yesterday'}, {'until': '2024-13-40'}, {'limit': 'ten'},
+                                    {'cursor': 'not-base64!'}, {'cursor': 'WzFd'}])
+def test_api_rejects_bad_parameters(server, app_log, params):
+    response = requests.get(f"{server}/api/user_activities", params=params, timeout=30)
+    assert response.status_code == 400
+    assert 'error' in response.json()
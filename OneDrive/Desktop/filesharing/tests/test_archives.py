@@ -0,0 +1,94 @@
+import io
+import os
+import tarfile
+import zipfile
+import pytest
+import requests
+import archives
+
+@pytest.fixture(scope='module')
+def tree(shared_dir):
+    root = shared_dir / 'archive'
+    (root / 'sub' / 'empty').mkdir(parents=True)
+    (root / 'a.txt').write_bytes(b'alpha' * 1000)
+    (root / 'sub' / 'b.bin').write_bytes(os.urandom(600000))
+    # An upload still in progress stays out of archives
+    (root / 'sub' / '.c.bin.0123456789ab.uploading').write_bytes(b'partial')
+    return root
+
+def fetch(server, path='archive', **params):
+    response = requests.get(f"{server}/download_folder/{path}", params=params, timeout=30)
+    return response
+
+def test_zip_holds_the_whole_tree(server, tree):
+    response = fetch(server)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/zip'
+    assert 'archive.zip' in response.headers['Content-Disposition']
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == ['archive/', 'archive/a.txt', 'archive/sub/',
+                                              'archive/sub/b.bin', 'archive/sub/empty/']
+        assert archive.read('archive/sub/b.bin') == (tree / 'sub' / 'b.bin').read_bytes()
+
+def test_deflated_zip_is_smaller_and_intact(server, tree):
+    stored = fetch(server).content
+    deflated = fetch(server, compression='deflate').content
+    with zipfile.ZipFile(io.BytesIO(deflated)) as archive:
+        assert archive.getinfo('archive/a.txt').compress_type == zipfile.ZIP_DEFLATED
+        assert archive.read('archive/a.txt') == b'alpha' * 1000
+    assert len(deflated) < len(stored)
+
+def test_tar_holds_the_whole_tree(server, tree):
+    response = fetch(server, format='tar')
+    assert response.headers['Content-Type'] == 'application/x-tar'
+    assert len(response.content) % tarfile.RECORDSIZE == 0
+    with tarfile.open(fileobj=io.BytesIO(response.content)) as archive:
+        names = sorted(archive.getnames())
+        assert names == ['archive', 'archive/a.txt', 'archive/sub', 'archive/sub/b.bin', 'archive/sub/empty']
+        assert archive.extractfile('archive/sub/b.bin').read() == (tree / 'sub' / 'b.bin').read_bytes()
+
+def test_selection_is_archived_together(server, tree):
+    response = requests.post(f"{server}/download_selection", timeout=30,
+                             data={'paths': ['archive/a.txt', 'archive/sub/empty'], 'format': 'tar'})
+    assert response.status_code == 200
+    with tarfile.open(fileobj=io.BytesIO(response.content)) as archive:
+        assert sorted(archive.getnames()) == ['a.txt', 'empty']
+
+@pytest.mark.parametrize('request_args, status', [
+    (('get', '/download_folder/archive', {'params': {'format': 'rar'}}), 400),
+    (('get', '/download_folder/..%2F..', {}), 403),
+    (('get', '/download_folder/archive/missing', {}), 404),
+    (('post', '/download_selection', {'data': {}}), 400),
+    (('post', '/download_selection', {'data': {'paths': ['archive/a.txt', '../../etc/passwd']}}), 403),
+    (('post', '/download_selection', {'data': {'paths': ['archive/nothing-here']}}), 403),
+])
+def test_bad_requests_are_refused(server, tree, request_args, status):
+    method, path, kwargs = request_args
+    response = requests.request(method, f"{server}{path}", timeout=30, **kwargs)
+    assert response.status_code == status
+
+def test_tar_stays_valid_when_a_file_shrinks_while_read(tree, monkeypatch):
+    real_stat = os.stat
+
+    def stat(path, *args, **kwargs):
+        st = real_stat(path, *args, **kwargs)
+        if str(path).endswith('a.txt'):
+            # Seen at its old, larger size, as if truncated after the stat
+            fields = list(st)
+            fields[6] += 10000
+            return os.stat_result(fields)
+        return st
+    monkeypatch.setattr(archives.os, 'stat', stat)
+    data = b''.join(archives.iter_tar(archives.iter_tree(str(tree), 'archive')))
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        member = archive.extractfile('archive/a.txt').read()
+        assert member == b'alpha' * 1000 + b'\0' * 10000
+        assert archive.extractfile('archive/sub/b.bin').read() == (tree / 'sub' / 'b.bin').read_bytes()
+
+def test_entries_that_vanish_are_skipped(tree, tmp_path):
+    entries = [(str(tmp_path / 'gone.txt'), 'gone.txt'), (str(tree / 'a.txt'), 'a.txt')]
+    with zipfile.ZipFile(io.BytesIO(b''.join(archives.iter_zip(iter(entries))))) as archive:
+        assert archive.namelist() == ['a.txt']
+    with tarfile.open(fileobj=io.BytesIO(b''.join(archives.iter_tar(iter(entries))))) as archive:
+        assert archive.getnames() == ['a.txt']
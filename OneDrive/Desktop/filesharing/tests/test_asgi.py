@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+import pytest
+import requests
+
+uvicorn = pytest.importorskip('uvicorn')
+
+BOUNDARY = 'asgiboundary'
+
+@pytest.fixture(scope='module')
+def asgi_server(shared_dir):
+    """Serve asgi.application from uvicorn on a free port, sharing shared_dir"""
+    import app
+    import asgi
+
+    app.apply_shared_folder(str(shared_dir))
+    app.state.set('shared_folder', str(shared_dir))
+    server = uvicorn.Server(uvicorn.Config(asgi.application, host='127.0.0.1', port=0, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join()
+
+@pytest.fixture(autouse=True)
+def uploads(shared_dir):
+    folder = shared_dir / 'asgi'
+    folder.mkdir(exist_ok=True)
+    for name in os.listdir(shared_dir):
+        if os.path.isfile(shared_dir / name):
+            os.remove(shared_dir / name)
+    return folder
+
+def multipart(filename, data):
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n\r\n'
+            ).encode() + data + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+def post(asgi_server, body):
+    return requests.post(f"{asgi_server}/upload", data=body, timeout=30,
+                         headers={'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'})
+
+def test_download_and_range_are_streamed(asgi_server, uploads):
+    data = os.urandom(200000)
+    (uploads / 'blob.bin').write_bytes(data)
+    headers = {'Accept-Encoding': 'identity'}
+    response = requests.get(f"{asgi_server}/download/asgi/blob.bin", headers=headers, timeout=30)
+    assert response.status_code == 200
+    assert response.content == data
+    response = requests.get(f"{asgi_server}/download/asgi/blob.bin", timeout=30,
+                            headers=dict(headers, Range='bytes=100000-100099'))
+    assert response.status_code == 206
+    assert response.content == data[100000:100100]
+
+def test_upload_is_parsed_on_the_event_loop(asgi_server, shared_dir):
+    response = post(asgi_server, multipart('loop.bin', b'l' * 300000))
+    assert response.status_code == 200
+    assert (shared_dir / 'loop.bin').read_bytes() == b'l' * 300000
+
+def test_cut_off_upload_is_a_400(asgi_server, shared_dir):
+    response = post(asgi_server, multipart('cut.bin', b'c' * 300000)[:-1000])
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Malformed multipart body'
+    assert not [name for name in os.listdir(shared_dir) if name != 'asgi']
+
+def test_event_stream_delivers_published_events(asgi_server):
+    import app
+
+    with requests.get(f"{asgi_server}/api/events", stream=True, timeout=30) as response:
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/event-stream')
+        app.event_broker.publish('folder', {'path': 'asgi'})
+        received = b''
+        deadline = time.monotonic() + 10
+        for chunk in response.iter_content(None):
+            received += chunk
+            if b'event: folder' in received or time.monotonic() > deadline:
+                break
+    assert b'"path": "asgi"' in received or b'"path":"asgi"' in received
@@ -0,0 +1,80 @@
+import os
+import json
+import base64
+import pytest
+import requests
+
+@pytest.fixture(scope='module')
+def big(shared_dir):
+    folder = shared_dir / 'pages'
+    folder.mkdir()
+    for i in range(250):
+        (folder / f'f{i:03d}.txt').write_bytes(b'x')
+    return folder
+
+def browse(server, **params):
+    return requests.get(f"{server}/api/browse/pages", params=params, timeout=30)
+
+def walk(server, **params):
+    """Follow next_cursor to the end, returning every name seen"""
+    names, cursor = [], None
+    while True:
+        data = browse(server, cursor=cursor or '', **params).json()
+        names += [item['name'] for item in data['items']]
+        cursor = data['next_cursor']
+        if not cursor:
+            return names
+
+def cursor_for(name, index):
+    raw = json.dumps({'n': name, 'i': index}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def test_pages_cover_the_folder_once(server, big):
+    first = browse(server, limit=100).json()
+    assert len(first['items']) == 100 and first['total_count'] == 250
+    names = walk(server, limit=100)
+    assert names == sorted(os.listdir(big))
+
+def test_limit_is_clamped(server, big):
+    import app
+
+    assert len(browse(server, limit=0).json()['items']) == 1
+    assert len(browse(server, limit=10 ** 9).json()['items']) == min(250, app.browse_max_page_size)
+
+def test_deleting_the_cursor_entry_does_not_skip_or_repeat(server, big):
+    first = browse(server, limit=10).json()
+    last = first['items'][-1]['name']
+    os.remove(big / last)
+    try:
+        second = browse(server, limit=10, cursor=first['next_cursor']).json()
+        assert second['items'][0]['name'] == 'f010.txt'
+    finally:
+        (big / last).write_bytes(b'x')
+
+@pytest.mark.parametrize('cursor', ['!!!', 'bm90IGpzb24', cursor_for('f001.txt', -50),
+                                    base64.urlsafe_b64encode(b'[1, 2]').decode()])
+def test_malformed_cursor_is_a_400(server, big, cursor):
+    response = browse(server, cursor=cursor)
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Invalid cursor'
+
+def test_non_numeric_limit_is_a_400(server, big):
+    assert browse(server, limit='many').status_code == 400
+
+def test_ndjson_streams_every_entry(server, big):
+    for response in (browse(server, stream='1'),
+                     requests.get(f"{server}/api/browse/pages", headers={'Accept': 'application/x-ndjson'},
+                                  timeout=30)):
+        assert response.headers['Content-Type'].startswith('application/x-ndjson')
+        records = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted(record['name'] for record in records) == sorted(os.listdir(big))
+        assert all(record['type'] == 'file' and record['size'] == 1 for record in records)
+
+def test_page_etag_revalidates(server, big):
+    response = browse(server, limit=5)
+    again = requests.get(f"{server}/api/browse/pages", params={'limit': 5}, timeout=30,
+                         headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+    other = requests.get(f"{server}/api/browse/pages", params={'limit': 6}, timeout=30,
+                         headers={'If-None-Match': response.headers['ETag']})
+    assert other.status_code == 200
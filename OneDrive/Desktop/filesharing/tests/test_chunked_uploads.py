@@ -0,0 +1,104 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+
+CHUNK = 64 * 1024
+
+@pytest.fixture(scope='module')
+def target(shared_dir):
+    folder = shared_dir / 'chunked'
+    folder.mkdir()
+    return folder
+
+def create(server, **data):
+    return requests.post(f"{server}/api/uploads", json=data, timeout=30)
+
+def put_chunk(server, upload_id, index, data, **headers):
+    return requests.put(f"{server}/api/uploads/{upload_id}/chunks/{index}", data=data, headers=headers, timeout=30)
+
+def commit(server, upload_id, **data):
+    return requests.post(f"{server}/api/uploads/{upload_id}/commit", json=data, timeout=30)
+
+def test_chunks_in_any_order_are_assembled(server, target):
+    data = os.urandom(CHUNK * 5 + 1234)
+    session = create(server, filename='big.bin', size=len(data), path='chunked', chunk_size=CHUNK).json()
+    assert session['total_chunks'] == 6
+    upload_id = session['upload_id']
+
+    def send(index):
+        piece = data[index * CHUNK:(index + 1) * CHUNK]
+        response = put_chunk(server, upload_id, index, piece, **{'X-Chunk-SHA256': hashlib.sha256(piece).hexdigest()})
+        assert response.status_code == 200
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        list(pool.map(send, [5, 0, 3, 1, 4, 2]))
+    status = requests.get(f"{server}/api/uploads/{upload_id}", timeout=30).json()
+    assert status['complete'] and status['received'] == list(range(6))
+
+    response = commit(server, upload_id, sha256=hashlib.sha256(data).hexdigest())
+    assert response.status_code == 200
+    assert (target / 'big.bin').read_bytes() == data
+
+def test_interrupted_upload_resumes_from_its_status(server, target):
+    data = os.urandom(CHUNK * 3)
+    upload_id = create(server, filename='resume.bin', size=len(data), path='chunked', chunk_size=CHUNK).json()['upload_id']
+    put_chunk(server, upload_id, 1, data[CHUNK:2 * CHUNK])
+
+    status = requests.get(f"{server}/api/uploads/{upload_id}", timeout=30).json()
+    assert status['received'] == [1] and not status['complete']
+    assert commit(server, upload_id).status_code == 409
+    for index in set(range(3)) - set(status['received']):
+        put_chunk(server, upload_id, index, data[index * CHUNK:(index + 1) * CHUNK])
+    assert commit(server, upload_id).status_code == 200
+    assert (target / 'resume.bin').read_bytes() == data
+
+def test_checksum_mismatches_are_rejected(server, target):
+    data = b'x' * CHUNK
+    upload_id = create(server, filename='bad.bin', size=CHUNK, path='chunked', chunk_size=CHUNK).json()['upload_id']
+    assert put_chunk(server, upload_id, 0, data, **{'X-Chunk-SHA256': '0' * 64}).status_code == 422
+    assert put_chunk(server, upload_id, 0, data).status_code == 200
+    assert commit(server, upload_id, sha256='0' * 64).status_code == 422
+    assert not (target / 'bad.bin').exists()
+
+def test_wrong_chunk_length_and_index(server):
+    upload_id = create(server, filename='len.bin', size=CHUNK + 10, chunk_size=CHUNK).json()['upload_id']
+    assert put_chunk(server, upload_id, 1, b'short').status_code == 400
+    assert put_chunk(server, upload_id, 2, b'x' * 10).status_code == 400
+
+def test_empty_file(server, shared_dir):
+    upload_id = create(server, filename='empty.txt', size=0).json()['upload_id']
+    # Sent without a Content-Length at all
+    response = requests.put(f"{server}/api/uploads/{upload_id}/chunks/0", data=iter([]), timeout=30)
+    assert response.status_code == 200
+    assert commit(server, upload_id).status_code == 200
+    assert (shared_dir / 'empty.txt').read_bytes() == b''
+
+@pytest.mark.parametrize('body', ['[1, 2]', '"text"', '42'])
+def test_json_that_is_not_an_object_is_a_400(server, body):
+    response = requests.post(f"{server}/api/uploads", data=body, timeout=30,
+                             headers={'Content-Type': 'application/json'})
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Expected a JSON object'
+
+@pytest.mark.parametrize('data', [
+    {'filename': 'a.bin', 'size': -1},
+    {'filename': 'a.bin', 'size': 'lots'},
+    {'filename': 'a.bin', 'size': 10, 'chunk_size': 10 ** 12},
+    {'filename': '', 'size': 10},
+    {'filename': 12, 'size': 10, 'path': ['not', 'a', 'path']},
+])
+def test_invalid_sessions_are_a_4xx(server, data):
+    response = create(server, **data)
+    assert 400 <= response.status_code < 500
+    assert 'error' in response.json()
+
+@pytest.mark.parametrize('size', [10 ** 30, 2 ** 62])
+def test_sizes_that_cannot_fit_are_a_507(server, size):
+    response = create(server, filename='huge.bin', size=size)
+    assert response.status_code == 507
+    assert 'error' in response.json()
+
+def test_unknown_session_is_a_404(server):
+    assert requests.get(f"{server}/api/uploads/not-a-session", timeout=30).status_code == 404
@@ -0,0 +1,87 @@
+import os
+import gzip
+import time
+import pytest
+import requests
+from compression import CompressionCache
+
+TEXT = b'\n'.join(b'line %d of a very repetitive log file' % i for i in range(5000))
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    import app
+
+    cache = CompressionCache(str(tmp_path / 'variants'))
+    monkeypatch.setattr(app, 'compression_cache', cache)
+    return cache
+
+@pytest.fixture(scope='module')
+def folder(shared_dir):
+    folder = shared_dir / 'compress'
+    folder.mkdir()
+    (folder / 'app.log').write_bytes(TEXT)
+    (folder / 'tiny.txt').write_bytes(b'small')
+    (folder / 'photo.bin').write_bytes(os.urandom(50000))
+    return folder
+
+def get(server, name, encoding='gzip', **headers):
+    # requests would decode the body, so ask for the raw bytes
+    response = requests.get(f"{server}/download/compress/{name}", stream=True, timeout=30,
+                            headers=dict({'Accept-Encoding': encoding}, **headers))
+    response.raw.decode_content = False
+    return response, response.raw.read()
+
+def test_text_is_sent_gzipped_once_and_then_from_the_cache(server, folder, cache):
+    response, body = get(server, 'app.log')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert int(response.headers['Content-Length']) == len(body) < len(TEXT) // 5
+    assert gzip.decompress(body) == TEXT
+    get(server, 'app.log')
+    stats = cache.stats()
+    assert (stats['misses'], stats['hits'], stats['entries']) == (1, 1, 1)
+
+@pytest.mark.parametrize('name, headers', [
+    ('tiny.txt', {}),
+    ('photo.bin', {}),
+    ('app.log', {'Range': 'bytes=0-99'}),
+])
+def test_small_binary_and_ranged_requests_are_sent_as_they_are(server, folder, cache, name, headers):
+    response, body = get(server, name, **headers)
+    assert 'Content-Encoding' not in response.headers
+    assert body == (folder / name).read_bytes()[:len(body)]
+    assert cache.stats()['entries'] == 0
+
+def test_refused_coding_is_not_used(server, folder, cache):
+    response, body = get(server, 'app.log', encoding='gzip;q=0, identity')
+    assert 'Content-Encoding' not in response.headers
+    assert body == TEXT
+
+def test_file_edited_in_place_gets_a_fresh_variant(server, folder, cache):
+    first, _ = get(server, 'app.log')
+    path = folder / 'app.log'
+    with open(path, 'r+b') as f:
+        f.write(b'LINE')
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 2_000_000_000))
+    try:
+        second, body = get(server, 'app.log')
+        assert second.headers['ETag'] != first.headers['ETag']
+        assert gzip.decompress(body) == b'LINE' + TEXT[4:]
+    finally:
+        path.write_bytes(TEXT)
+
+def test_variant_evicted_by_another_worker_is_compressed_again(server, folder, cache, tmp_path):
+    get(server, 'app.log')
+    for name in os.listdir(tmp_path / 'variants'):
+        os.remove(tmp_path / 'variants' / name)
+    response, body = get(server, 'app.log')
+    assert response.status_code == 200
+    assert gzip.decompress(body) == TEXT
+    assert cache.stats()['misses'] == 2
+
+def test_variant_larger_than_the_cache_is_not_kept(server, folder, cache, monkeypatch):
+    monkeypatch.setattr(cache._files, 'max_bytes', 10)
+    response, body = get(server, 'app.log')
+    assert 'Content-Encoding' not in response.headers
+    assert body == TEXT
+    assert cache.stats()['entries'] == 0
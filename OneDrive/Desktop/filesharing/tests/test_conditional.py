@@ -0,0 +1,59 @@
+import os
+import time
+import pytest
+import requests
+
+@pytest.fixture(autouse=True)
+def folder(shared_dir):
+    folder = shared_dir / 'conditional'
+    folder.mkdir(exist_ok=True)
+    for name in os.listdir(folder):
+        os.remove(folder / name)
+    (folder / 'notes.txt').write_bytes(b'first line\n')
+    return folder
+
+def get(server, path, **headers):
+    return requests.get(f"{server}{path}", headers=dict({'Accept-Encoding': 'identity'}, **headers), timeout=30)
+
+def test_download_revalidates_with_its_etag(server):
+    response = get(server, '/download/conditional/notes.txt')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert get(server, '/download/conditional/notes.txt', **{'If-None-Match': etag}).status_code == 304
+    modified = get(server, '/download/conditional/notes.txt', **{'If-Modified-Since': response.headers['Last-Modified']})
+    assert modified.status_code == 304
+
+def test_download_etag_changes_when_the_file_is_written_in_place(server, folder):
+    etag = get(server, '/download/conditional/notes.txt').headers['ETag']
+    with open(folder / 'notes.txt', 'ab') as f:
+        f.write(b'second line\n')
+    response = get(server, '/download/conditional/notes.txt', **{'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.content == b'first line\nsecond line\n'
+
+@pytest.mark.parametrize('path', ['/api/browse/conditional', '/api/browse/conditional?sort=size', '/browse/conditional'])
+def test_unchanged_listing_is_a_304(server, path):
+    response = get(server, path)
+    assert response.status_code == 200
+    assert get(server, path, **{'If-None-Match': response.headers['ETag']}).status_code == 304
+
+@pytest.mark.parametrize('path', ['/api/browse/conditional', '/browse/conditional'])
+def test_listing_validators_change_when_a_file_is_written_in_place(server, folder, path):
+    import app
+
+    response = get(server, path)
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    directory_mtime = os.stat(folder).st_mtime_ns
+
+    with open(folder / 'notes.txt', 'ab') as f:
+        f.write(b'second line\n')
+    os.utime(folder / 'notes.txt', (time.time() + 5, time.time() + 5))
+    assert os.stat(folder).st_mtime_ns == directory_mtime
+
+    time.sleep(app.listing_cache.revalidate_after + 0.1)
+    assert get(server, path, **{'If-None-Match': etag}).status_code == 200
+    assert get(server, path, **{'If-Modified-Since': last_modified}).status_code == 200
+    response = get(server, path)
+    assert response.headers['ETag'] != etag
+    if path.startswith('/api/'):
+        assert response.json()['items'][0]['size'] == len(b'first line\nsecond line\n')
@@ -0,0 +1,91 @@
+import os
+import time
+import hashlib
+import pytest
+import requests
+from dedup import ContentIndex, link_duplicate, hash_file, min_dedup_size
+
+BOUNDARY = 'dedupboundary'
+
+def upload(server, filename, data):
+    body = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n\r\n'
+            ).encode() + data + f'\r\n--{BOUNDARY}--\r\n'.encode()
+    response = requests.post(f"{server}/upload", data=body, timeout=30,
+                             headers={'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'})
+    assert response.status_code == 200
+    return response.json()['results'][0]
+
+@pytest.fixture
+def index(tmp_path):
+    root = tmp_path / 'share'
+    root.mkdir()
+    index = ContentIndex(str(tmp_path / 'index' / 'files.sqlite3'), str(root))
+    yield index
+    index.close()
+
+def write(path, data):
+    path.write_bytes(data)
+    return hash_file(path)
+
+def test_identical_upload_is_linked_to_the_first(server, shared_dir):
+    data = os.urandom(min_dedup_size * 2)
+    first = upload(server, 'original.bin', data)
+    assert 'duplicate_of' not in first
+    second = upload(server, 'copy.bin', data)
+    assert second['duplicate_of'] == 'original.bin'
+    assert second['dedup'] in ('reflink', 'hardlink')
+    assert (shared_dir / 'copy.bin').read_bytes() == data
+    if second['dedup'] == 'hardlink':
+        assert os.stat(shared_dir / 'copy.bin').st_ino == os.stat(shared_dir / 'original.bin').st_ino
+
+def test_small_uploads_are_left_alone(server, shared_dir):
+    data = b's' * 100
+    upload(server, 'small-1.txt', data)
+    assert 'duplicate_of' not in upload(server, 'small-2.txt', data)
+
+def test_file_edited_in_place_is_not_linked_to(index, tmp_path):
+    root = tmp_path / 'share'
+    data = os.urandom(min_dedup_size)
+    sha256 = write(root / 'a.bin', data)
+    index.record(str(root / 'a.bin'), sha256)
+    with open(root / 'a.bin', 'r+b') as f:
+        f.write(b'edited')
+    os.utime(root / 'a.bin', ns=(time.time_ns(), time.time_ns() + 2_000_000_000))
+
+    write(root / 'b.bin', data)
+    assert index.deduplicate(str(root / 'b.bin'), sha256) == (None, None)
+    assert (root / 'b.bin').read_bytes() == data
+    # The stale row was dropped on the way; only the new file is indexed
+    assert index.stats() == {'files': 1, 'distinct_contents': 1}
+
+def test_deleted_original_is_not_linked_to(index, tmp_path):
+    root = tmp_path / 'share'
+    data = os.urandom(min_dedup_size)
+    sha256 = write(root / 'a.bin', data)
+    index.record(str(root / 'a.bin'), sha256)
+    os.remove(root / 'a.bin')
+    write(root / 'b.bin', data)
+    assert index.deduplicate(str(root / 'b.bin'), sha256) == (None, None)
+
+def test_scan_catches_up_and_forgets(index, tmp_path):
+    root = tmp_path / 'share'
+    (root / 'sub').mkdir()
+    data = os.urandom(min_dedup_size)
+    write(root / 'one.bin', data)
+    write(root / 'sub' / 'two.bin', data)
+    (root / '.three.bin.0123456789ab.uploading').write_bytes(data)
+    (root / 'tiny.txt').write_bytes(b'tiny')
+    index.scan()
+    assert index.stats() == {'files': 2, 'distinct_contents': 1}
+    assert index.find(hashlib.sha256(data).hexdigest(), len(data)) is not None
+
+    os.remove(root / 'one.bin')
+    os.remove(root / 'sub' / 'two.bin')
+    index.scan()
+    assert index.stats() == {'files': 0, 'distinct_contents': 0}
+
+def test_failed_link_keeps_the_upload(tmp_path):
+    (tmp_path / 'upload.bin').write_bytes(b'data')
+    assert link_duplicate(str(tmp_path / 'missing.bin'), str(tmp_path / 'upload.bin')) is None
+    assert (tmp_path / 'upload.bin').read_bytes() == b'data'
+    assert os.listdir(tmp_path) == ['upload.bin']
@@ -0,0 +1,170 @@
+import os
+import json
+import pytest
+import requests
+import delta
+from delta import MAGIC, RECORD, compute_signature, parse_signature, match_blocks, missing_ranges
+from delta_sync import delta_sync, DeltaSyncError
+
+BLOCK = 4096
+
+def signature(tmp_path, data, name='new.bin'):
+    source = tmp_path / name
+    source.write_bytes(data)
+    manifest = tmp_path / f'{name}.sig'
+    compute_signature(str(source), str(manifest), '"etag"')
+    return manifest.read_bytes()
+
+def test_manifest_round_trips(tmp_path):
+    data = os.urandom(BLOCK * 3 + 100)
+    header, blocks = parse_signature(signature(tmp_path, data))
+    assert header['size'] == len(data) and header['block_size'] == BLOCK
+    assert len(blocks) == 4
+
+def test_block_size_grows_to_cap_the_block_count(monkeypatch):
+    monkeypatch.setattr(delta, 'max_blocks', 4)
+    assert delta.block_size_for(4 * BLOCK) == BLOCK
+    assert delta.block_size_for(4 * BLOCK + 1) == 2 * BLOCK
+
+@pytest.mark.parametrize('cut', [1, RECORD.size, 2 * RECORD.size])
+def test_truncated_manifests_are_rejected(tmp_path, cut):
+    # Cutting whole records used to pass and fail later with an IndexError
+    manifest = signature(tmp_path, os.urandom(BLOCK * 3))
+    with pytest.raises(ValueError):
+        parse_signature(manifest[:-cut])
+
+@pytest.mark.parametrize('manifest', [
+    b'',
+    b'GIF89a',
+    MAGIC + b'{"size": 1',
+    MAGIC + b'not json\n',
+    MAGIC + b'[1, 2]\n',
+    MAGIC + json.dumps({'size': 10, 'block_size': 0, 'sha256': '', 'etag': ''}).encode() + b'\n',
+    MAGIC + json.dumps({'size': -1, 'block_size': BLOCK, 'sha256': '', 'etag': ''}).encode() + b'\n',
+    MAGIC + json.dumps({'size': 10, 'block_size': BLOCK}).encode() + b'\n' + b'\0' * RECORD.size,
+])
+def test_malformed_manifests_are_rejected(manifest):
+    with pytest.raises(ValueError):
+        parse_signature(manifest)
+
+def test_inserted_and_deleted_bytes_cost_only_the_blocks_around_them(tmp_path):
+    new = os.urandom(BLOCK * 20)
+    header, blocks = parse_signature(signature(tmp_path, new))
+    old = tmp_path / 'old.bin'
+    # The old copy lacks 100 bytes in block 5 and has 7 extra in block 12
+    old.write_bytes(new[:5 * BLOCK] + new[5 * BLOCK + 100:12 * BLOCK] + b'extra!!' + new[12 * BLOCK:])
+    found = match_blocks(str(old), header, blocks)
+    assert set(range(20)) - set(found) == {5}
+    assert found[13] == 13 * BLOCK - 100 + 7
+    assert missing_ranges(header, len(blocks), found) == [(5 * BLOCK, 6 * BLOCK - 1)]
+
+def test_short_last_block_is_only_matched_in_place(tmp_path):
+    new = os.urandom(BLOCK * 2 + 10)
+    header, blocks = parse_signature(signature(tmp_path, new))
+    old = tmp_path / 'old.bin'
+    old.write_bytes(new)
+    assert match_blocks(str(old), header, blocks) == {0: 0, 1: BLOCK, 2: 2 * BLOCK}
+    old.write_bytes(b'x' + new)
+    found = match_blocks(str(old), header, blocks)
+    assert 2 not in found
+    assert missing_ranges(header, len(blocks), found) == [(2 * BLOCK, 2 * BLOCK + 9)]
+
+def test_empty_copies_match_nothing(tmp_path):
+    header, blocks = parse_signature(signature(tmp_path, os.urandom(BLOCK)))
+    (tmp_path / 'empty.bin').write_bytes(b'')
+    assert match_blocks(str(tmp_path / 'empty.bin'), header, blocks) == {}
+    header, blocks = parse_signature(signature(tmp_path, b'', 'nothing.bin'))
+    assert blocks == [] and missing_ranges(header, 0, {}) == []
+
+@pytest.fixture(scope='module')
+def remote(shared_dir):
+    folder = shared_dir / 'delta'
+    folder.mkdir()
+    return folder
+
+def test_signature_endpoint(server, remote):
+    data = os.urandom(BLOCK * 3)
+    (remote / 'sig.bin').write_bytes(data)
+    url = f"{server}/api/signature/delta/sig.bin"
+    response = requests.get(url, timeout=30)
+    assert response.status_code == 200
+    header, blocks = parse_signature(response.content)
+    assert header['size'] == len(data) and len(blocks) == 3
+    assert requests.get(url, headers={'If-None-Match': response.headers['ETag']}, timeout=30).status_code == 304
+
+    # A changed file gets a manifest of its own
+    (remote / 'sig.bin').write_bytes(data + b'more')
+    os.utime(remote / 'sig.bin', (1, 1))
+    header, _ = parse_signature(requests.get(url, timeout=30).content)
+    assert header['size'] == len(data) + 4
+
+    assert requests.get(f"{server}/api/signature/delta/none.bin", timeout=30).status_code == 404
+    assert requests.get(f"{server}/api/signature/..%2F..%2Fetc%2Fpasswd", timeout=30).status_code in (403, 404)
+
+def test_sync_fetches_only_the_modified_block(server, remote, tmp_path):
+    data = os.urandom(BLOCK * 16)
+    local = tmp_path / 'copy.bin'
+    local.write_bytes(data)
+    # Modified in place, on the server: one block rewritten, same size
+    changed = bytearray(data)
+    changed[7 * BLOCK + 10:7 * BLOCK + 20] = os.urandom(10)
+    (remote / 'doc.bin').write_bytes(bytes(changed))
+
+    result = delta_sync(server, 'delta/doc.bin', str(local))
+    assert local.read_bytes() == bytes(changed)
+    assert result['downloaded_bytes'] == BLOCK and result['requests'] == 1
+    assert not os.path.exists(f"{local}.delta-tmp")
+
+def test_sync_without_a_local_copy_downloads_everything(server, remote, tmp_path):
+    data = os.urandom(BLOCK * 2 + 5)
+    (remote / 'fresh.bin').write_bytes(data)
+    result = delta_sync(server, 'delta/fresh.bin', str(tmp_path / 'missing.bin'), str(tmp_path / 'out.bin'))
+    assert (tmp_path / 'out.bin').read_bytes() == data
+    assert result['downloaded_bytes'] == len(data) and result['reused_bytes'] == 0
+
+def test_missing_remote_file_is_an_error(server, tmp_path):
+    with pytest.raises(DeltaSyncError, match='HTTP 404'):
+        delta_sync(server, 'delta/not-there.bin', str(tmp_path / 'x.bin'))
+
+class ChangingSession(requests.Session):
+    """Runs on_signature() once the manifest has been fetched, to simulate a change in between"""
+
+    def __init__(self, on_signature):
+        super().__init__()
+        self.on_signature = on_signature
+
+    def get(self, url, **kwargs):
+        response = super().get(url, **kwargs)
+        if '/api/signature/' in url:
+            self.on_signature(response)
+        return response
+
+def test_remote_file_changing_during_the_sync_is_an_error(server, remote, tmp_path):
+    data = os.urandom(BLOCK * 4)
+    (remote / 'moving.bin').write_bytes(data)
+    local = tmp_path / 'moving.bin'
+    local.write_bytes(data[:BLOCK])
+
+    def rewrite(response):
+        (remote / 'moving.bin').write_bytes(os.urandom(BLOCK * 4))
+        os.utime(remote / 'moving.bin', (2, 2))
+
+    with pytest.raises(DeltaSyncError, match='changed during the sync'):
+        delta_sync(server, 'delta/moving.bin', str(local), session=ChangingSession(rewrite))
+    assert local.read_bytes() == data[:BLOCK]
+    assert not os.path.exists(f"{local}.delta-tmp")
+
+def test_checksum_mismatch_keeps_the_old_copy(server, remote, tmp_path):
+    data = os.urandom(BLOCK * 4)
+    (remote / 'sum.bin').write_bytes(data)
+    local = tmp_path / 'sum.bin'
+    local.write_bytes(data[:2 * BLOCK])
+
+    def corrupt(response):
+        response._content = response.content.replace(
+            json.loads(response.content[len(MAGIC):response.content.index(b'\n')])['sha256'].encode(), b'0' * 64)
+
+    with pytest.raises(DeltaSyncError, match='Checksum mismatch'):
+        delta_sync(server, 'delta/sum.bin', str(local), session=ChangingSession(corrupt))
+    assert local.read_bytes() == data[:2 * BLOCK]
+    assert not os.path.exists(f"{local}.delta-tmp")
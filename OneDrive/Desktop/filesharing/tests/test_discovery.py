@@ -0,0 +1,128 @@
+import json
+import time
+import socket
+import pytest
+import requests
+import discovery
+from discovery import Discovery, PeerDirectory, parse_announcement, PROTOCOL
+
+def datagram(**fields):
+    return json.dumps(dict({'protocol': PROTOCOL, 'id': 'abc', 'port': 8080}, **fields)).encode()
+
+def test_announcement_becomes_a_peer():
+    peer = parse_announcement(datagram(name='Office', share='Docs', users=3, load=0.5), '192.168.1.20')
+    assert peer == {'id': 'abc', 'name': 'Office', 'ip': '192.168.1.20', 'port': 8080,
+                    'url': 'http://192.168.1.20:8080', 'share': 'Docs', 'users': 3, 'load': 0.5, 'bye': False}
+
+def test_missing_and_oversized_fields_are_defaulted_or_cut():
+    peer = parse_announcement(datagram(id='x' * 500, name='n' * 500), '10.0.0.5')
+    assert len(peer['id']) == 64 and len(peer['name']) == 100
+    peer = parse_announcement(datagram(), '10.0.0.5')
+    assert peer['name'] == '10.0.0.5' and peer['share'] is None and peer['users'] == 0
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'\xff\xfe not utf-8',
+    b'{"protocol": "lan-filesharing/1", "id": "abc", "po',
+    b'[1, 2, 3]',
+    b'"just a string"',
+    json.dumps({'protocol': 'someone-else/1', 'id': 'abc', 'port': 8080}).encode(),
+    json.dumps({'protocol': PROTOCOL, 'port': 8080}).encode(),
+    datagram(port=0),
+    datagram(port=70000),
+    datagram(port='http'),
+    datagram(users='many'),
+    # Both used to escape parse_announcement, the first killing the listener thread
+    b'{"protocol": "lan-filesharing/1", "id": "abc", "port": 8080, "users": Infinity}',
+    b'{"protocol": "lan-filesharing/1", "id": "abc", "port": 8080, "load": NaN}',
+])
+def test_malformed_datagrams_are_ignored(data):
+    assert parse_announcement(data, '10.0.0.5') is None
+
+def test_directory_expires_quiet_peers():
+    directory = PeerDirectory(ttl=10)
+    directory.update(parse_announcement(datagram(id='old', name='b'), '10.0.0.1'), now=time.monotonic() - 60)
+    directory.update(parse_announcement(datagram(id='new', name='a'), '10.0.0.2'))
+    assert [peer['id'] for peer in directory.peers()] == ['new']
+    assert directory.get('old') is None
+    assert directory.find('10.0.0.2', 8080)['id'] == 'new'
+    assert directory.find('10.0.0.2', 9090) is None
+    assert directory.stats() == {'peers': 1, 'announcements': 2}
+
+def test_peers_are_listed_by_name_without_the_bye_flag():
+    directory = PeerDirectory()
+    for peer_id, name in (('1', 'zeta'), ('2', 'Alpha'), ('3', 'beta')):
+        directory.update(parse_announcement(datagram(id=peer_id, name=name), '10.0.0.1'))
+    peers = directory.peers()
+    assert [peer['name'] for peer in peers] == ['Alpha', 'beta', 'zeta']
+    assert all('bye' not in peer and peer['age'] >= 0 for peer in peers)
+    directory.remove('2')
+    directory.remove('unknown')
+    assert len(directory.peers()) == 2
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def listening(monkeypatch):
+    """A started Discovery announcing to, and listening on, a free port on loopback"""
+    monkeypatch.setattr(discovery, 'announce_interval', 0.1)
+    udp_port = free_udp_port()
+    status = {'name': 'me', 'share': None, 'users': 0, 'load': 0}
+    instance = Discovery(free_udp_port(), lambda: status, '127.0.0.1', udp_port)
+    instance.start()
+    yield instance
+    instance.stop()
+
+def send(instance, data):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.sendto(data, ('127.0.0.1', instance.udp_port))
+
+def wait_for(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+def test_listener_survives_garbage_and_ignores_itself(listening):
+    assert listening.error is None
+    for data in (b'\xff' * 100, b'{"protocol": "lan-filesharing/1", "id": "x", "port": 1, "users": Infinity}',
+                 b'x' * (discovery.max_datagram + 100)):
+        send(listening, data)
+    send(listening, datagram(id='peer', name='Other', port=9000))
+    assert wait_for(lambda: listening.directory.get('peer') is not None)
+    # Its own announcements come back over loopback but are never listed
+    assert wait_for(lambda: listening.directory.stats()['announcements'] >= 1)
+    assert [peer['id'] for peer in listening.directory.peers()] == ['peer']
+
+    send(listening, datagram(id='peer', port=9000, bye=True))
+    assert wait_for(lambda: listening.directory.get('peer') is None)
+
+def test_own_announcement_describes_this_server(listening):
+    message = json.loads(listening.announcement())
+    assert message['protocol'] == PROTOCOL and message['port'] == listening.port
+    assert message['id'] == listening.instance_id and 'bye' not in message
+    assert json.loads(listening.announcement(bye=True))['bye'] is True
+
+def test_unusable_address_disables_discovery_with_an_error(monkeypatch, capsys):
+    instance = Discovery(free_udp_port(), dict, '127.0.0.1', free_udp_port())
+    monkeypatch.setattr(instance, '_listen_socket', lambda: (_ for _ in ()).throw(OSError('no multicast here')))
+    instance.start()
+    assert 'no multicast here' in instance.error
+    assert 'Discovery unavailable' in capsys.readouterr().out
+
+def test_api_lists_peers_from_the_table(server, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'discovery', None)
+    assert requests.get(f"{server}/api/peers", timeout=30).json() == {'enabled': False, 'peers': []}
+
+    instance = Discovery(free_udp_port(), dict, '127.0.0.1', free_udp_port())
+    instance.directory.update(parse_announcement(datagram(id='p1', name='Lab', load=1.25), '10.0.0.9'))
+    monkeypatch.setattr(app, 'discovery', instance)
+    response = requests.get(f"{server}/api/peers", timeout=30).json()
+    assert response['enabled'] and response['error'] is None
+    assert [(peer['name'], peer['url'], peer['load']) for peer in response['peers']] == \
+        [('Lab', 'http://10.0.0.9:8080', 1.25)]
@@ -0,0 +1,111 @@
+import os
+import time
+import pytest
+import requests
+from utils import DiskLRU
+from federation import RemoteFileCache
+
+def write(cache, name, data):
+    tmp_path = cache.temp_path(name)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    return cache.add(name, tmp_path)
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = DiskLRU(str(tmp_path), max_bytes=250)
+    for name in ('a', 'b'):
+        write(cache, name, b'x' * 100)
+    assert cache.get('a') is not None
+    write(cache, 'c', b'x' * 100)
+    assert sorted(os.listdir(tmp_path)) == ['a', 'c']
+    assert cache.total_bytes == 200 and len(cache) == 2
+
+def test_file_over_the_limit_is_not_kept_unless_newest_is(tmp_path):
+    assert write(DiskLRU(str(tmp_path / 'plain'), max_bytes=10), 'big', b'x' * 100) is None
+    cache = DiskLRU(str(tmp_path / 'keep'), max_bytes=10, keep_newest=True)
+    write(cache, 'old', b'x' * 100)
+    assert write(cache, 'big', b'x' * 100) is not None
+    assert os.listdir(tmp_path / 'keep') == ['big']
+
+def test_restart_indexes_by_access_time_and_drops_temp_files(tmp_path):
+    for name in ('new', 'old', 'mid'):
+        (tmp_path / name).write_bytes(b'x' * 100)
+    for name, atime in (('old', 1000), ('mid', 2000), ('new', 3000)):
+        os.utime(tmp_path / name, (atime, atime))
+    (tmp_path / 'half.123.tmp').write_bytes(b'unfinished')
+    cache = DiskLRU(str(tmp_path), max_bytes=200)
+    assert sorted(os.listdir(tmp_path)) == ['mid', 'new']
+    assert cache.total_bytes == 200
+
+def test_file_deleted_by_another_worker_is_unindexed(tmp_path):
+    cache = DiskLRU(str(tmp_path), max_bytes=1000)
+    path = write(cache, 'a', b'x' * 100)
+    # Another process sharing the directory evicts it
+    DiskLRU(str(tmp_path), max_bytes=0)
+    assert not os.path.exists(path)
+    assert cache.get('a') is None
+    assert cache.total_bytes == 0 and len(cache) == 0
+
+def test_discard_only_drops_missing_files(tmp_path):
+    cache = DiskLRU(str(tmp_path), max_bytes=1000)
+    path = write(cache, 'a', b'x' * 100)
+    cache.discard('a')
+    assert cache.get('a') == path
+    os.remove(path)
+    cache.discard('a')
+    assert cache.size('a') is None
+
+def test_remote_copy_evicted_by_another_worker_is_a_miss(tmp_path):
+    cache = RemoteFileCache(str(tmp_path))
+    name = cache.name_for('http://peer', 'doc.txt', 5, 0)
+    tmp = cache.temp_path(name)
+    with open(tmp, 'wb') as f:
+        f.write(b'hello')
+    cache.add(name, tmp)
+    path, f = cache.open(name)
+    os.remove(path)
+    # Still readable through the file opened before the eviction
+    assert f.read() == b'hello'
+    f.close()
+    assert cache.open(name) == (None, None)
+    assert cache.stats() == {'entries': 0, 'bytes': 0, 'hits': 1, 'misses': 1}
+
+@pytest.fixture(scope='module')
+def peer(server, shared_dir):
+    """This server registered as a peer of itself"""
+    import app
+
+    folder = shared_dir / 'fed'
+    folder.mkdir()
+    (folder / 'doc.bin').write_bytes(os.urandom(100000))
+    # Far enough in the past that the peer's listing is final
+    os.utime(folder / 'doc.bin', (time.time() - 60, time.time() - 60))
+    return app.register_peer(server)
+
+def test_peer_download_survives_its_cached_copy_going_away(server, shared_dir, peer, tmp_path, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'remote_files', RemoteFileCache(str(tmp_path)))
+    data = (shared_dir / 'fed' / 'doc.bin').read_bytes()
+    url = f"{server}/peer/{peer}/download/fed/doc.bin"
+    headers = {'Accept-Encoding': 'identity'}
+    assert requests.get(url, headers=headers, timeout=30).content == data
+    # The copy is added once the relay finishes, just after the last byte
+    deadline = time.monotonic() + 5
+    while app.remote_files.stats()['entries'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert app.remote_files.stats()['entries'] == 1
+
+    response = requests.get(url, headers=dict(headers, Range='bytes=10-19, 50-59'), timeout=30)
+    assert response.status_code == 206
+    assert data[10:20] in response.content and data[50:60] in response.content
+    hits = app.remote_files.stats()['hits']
+    assert hits >= 1
+
+    # Another worker evicts the copy; the next request fetches it from the peer again
+    for name in os.listdir(tmp_path):
+        os.remove(tmp_path / name)
+    response = requests.get(url, headers=headers, timeout=30)
+    assert response.status_code == 200
+    assert response.content == data
+    assert app.remote_files.stats()['hits'] == hits
@@ -0,0 +1,110 @@
+import time
+import pytest
+import requests
+
+def open_events(server, **headers):
+    return requests.get(f"{server}/api/events", stream=True, headers=headers, timeout=30)
+
+def stats(server):
+    return requests.get(f"{server}/api/server_stats", timeout=30).json()['events']
+
+def test_streams_over_the_cap_are_turned_away_until_one_closes(server, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'max_event_streams', 1)
+    # A quick heartbeat, so the server notices the closed stream
+    monkeypatch.setattr(app, 'event_heartbeat', 0.1)
+    first = open_events(server)
+    assert first.status_code == 200
+    refused = open_events(server)
+    assert refused.status_code == 503
+    assert refused.json()['error'] == 'Too many open event streams'
+    assert stats(server)['open_streams'] == 1
+
+    first.close()
+    deadline = time.monotonic() + 10
+    while stats(server)['open_streams'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert stats(server)['open_streams'] == 0
+    with open_events(server) as again:
+        assert again.status_code == 200
+
+def read_events(response, until, seconds=10):
+    """Parse SSE events off a streamed response until until(events) holds or time runs out"""
+    events, buffer = [], b''
+    deadline = time.monotonic() + seconds
+    for chunk in response.iter_content(None):
+        buffer += chunk
+        while b'\n\n' in buffer:
+            block, buffer = buffer.split(b'\n\n', 1)
+            fields = dict(line.split(': ', 1) for line in block.decode().splitlines()
+                          if ': ' in line and not line.startswith(':'))
+            if 'event' in fields:
+                events.append(fields)
+        if until(events) or time.monotonic() > deadline:
+            break
+    return events
+
+def test_published_events_reach_open_pages(server):
+    import app
+
+    with open_events(server) as response:
+        assert response.headers['Content-Type'].startswith('text/event-stream')
+        event_id = app.event_broker.publish('activity', {'n': 1})
+        events = read_events(response, lambda events: events)
+    assert events[0] == {'id': str(event_id), 'event': 'activity', 'data': '{"n":1}'}
+
+def test_reconnect_replays_what_was_missed(server):
+    import app
+
+    seen = app.event_broker.publish('activity', {'n': 'seen'})
+    missed = [app.event_broker.publish('activity', {'n': i}) for i in range(3)]
+    with open_events(server, **{'Last-Event-ID': str(seen)}) as response:
+        events = read_events(response, lambda events: len(events) >= 3)
+    assert [int(event['id']) for event in events[:3]] == missed
+
+@pytest.mark.parametrize('last_event_id', ['999999999', '-5'])
+def test_unknown_position_is_told_to_reset(server, last_event_id):
+    import app
+
+    app.event_broker.publish('activity', {'n': 'any'})
+    with open_events(server, **{'Last-Event-ID': last_event_id}) as response:
+        events = read_events(response, lambda events: events)
+    assert events[0]['event'] == 'reset'
+
+def test_garbage_position_starts_from_now(server):
+    import app
+
+    app.event_broker.publish('activity', {'n': 'old'})
+    with open_events(server, **{'Last-Event-ID': 'yesterday'}) as response:
+        new = app.event_broker.publish('activity', {'n': 'new'})
+        events = read_events(response, lambda events: events)
+    assert events[0]['id'] == str(new)
+
+def test_position_older_than_the_history_resets(monkeypatch):
+    import events
+
+    monkeypatch.setattr(events, 'history_size', 3)
+    broker = events.EventBroker()
+    first = broker.publish('activity', {})
+    for _ in range(5):
+        broker.publish('activity', {})
+    stream = iter(broker.stream(str(first), heartbeat=60))
+    assert next(stream).startswith(b'retry:')
+    assert b'event: reset' in next(stream)
+    stream.close()
+    assert broker.subscribers == 0
+
+def test_page_is_told_when_its_folder_changes(server, shared_dir, monkeypatch):
+    import app
+
+    folder = shared_dir / 'watched'
+    folder.mkdir()
+    monkeypatch.setattr(app, 'folder_poll_interval', 0.1)
+    with requests.get(f"{server}/api/events", params={'path': 'watched'}, stream=True, timeout=30) as response:
+        # Let the watcher take the folder's fingerprint first
+        time.sleep(0.5)
+        (folder / 'new.txt').write_bytes(b'new')
+        events = read_events(response, lambda events: any(event['event'] == 'folder' for event in events))
+    assert {'event': 'folder', 'data': '{"path":"watched"}'}.items() <= \
+        next(event for event in events if event['event'] == 'folder').items()
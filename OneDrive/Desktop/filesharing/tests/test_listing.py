@@ -0,0 +1,59 @@
+import os
+import time
+import pytest
+import requests
+
+@pytest.fixture(autouse=True)
+def folder(shared_dir):
+    folder = shared_dir / 'listing'
+    folder.mkdir(exist_ok=True)
+    for name in os.listdir(folder):
+        os.remove(folder / name)
+    return folder
+
+def browse(server, **params):
+    response = requests.get(f"{server}/api/browse/listing", params=params, timeout=30)
+    assert response.status_code == 200
+    return {item['name']: item for item in response.json()['items']}
+
+def test_added_and_removed_files_show_up_at_once(server, folder):
+    (folder / 'a.txt').write_bytes(b'a')
+    assert list(browse(server)) == ['a.txt']
+    (folder / 'b.txt').write_bytes(b'b')
+    assert sorted(browse(server)) == ['a.txt', 'b.txt']
+    os.remove(folder / 'a.txt')
+    assert list(browse(server)) == ['b.txt']
+
+def test_file_written_in_place_is_picked_up(server, folder):
+    import app
+
+    path = folder / 'log.txt'
+    path.write_bytes(b'x' * 10)
+    assert browse(server)['log.txt']['size'] == 10
+    directory_mtime = os.stat(folder).st_mtime_ns
+
+    with open(path, 'ab') as f:
+        f.write(b'y' * 90)
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 5_000_000_000))
+    assert os.stat(folder).st_mtime_ns == directory_mtime
+
+    time.sleep(app.listing_cache.revalidate_after + 0.1)
+    item = browse(server)['log.txt']
+    assert item['size'] == 100
+    assert item['mtime'] == os.stat(path).st_mtime
+
+def test_unchanged_listing_is_revalidated_not_rebuilt(server, folder):
+    import app
+
+    (folder / 'same.txt').write_bytes(b'same')
+    browse(server)
+    before = app.listing_cache.stats()
+    time.sleep(app.listing_cache.revalidate_after + 0.1)
+    browse(server)
+    after = app.listing_cache.stats()
+    assert after['revalidations'] == before['revalidations'] + 1
+    assert after['misses'] == before['misses']
+
+def test_missing_folder_is_a_404(server):
+    response = requests.get(f"{server}/api/browse/listing/missing", timeout=30)
+    assert response.status_code == 404
@@ -0,0 +1,88 @@
+import time
+import pytest
+import requests
+
+def scrape(server):
+    """Return {'name{labels}': value} from /metrics"""
+    return scrape_with_size(server)[0]
+
+def scrape_with_size(server):
+    """Return the samples of /metrics and the size of the response, which the next scrape counts"""
+    response = requests.get(f"{server}/metrics", timeout=30)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples, len(response.content)
+
+@pytest.fixture(scope='module')
+def listing(shared_dir):
+    folder = shared_dir / 'metrics'
+    folder.mkdir()
+    for i in range(200):
+        (folder / f'file-{i:03d}.txt').write_bytes(b'x' * i)
+    return folder
+
+def test_requests_are_counted_by_route_and_status(server, listing):
+    key = 'filesharing_http_requests_total{route="/api/browse/<path:subpath>",method="GET",status="200"}'
+    before = scrape(server).get(key, 0)
+    for _ in range(3):
+        requests.get(f"{server}/api/browse/metrics", timeout=30)
+    requests.get(f"{server}/api/browse/metrics?sort=nope", timeout=30)
+    after = scrape(server)
+    assert after[key] == before + 3
+    assert after['filesharing_http_requests_total{route="/api/browse/<path:subpath>",method="GET",status="400"}'] >= 1
+    count = after['filesharing_http_request_duration_seconds_count{route="/api/browse/<path:subpath>"}']
+    assert after['filesharing_http_request_duration_seconds_bucket{route="/api/browse/<path:subpath>",le="+Inf"}'] == count
+
+def test_streamed_listing_bytes_are_counted(server, listing):
+    before, scraped = scrape_with_size(server)
+    body = requests.get(f"{server}/api/browse/metrics?stream=1", timeout=30).content
+    assert body.count(b'\n') == 200
+    after = scrape(server)['filesharing_bytes_sent_total']
+    # The first scrape's own body is counted as well
+    assert after - before['filesharing_bytes_sent_total'] - scraped == len(body)
+
+def test_event_stream_bytes_are_counted(server):
+    import app
+
+    before, scraped = scrape_with_size(server)
+    received = b''
+    with requests.get(f"{server}/api/events", stream=True, timeout=30) as response:
+        app.event_broker.publish('folder', {'path': 'metrics'})
+        deadline = time.monotonic() + 10
+        for chunk in response.iter_content(None):
+            received += chunk
+            if b'event: folder' in received or time.monotonic() > deadline:
+                break
+    assert b'event: folder' in received
+    sent = scrape(server)['filesharing_bytes_sent_total'] - before['filesharing_bytes_sent_total'] - scraped
+    assert sent >= len(received)
+
+def test_workers_are_added_up_through_the_shared_state(server, tmp_path, monkeypatch):
+    import app
+    from state import SQLiteState
+
+    monkeypatch.setattr(app, 'state', SQLiteState(str(tmp_path / 'state.sqlite3')))
+    key = 'filesharing_http_requests_total{route="/api/ping",method="GET",status="200"}'
+    other = app.worker_metrics()
+    other['requests'] = {'started_at': 1.0, 'bytes_sent': 1000, 'bytes_received': 10,
+                         'requests': [['/api/ping', 'GET', 200, 7]],
+                         'latency': {'/api/ping': [7] + [0] * len(app.request_metrics.buckets) + [0.007]}}
+    other['shaped_bytes'] = {'download': 5000, 'upload': 0}
+    # An exited worker: its totals still count, its gauges no longer do
+    other['updated_at'] = time.time() - 3600
+    other['active_transfers'] = {'download': 9, 'upload': 9}
+    app.state.put_metrics('exited-worker', other)
+
+    first = scrape(server)
+    assert first[key] == 7
+    assert first['filesharing_start_time_seconds'] == 1.0
+    assert first['filesharing_workers'] == 1
+    assert first['filesharing_active_transfers{direction="download"}'] < 9
+    second = scrape(server)
+    assert second['filesharing_bytes_sent_total'] >= first['filesharing_bytes_sent_total'] >= 6000
+    assert second['filesharing_http_request_duration_seconds_count{route="/api/ping"}'] == 7
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from mirror import Mirror
+
+@pytest.fixture(scope='module')
+def remote(shared_dir):
+    """A small tree in the share for the mirror to copy"""
+    root = shared_dir / 'remote'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'top.txt').write_bytes(b'top level')
+    (root / 'sub' / 'data.bin').write_bytes(os.urandom(300000))
+    return root
+
+def make_peer(body, content_type):
+    """Serve the same body for every GET, standing in for something that is not a peer"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+def test_mirror_copies_the_tree_then_skips_it(server, remote, tmp_path):
+    progress = Mirror(server, tmp_path, 'remote', workers=2).run()
+    assert progress['state'] == 'done'
+    assert progress['files_done'] == 2
+    # Paths keep the remote folder they came from
+    assert (tmp_path / 'remote' / 'sub' / 'data.bin').read_bytes() == (remote / 'sub' / 'data.bin').read_bytes()
+    assert os.stat(tmp_path / 'remote' / 'top.txt').st_mtime == pytest.approx(os.stat(remote / 'top.txt').st_mtime, abs=0.001)
+
+    progress = Mirror(server, tmp_path, 'remote', workers=2).run()
+    assert progress['state'] == 'done'
+    assert (progress['files_done'], progress['files_skipped']) == (0, 2)
+
+def test_partial_download_is_resumed(server, remote, tmp_path):
+    source = (remote / 'sub' / 'data.bin').read_bytes()
+    mtime = int(os.stat(remote / 'sub' / 'data.bin').st_mtime)
+    local = tmp_path / 'remote' / 'sub'
+    local.mkdir(parents=True)
+    (local / f'data.bin.{mtime}.part').write_bytes(source[:100000])
+
+    mirror = Mirror(server, tmp_path, 'remote/sub')
+    progress = mirror.run()
+    assert progress['state'] == 'done'
+    assert mirror.bytes_resumed == 100000
+    assert (local / 'data.bin').read_bytes() == source
+    assert os.listdir(local) == ['data.bin']
+
+@pytest.mark.parametrize('body, content_type', [
+    (b'<html><body>Not a peer</body></html>', 'text/html'),
+    (b'[1, 2, 3]\n', 'application/x-ndjson'),
+    (b'{"name": "x"}\n', 'application/x-ndjson'),
+])
+def test_peer_sending_garbage_fails_the_job(body, content_type, tmp_path):
+    peer = make_peer(body, content_type)
+    try:
+        progress = Mirror(f"http://127.0.0.1:{peer.server_port}", tmp_path / 'out').run()
+    finally:
+        peer.shutdown()
+    assert progress['state'] == 'failed'
+    assert progress['error']
+
+def test_unwritable_target_fails_the_job(server, remote, tmp_path):
+    blocker = tmp_path / 'blocker'
+    blocker.write_bytes(b'a file where the mirror folder should go')
+    progress = Mirror(server, blocker / 'mirror', 'remote').run()
+    assert progress['state'] == 'failed'
+
+def test_failed_job_does_not_block_the_folder(server, shared_dir):
+    peer = make_peer(b'<html></html>', 'text/html')
+    try:
+        payload = {'url': f"http://127.0.0.1:{peer.server_port}", 'target': 'mirrored'}
+        response = requests.post(f"{server}/api/mirror", json=payload, timeout=30)
+        assert response.status_code == 202
+        job_id = response.json()['id']
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            status = requests.get(f"{server}/api/mirror/{job_id}", timeout=30).json()
+            if status['state'] not in ('pending', 'running'):
+                break
+            time.sleep(0.05)
+        assert status['state'] == 'failed'
+        assert requests.post(f"{server}/api/mirror", json=payload, timeout=30).status_code == 202
+    finally:
+        peer.shutdown()
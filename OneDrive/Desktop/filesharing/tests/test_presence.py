@@ -0,0 +1,95 @@
+import time
+import threading
+import pytest
+import requests
+from presence import PresenceRegistry
+from state import SQLiteState
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_registry(request, tmp_path):
+    """Build a registry of either kind, recording the events it emits"""
+    def make(**kwargs):
+        events = []
+        on_event = lambda kind, data: events.append((kind, data.get('action'), data))
+        if request.param == 'memory':
+            registry = PresenceRegistry(on_event=on_event, **kwargs)
+        else:
+            registry = SQLiteState(str(tmp_path / 'state.sqlite3')).presence(on_event=on_event, **kwargs)
+        return registry, events
+    return make
+
+def test_join_update_and_leave_are_announced_once(make_registry):
+    registry, events = make_registry(timeout=0.2)
+    registry.touch('u1', 'Ann', '10.0.0.1', 'home')
+    registry.touch('u1', 'Ann', '10.0.0.1', 'home')
+    registry.touch('u1', 'Ann', '10.0.0.1', 'browsing: root')
+    assert [(kind, action) for kind, action, _ in events] == [('presence', 'joined'), ('presence', 'updated')]
+    time.sleep(0.3)
+    assert registry.expire() == ['u1']
+    assert registry.expire() == []
+    assert registry.user_count() == 0
+    assert events[-2][:2] == ('presence', 'left')
+    assert events[-1][2]['action'] == 'disconnected'
+
+def test_heartbeat_keeps_a_user_connected(make_registry):
+    registry, _ = make_registry(timeout=0.3)
+    registry.touch('stay', None, '10.0.0.1', 'home')
+    registry.touch('go', None, '10.0.0.2', 'home')
+    for _ in range(4):
+        time.sleep(0.1)
+        assert registry.heartbeat('stay')
+        registry.expire()
+    assert [user['id'] for user in registry.users()] == ['stay']
+    assert registry.users()[0]['name'] == 'Anonymous User'
+    assert not registry.heartbeat('go')
+
+def test_rename_of_unknown_user_is_none(make_registry):
+    registry, events = make_registry()
+    assert registry.rename('ghost', 'Boo') is None
+    registry.touch('u1', 'Ann', '10.0.0.1', 'home')
+    assert registry.rename('u1', 'Bea') == 'Ann'
+    assert registry.users()[0]['name'] == 'Bea'
+    assert events[-1][2]['user']['name'] == 'Bea'
+
+def test_activities_are_a_bounded_log_newest_first(make_registry):
+    registry, _ = make_registry(max_activities=5)
+    registry.touch('u1', 'Ann', '10.0.0.1', 'home')
+    for i in range(8):
+        registry.record_activity('u1', 'download', f'file {i}', '10.0.0.1')
+    activities = registry.activities()
+    assert [activity['details'] for activity in activities] == [f'file {i}' for i in (7, 6, 5, 4, 3)]
+    assert activities[0]['user_name'] == 'Ann'
+    assert registry.activities(2) == activities[:2]
+    assert registry.activity_count() == 5
+    assert registry.record_activity('nobody', 'upload')['user_name'] == 'Anonymous User'
+
+def test_concurrent_touches_keep_one_entry_per_user(make_registry):
+    registry, events = make_registry(timeout=60)
+
+    def visit(worker):
+        for i in range(50):
+            registry.touch(f'user-{i % 10}', None, '10.0.0.1', 'home')
+            registry.heartbeat(f'user-{worker}')
+
+    threads = [threading.Thread(target=visit, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry.user_count() == 10
+    assert sum(1 for _, action, _ in events if action == 'joined') == 10
+
+@pytest.mark.parametrize('body', [b'not json', b'[1, 2]', b'{"username": 7}', b'{"username": "   "}',
+                                  b'{"username": "' + b'x' * 51 + b'"}'])
+def test_bad_usernames_are_a_400(server, body):
+    response = requests.post(f"{server}/api/set_username", data=body, timeout=30,
+                             headers={'Content-Type': 'application/json'})
+    assert response.status_code == 400
+    assert 'error' in response.json()
+
+def test_renaming_shows_up_in_connected_users(server):
+    session = requests.Session()
+    session.get(f"{server}/", timeout=30)
+    assert session.post(f"{server}/api/set_username", json={'username': 'Tester'}, timeout=30).status_code == 200
+    users = session.get(f"{server}/api/connected_users", timeout=30).json()['users']
+    assert 'Tester' in [user['name'] for user in users]
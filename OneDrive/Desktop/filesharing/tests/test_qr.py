@@ -0,0 +1,58 @@
+import pytest
+import requests
+import utils
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+@pytest.fixture(autouse=True)
+def fresh_memo():
+    utils.qr_code_png.cache_clear()
+
+def test_index_links_the_versioned_qr_code(server):
+    import app
+
+    page = requests.get(f"{server}/", timeout=30).text
+    assert f'/qr.png?v={app.qr_code_version()}' in page
+    assert 'data:image/png;base64' not in page
+
+def test_qr_code_is_rendered_once_per_url(server):
+    import app
+
+    version = app.qr_code_version()
+    first = requests.get(f"{server}/qr.png", params={'v': version}, timeout=30)
+    assert first.status_code == 200
+    assert first.content.startswith(PNG_SIGNATURE)
+    assert 'immutable' in first.headers['Cache-Control']
+    second = requests.get(f"{server}/qr.png", timeout=30)
+    assert second.content == first.content
+    assert second.headers['Cache-Control'] == 'no-cache'
+    info = utils.qr_code_png.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+
+def test_revalidation_is_answered_without_rendering(server):
+    etag = requests.get(f"{server}/qr.png", timeout=30).headers['ETag']
+    response = requests.get(f"{server}/qr.png", headers={'If-None-Match': etag}, timeout=30)
+    assert response.status_code == 304
+    assert utils.qr_code_png.cache_info().hits == 0
+
+def test_new_port_gets_a_new_version_and_image(server, monkeypatch):
+    import app
+
+    first = requests.get(f"{server}/qr.png", timeout=30)
+    monkeypatch.setattr(app, 'port', 9999)
+    second = requests.get(f"{server}/qr.png", headers={'If-None-Match': first.headers['ETag']}, timeout=30)
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert second.content != first.content
+
+def test_failed_render_is_a_500_and_not_remembered(server, monkeypatch):
+    class Broken:
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError('no encoder')
+
+    monkeypatch.setattr(utils.qrcode, 'QRCode', Broken)
+    assert requests.get(f"{server}/qr.png", timeout=30).status_code == 500
+    monkeypatch.undo()
+    response = requests.get(f"{server}/qr.png", timeout=30)
+    assert response.status_code == 200
+    assert response.content.startswith(PNG_SIGNATURE)
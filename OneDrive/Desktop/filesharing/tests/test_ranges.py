@@ -0,0 +1,86 @@
+import os
+import email
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+
+SIZE = 3 * 1024 * 1024 + 12345
+
+# Compression would turn whole-file answers into a different byte stream
+IDENTITY = {'Accept-Encoding': 'identity'}
+
+@pytest.fixture(scope='module')
+def source(shared_dir):
+    data = os.urandom(SIZE)
+    (shared_dir / 'source.bin').write_bytes(data)
+    return data
+
+def fetch(server, headers=None):
+    return requests.get(f"{server}/download/source.bin", headers=dict(IDENTITY, **(headers or {})), timeout=30)
+
+@pytest.mark.parametrize('segments', [1, 2, 7, 16])
+def test_parallel_segments_reassemble_the_file(server, source, segments):
+    step = -(-SIZE // segments)
+    bounds = [(start, min(start + step, SIZE) - 1) for start in range(0, SIZE, step)]
+
+    def get(bound):
+        response = fetch(server, {'Range': f'bytes={bound[0]}-{bound[1]}'})
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == f'bytes {bound[0]}-{bound[1]}/{SIZE}'
+        assert int(response.headers['Content-Length']) == bound[1] - bound[0] + 1
+        return response.content
+
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        pieces = list(pool.map(get, bounds))
+    assert b''.join(pieces) == source
+
+def test_open_ended_range_resumes_to_the_end(server, source):
+    response = fetch(server, {'Range': 'bytes=1000000-'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 1000000-{SIZE - 1}/{SIZE}'
+    assert response.content == source[1000000:]
+
+def test_suffix_range(server, source):
+    response = fetch(server, {'Range': 'bytes=-4096'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {SIZE - 4096}-{SIZE - 1}/{SIZE}'
+    assert response.content == source[-4096:]
+
+def test_suffix_range_longer_than_the_file(server, source):
+    response = fetch(server, {'Range': f'bytes=-{SIZE * 2}'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 0-{SIZE - 1}/{SIZE}'
+    assert response.content == source
+
+def test_multiple_ranges_are_sent_as_multipart_byteranges(server, source):
+    wanted = [(0, 99), (500000, 500999), (SIZE - 10, SIZE - 1)]
+    response = fetch(server, {'Range': 'bytes=' + ','.join(f'{start}-{end}' for start, end in wanted)})
+    assert response.status_code == 206
+    assert response.headers['Content-Type'].startswith('multipart/byteranges; boundary=')
+    assert int(response.headers['Content-Length']) == len(response.content)
+
+    message = email.message_from_bytes(
+        f"Content-Type: {response.headers['Content-Type']}\r\n\r\n".encode() + response.content)
+    parts = message.get_payload()
+    assert len(parts) == len(wanted)
+    for part, (start, end) in zip(parts, wanted):
+        assert part['Content-Range'] == f'bytes {start}-{end}/{SIZE}'
+        assert part.get_payload(decode=True) == source[start:end + 1]
+
+def test_unsatisfiable_range_is_416(server, source):
+    response = fetch(server, {'Range': f'bytes={SIZE}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{SIZE}'
+
+def test_if_range_match_is_honoured(server, source):
+    etag = fetch(server, {'Range': 'bytes=0-0'}).headers['ETag']
+    response = fetch(server, {'Range': 'bytes=10-19', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.content == source[10:20]
+
+@pytest.mark.parametrize('validator', ['"stale-etag"', 'Wed, 21 Oct 2015 07:28:00 GMT'])
+def test_if_range_mismatch_sends_the_whole_file(server, source, validator):
+    response = fetch(server, {'Range': 'bytes=10-19', 'If-Range': validator})
+    assert response.status_code == 200
+    assert 'Content-Range' not in response.headers
+    assert response.content == source
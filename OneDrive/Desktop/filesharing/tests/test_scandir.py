@@ -0,0 +1,55 @@
+import os
+import pytest
+import requests
+from utils import iter_directory, scan_directory, sort_items, format_size
+
+@pytest.fixture(scope='module')
+def tree(shared_dir):
+    folder = shared_dir / 'scandir'
+    (folder / 'Zeta').mkdir(parents=True)
+    (folder / 'alpha').mkdir()
+    for name, size, mtime in (('b.txt', 300, 3000), ('A.txt', 10, 1000), ('c.txt', 2000, 2000)):
+        (folder / name).write_bytes(b'x' * size)
+        os.utime(folder / name, (mtime, mtime))
+    return folder
+
+def test_one_record_per_entry_with_raw_metadata(tree):
+    records = {item['name']: item for item in iter_directory(tree)}
+    assert set(records) == {'Zeta', 'alpha', 'b.txt', 'A.txt', 'c.txt'}
+    assert records['c.txt'] == {'name': 'c.txt', 'type': 'file', 'size': 2000, 'mtime': 2000}
+    assert records['alpha']['type'] == 'directory' and records['alpha']['size'] is None
+
+def test_directories_come_first_in_either_order(tree):
+    items = scan_directory(tree)
+    assert [item['name'] for item in items] == ['alpha', 'Zeta', 'A.txt', 'b.txt', 'c.txt']
+    by_size = sort_items(items, 'size', reverse=True)
+    assert [item['name'] for item in by_size][2:] == ['c.txt', 'b.txt', 'A.txt']
+    assert {item['type'] for item in by_size[:2]} == {'directory'}
+    by_mtime = sort_items(items, 'mtime')
+    assert [item['name'] for item in by_mtime][2:] == ['A.txt', 'c.txt', 'b.txt']
+
+def test_entries_that_cannot_be_stated_are_skipped(tmp_path):
+    (tmp_path / 'real.txt').write_bytes(b'here')
+    os.symlink(tmp_path / 'nowhere', tmp_path / 'dangling')
+    assert [item['name'] for item in iter_directory(tmp_path)] == ['real.txt']
+
+def test_missing_folder_scans_as_empty(tmp_path):
+    assert scan_directory(tmp_path / 'gone') == []
+
+def test_sizes_are_formatted_only_when_rendered(server, tree):
+    assert format_size(2000) == '2.0 KB'
+    page = requests.get(f"{server}/browse/scandir", timeout=30)
+    assert page.status_code == 200
+    assert '2.0 KB' in page.text and '300.0 B' in page.text
+
+def test_api_sorts_by_raw_values(server, tree):
+    response = requests.get(f"{server}/api/browse/scandir", params={'sort': 'size', 'order': 'desc'}, timeout=30)
+    assert response.status_code == 200
+    items = response.json()['items']
+    assert [(item['name'], item['size']) for item in items[2:]] == [('c.txt', 2000), ('b.txt', 300), ('A.txt', 10)]
+
+@pytest.mark.parametrize('params', [{'sort': 'colour'}, {'order': 'sideways'}])
+def test_bad_sort_is_a_400(server, tree, params):
+    response = requests.get(f"{server}/api/browse/scandir", params=params, timeout=30)
+    assert response.status_code == 400
+    assert 'error' in response.json()
@@ -0,0 +1,63 @@
+import pytest
+import requests
+
+@pytest.fixture(scope='module')
+def indexed(server, shared_dir):
+    import app
+
+    folder = shared_dir / 'search'
+    (folder / 'nested').mkdir(parents=True)
+    for i in range(300):
+        (folder / f'quarterly-budget-{i:03d}.csv').write_text('a,b\n')
+    (folder / 'nested' / 'Budget').mkdir()
+    (folder / 'budget.txt').write_text('the quick brown fox')
+    (folder / 'ab.txt').write_text('short name')
+    app.search_index.refresh()
+    return folder
+
+def search(server, **params):
+    response = requests.get(f"{server}/api/search", params=params, timeout=30)
+    return response
+
+def test_exact_name_ranks_first_even_past_the_match_cap(server, indexed, monkeypatch):
+    import search as search_module
+
+    # Fewer ranked matches than substring hits, as on a huge share
+    monkeypatch.setattr(search_module, 'max_matches', 50)
+    results = search(server, q='budget').json()['results']
+    assert [result['name'] for result in results[:2]] == ['Budget', 'budget.txt']
+
+def test_prefix_matches_come_before_substring_matches(server, indexed):
+    results = search(server, q='budg', per_page=5).json()['results']
+    assert {result['name'] for result in results[:2]} == {'Budget', 'budget.txt'}
+    assert all(result['name'].startswith('quarterly') for result in results[2:])
+
+def test_type_filter(server, indexed):
+    results = search(server, q='budget', type='directory').json()['results']
+    assert [result['path'] for result in results] == ['search/nested/Budget']
+
+def test_short_terms_fall_back_to_a_scan(server, indexed):
+    results = search(server, q='ab').json()['results']
+    assert 'ab.txt' in [result['name'] for result in results]
+
+def test_content_search(server, indexed):
+    results = search(server, q='brown fox', content='1').json()['results']
+    assert [result['name'] for result in results] == ['budget.txt']
+    assert '[brown]' in results[0]['snippet']
+
+def test_pages_split_the_results(server, indexed):
+    first = search(server, q='quarterly', per_page=100, page=1).json()
+    third = search(server, q='quarterly', per_page=100, page=3).json()
+    assert first['total_count'] == 300
+    assert len(first['results']) == 100 and len(third['results']) == 100
+    assert not {r['path'] for r in first['results']} & {r['path'] for r in third['results']}
+
+@pytest.mark.parametrize('page', ['100000000000000000000', str(2 ** 63)])
+def test_huge_page_is_an_empty_page_not_an_error(server, indexed, page):
+    response = search(server, q='budget', page=page)
+    assert response.status_code == 200
+    assert response.json()['results'] == []
+
+@pytest.mark.parametrize('params', [{'q': ''}, {'q': 'x', 'page': 'two'}, {'q': 'x', 'type': 'link'}])
+def test_bad_queries_are_a_400(server, indexed, params):
+    assert search(server, **params).status_code == 400
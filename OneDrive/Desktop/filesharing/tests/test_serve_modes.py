@@ -0,0 +1,89 @@
+import os
+import pytest
+import requests
+from urllib.parse import unquote
+from werkzeug.wsgi import FileWrapper
+
+@pytest.fixture(scope='module')
+def files(shared_dir):
+    folder = shared_dir / 'modes'
+    folder.mkdir()
+    data = os.urandom(300000)
+    (folder / 'big file.bin').write_bytes(data)
+    (folder / 'empty.bin').write_bytes(b'')
+    return data
+
+@pytest.fixture
+def mode(monkeypatch):
+    import downloads
+
+    def set_mode(name):
+        monkeypatch.setattr(downloads, 'serve_mode', name)
+    return set_mode
+
+def get(server, path, **headers):
+    return requests.get(f"{server}/download/{path}", headers=dict({'Accept-Encoding': 'identity'}, **headers),
+                        timeout=30)
+
+def test_x_accel_hands_the_file_to_nginx(server, files, mode):
+    mode('x-accel')
+    response = get(server, 'modes/big file.bin', Range='bytes=0-9')
+    # nginx applies the Range itself
+    assert response.status_code == 200
+    assert response.content == b''
+    assert unquote(response.headers['X-Accel-Redirect']) == '/protected-files/modes/big file.bin'
+    assert ' ' not in response.headers['X-Accel-Redirect']
+    assert 'ETag' in response.headers
+
+def test_x_sendfile_names_the_absolute_path(server, shared_dir, files, mode):
+    mode('x-sendfile')
+    response = get(server, 'modes/big file.bin')
+    assert response.content == b''
+    assert response.headers['X-Sendfile'] == str(shared_dir / 'modes' / 'big file.bin')
+
+def test_offloaded_download_still_revalidates(server, files, mode):
+    mode('x-accel')
+    etag = get(server, 'modes/big file.bin').headers['ETag']
+    response = get(server, 'modes/big file.bin', **{'If-None-Match': etag})
+    assert response.status_code == 304
+    assert 'X-Accel-Redirect' not in response.headers
+
+def test_paths_outside_the_share_are_refused_in_every_mode(server, files, mode):
+    for name in ('x-accel', 'x-sendfile', 'sendfile'):
+        mode(name)
+        response = requests.get(f"{server}/download/..%2F..%2Fetc%2Fpasswd", timeout=30)
+        assert response.status_code in (403, 404)
+        assert 'X-Accel-Redirect' not in response.headers and 'X-Sendfile' not in response.headers
+
+def test_sendfile_uses_the_servers_file_wrapper(shared_dir, files, mode):
+    import app
+
+    mode('sendfile')
+    wrapped = []
+
+    class RecordingWrapper(FileWrapper):
+        def __init__(self, file, buffer_size=8192):
+            wrapped.append(file.tell())
+            super().__init__(file, buffer_size)
+
+    client = app.app.test_client()
+    environ = {'wsgi.file_wrapper': RecordingWrapper}
+    response = client.get('/download/modes/big file.bin', environ_overrides=environ,
+                          headers={'Accept-Encoding': 'identity'})
+    assert response.get_data() == files
+    assert wrapped == [0]
+    # A range that does not run to the end is read from Python
+    response = client.get('/download/modes/big file.bin', environ_overrides=environ,
+                          headers={'Range': 'bytes=10-19', 'Accept-Encoding': 'identity'})
+    assert response.status_code == 206
+    assert response.get_data() == files[10:20]
+    # Resumed downloads run to the end and keep the wrapper
+    response = client.get('/download/modes/big file.bin', environ_overrides=environ,
+                          headers={'Range': 'bytes=299990-', 'Accept-Encoding': 'identity'})
+    assert response.get_data() == files[299990:]
+    assert wrapped == [0, 299990]
+
+def test_sendfile_without_a_wrapper_falls_back(server, files, mode):
+    mode('sendfile')
+    assert get(server, 'modes/big file.bin').content == files
+    assert get(server, 'modes/empty.bin').content == b''
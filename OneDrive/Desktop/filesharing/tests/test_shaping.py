@@ -0,0 +1,97 @@
+import time
+import threading
+import pytest
+import requests
+import shaping
+from shaping import BandwidthShaper
+from start_server import per_worker_rates
+
+MB = 1024 * 1024
+
+@pytest.fixture(scope='module')
+def blob(shared_dir):
+    folder = shared_dir / 'shaping'
+    folder.mkdir()
+    (folder / 'blob.bin').write_bytes(b's' * MB)
+    return 'shaping/blob.bin'
+
+def send(shaper, key, total, chunk=64 * 1024):
+    """Push total bytes through one transfer as the download loop would, returning the seconds it took"""
+    started = time.monotonic()
+    transfer = shaper.open(key)
+    try:
+        for _ in range(total // chunk):
+            transfer.throttle(chunk)
+    finally:
+        transfer.close()
+    return time.monotonic() - started
+
+def test_rate_is_held_by_the_token_bucket():
+    shaper = BandwidthShaper(rate=2 * MB)
+    elapsed = send(shaper, 'a', MB)
+    # The bucket starts empty and allows one chunk of debt
+    assert 0.4 < elapsed < 1.0
+    assert shaper.total_bytes == MB
+
+def test_global_rate_is_split_between_users_not_connections():
+    shaper = BandwidthShaper(rate=4 * MB)
+    transfers = [shaper.open('a') for _ in range(3)] + [shaper.open('b')]
+    assert shaper.user_limit() == 2 * MB
+    assert shaper.stats()['users']['a']['active_transfers'] == 3
+    for transfer in transfers:
+        transfer.close()
+    assert shaper.stats()['active_transfers'] == 0
+
+def test_two_users_share_the_rate():
+    shaper = BandwidthShaper(rate=2 * MB)
+    times = {}
+    threads = [threading.Thread(target=lambda key=key: times.update({key: send(shaper, key, MB // 2)}))
+               for key in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Together they move 1 MB at 2 MB/s, each at about half of it
+    assert all(0.35 < elapsed < 1.0 for elapsed in times.values())
+
+def test_user_rate_caps_one_user():
+    shaper = BandwidthShaper(rate=100 * MB, user_rate=MB)
+    assert shaper.user_limit() == MB
+    assert 0.3 < send(shaper, 'a', MB // 2) < 1.0
+
+def test_idle_users_are_forgotten(monkeypatch):
+    shaper = BandwidthShaper()
+    assert not shaper.limited
+    send(shaper, 'gone', 64 * 1024)
+    transfer = shaper.open('busy')
+    monkeypatch.setattr(shaping, 'idle_timeout', 0)
+    time.sleep(0.01)
+    assert list(shaper.stats()['users']) == ['busy']
+    transfer.close()
+
+def test_closing_twice_counts_once():
+    shaper = BandwidthShaper(rate=MB)
+    transfer = shaper.open('a')
+    transfer.close()
+    transfer.close()
+    assert shaper.stats()['active_users'] == 0 and shaper.active_transfers == 0
+
+@pytest.mark.parametrize('workers', [0, 1, 4])
+def test_workers_together_stay_within_the_limits(workers):
+    rate, user_rate = per_worker_rates(20, 5, workers)
+    assert rate * max(workers, 1) <= 20 * MB
+    assert user_rate * max(workers, 1) <= 5 * MB
+    assert rate * max(workers, 1) >= 20 * MB - workers
+    assert per_worker_rates(None, None, workers) == (None, None)
+
+def test_download_is_shaped(server, blob, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app.download_shaper, 'rate', MB)
+    started = time.monotonic()
+    response = requests.get(f"{server}/download/{blob}", headers={'Accept-Encoding': 'identity'}, timeout=30)
+    elapsed = time.monotonic() - started
+    assert response.status_code == 200
+    assert len(response.content) == MB
+    # Less one chunk of debt, which may be a quarter of the file
+    assert elapsed > 0.5
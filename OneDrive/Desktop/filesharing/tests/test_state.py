@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import sqlite3
+import hashlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+import state as state_module
+from state import SQLiteState
+from test_events import read_events
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'state' / 'shared.sqlite3')
+
+def test_settings_are_seen_by_every_process(db_path):
+    first, second = SQLiteState(db_path), SQLiteState(db_path)
+    assert second.get('shared_folder', 'none') == 'none'
+    first.set('shared_folder', '/srv/share')
+    first.set('limits', {'rate': 2, 'users': [1, 2]})
+    assert second.get('shared_folder') == '/srv/share'
+    assert second.get('limits') == {'rate': 2, 'users': [1, 2]}
+
+def test_reset_forgets_the_previous_run(db_path):
+    old = SQLiteState(db_path)
+    old.set('shared_folder', '/old')
+    old.events().publish('activity', {})
+    old.put_metrics('worker-1', {'requests': 5})
+    old.presence().touch('u1', 'Ann', '10.0.0.1', '/')
+
+    new = SQLiteState(db_path)
+    new.reset()
+    assert new.get('shared_folder') is None
+    assert new.worker_metrics() == []
+    assert new.presence().users() == []
+    assert new.events()._since(0) == []
+
+def test_event_published_in_one_worker_streams_from_another(db_path, monkeypatch):
+    monkeypatch.setattr(state_module, 'event_poll_interval', 0.01)
+    publisher, subscriber = SQLiteState(db_path).events(), SQLiteState(db_path).events()
+    stream = iter(subscriber.stream(None, heartbeat=60))
+    assert next(stream).startswith(b'retry:')
+    event_id = publisher.publish('activity', {'n': 1})
+    assert subscriber.last_id() == event_id
+    assert next(stream) == f'id: {event_id}\nevent: activity\ndata: {{"n":1}}\n\n'.encode()
+    stream.close()
+
+def test_trimmed_history_tells_the_page_to_reset(db_path, monkeypatch):
+    monkeypatch.setattr(state_module, 'history_size', 10)
+    broker = SQLiteState(db_path).events()
+    first = broker.publish('activity', {})
+    # Old rows are trimmed every hundred events
+    for _ in range(99):
+        broker.publish('activity', {})
+    assert broker._since(first) is None
+    assert len(broker._since(broker.last_id() - 5)) == 5
+
+def test_connections_are_not_shared_across_a_fork(db_path):
+    shared = SQLiteState(db_path)
+    shared.set('before_fork', True)
+    child = multiprocessing.get_context('fork').Process(target=publish_from_child, args=(shared,))
+    child.start()
+    child.join(30)
+    assert child.exitcode == 0
+    assert [row[1] for row in shared.events()._since(0)] == ['from_child']
+    assert shared.get('child_saw') is True
+
+def publish_from_child(shared):
+    shared.set('child_saw', shared.get('before_fork'))
+    shared.events().publish('from_child', {'pid': os.getpid()})
+
+def test_each_timed_out_user_is_expired_by_one_worker_only(db_path):
+    left = []
+    registries = [SQLiteState(db_path).presence(timeout=0, on_event=lambda kind, data: left.append(data))
+                  for _ in range(4)]
+    for i in range(20):
+        registries[0].touch(f'u{i}', f'User {i}', '10.0.0.1', '/')
+    left.clear()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        expired = list(pool.map(lambda registry: registry.expire(), registries))
+    assert sorted(sum(expired, [])) == sorted(f'u{i}' for i in range(20))
+    assert len([data for data in left if data.get('action') == 'left']) == 20
+    assert registries[1].user_count() == 0
+    assert registries[2].activities(limit=1)[0]['action'] == 'disconnected'
+
+def test_presence_changes_only_emit_when_something_changed(db_path):
+    seen = []
+    first = SQLiteState(db_path).presence(on_event=lambda kind, data: seen.append(data.get('action')))
+    second = SQLiteState(db_path).presence()
+    first.touch('u1', None, '10.0.0.1', '/')
+    first.touch('u1', None, '10.0.0.1', '/')
+    first.touch('u1', None, '10.0.0.1', '/other')
+    assert seen == ['joined', 'updated']
+    assert second.users()[0]['name'] == 'Anonymous User'
+    assert second.rename('u1', 'Ann') == 'Anonymous User'
+    assert second.rename('nobody', 'Bob') is None
+    assert first.heartbeat('u1') and not first.heartbeat('nobody')
+
+def test_activities_are_capped_across_workers(db_path):
+    first = SQLiteState(db_path).presence(max_activities=3)
+    second = SQLiteState(db_path).presence(max_activities=3)
+    for i in range(5):
+        (first, second)[i % 2].record_activity('u1', 'download', str(i))
+    assert [activity['details'] for activity in first.activities()] == ['4', '3', '2']
+    assert second.activity_count() == 3
+
+def test_each_worker_keeps_one_metrics_row(db_path):
+    first, second = SQLiteState(db_path), SQLiteState(db_path)
+    first.put_metrics('worker-1', {'requests': 1})
+    second.put_metrics('worker-2', {'requests': 7})
+    first.put_metrics('worker-1', {'requests': 3})
+    assert sorted(row['requests'] for row in second.worker_metrics()) == [3, 7]
+
+def test_failed_transaction_leaves_nothing_behind(db_path):
+    shared = SQLiteState(db_path)
+
+    def statements(db):
+        db.execute("INSERT INTO settings (key, value) VALUES ('half', '1')")
+        raise ValueError('interrupted')
+
+    with pytest.raises(ValueError):
+        shared._transaction(statements)
+    assert shared.get('half') is None
+    # The connection is usable again afterwards
+    shared.set('after', 1)
+    assert SQLiteState(db_path).get('after') == 1
+
+def test_unreadable_database_is_an_error(tmp_path):
+    path = tmp_path / 'garbage.sqlite3'
+    path.write_bytes(b'this is not a database' * 100)
+    with pytest.raises(sqlite3.DatabaseError):
+        SQLiteState(str(path))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture(scope='module')
+def workers(tmp_path_factory):
+    """The real server with three gunicorn workers sharing one state database"""
+    pytest.importorskip('gunicorn')
+    folder = tmp_path_factory.mktemp('workers-share')
+    db = tmp_path_factory.mktemp('workers-state') / 'state.sqlite3'
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, 'start_server.py', '--workers', '3', '--threads', '4', '--host', '127.0.0.1',
+         '--port', str(port), '--folder', str(folder), '--state-db', str(db), '--no-discovery',
+         # Workers exit once their streams notice the closed connection, on the next heartbeat
+         '--event-heartbeat', '1'],
+        cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            requests.get(f"{url}/api/server_stats", timeout=5)
+            break
+        except requests.ConnectionError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                pytest.fail('The multi-worker server did not start')
+            time.sleep(0.2)
+    yield url, folder
+    process.send_signal(signal.SIGINT)
+    process.wait(30)
+
+def fresh(method, url, **kwargs):
+    """Send a request over a new connection, so it may reach any worker"""
+    headers = dict(kwargs.pop('headers', {}), Connection='close')
+    return requests.request(method, url, headers=headers, timeout=30, **kwargs)
+
+def test_chunks_sent_to_different_workers_are_assembled(workers):
+    url, folder = workers
+    chunk = 64 * 1024
+    data = os.urandom(chunk * 6)
+    upload_id = fresh('POST', f"{url}/api/uploads",
+                      json={'filename': 'spread.bin', 'size': len(data), 'chunk_size': chunk}).json()['upload_id']
+    for index in (3, 0, 5, 1, 4, 2):
+        response = fresh('PUT', f"{url}/api/uploads/{upload_id}/chunks/{index}",
+                         data=data[index * chunk:(index + 1) * chunk])
+        assert response.status_code == 200
+    # A wrong chunk is rejected whichever worker gets it
+    assert fresh('PUT', f"{url}/api/uploads/{upload_id}/chunks/9", data=b'x').status_code == 400
+    response = fresh('POST', f"{url}/api/uploads/{upload_id}/commit",
+                     json={'sha256': hashlib.sha256(data).hexdigest()})
+    assert response.status_code == 200
+    assert (folder / 'spread.bin').read_bytes() == data
+
+def test_events_reach_pages_open_on_other_workers(workers):
+    url, _ = workers
+    user = requests.Session()
+    user.headers['Connection'] = 'close'
+    with requests.get(f"{url}/api/events", stream=True, timeout=30) as stream:
+        # Whichever workers the session's requests land on, the stream sees them
+        for _ in range(3):
+            assert user.get(f"{url}/", timeout=30).status_code == 200
+        assert user.post(f"{url}/api/set_username", json={'username': 'Ann'}, timeout=30).status_code == 200
+        events = read_events(stream, lambda events: any(
+            event['event'] == 'presence' and json.loads(event['data'])['user']['name'] == 'Ann'
+            for event in events))
+    assert any(event['event'] == 'presence' and json.loads(event['data'])['user']['name'] == 'Ann'
+               for event in events)
+    names = {fresh('GET', f"{url}/api/connected_users").json()['users'][0]['name'] for _ in range(6)}
+    assert names == {'Ann'}
@@ -0,0 +1,85 @@
+import io
+import os
+import time
+import pytest
+import requests
+from thumbnails import ThumbnailCache
+
+Image = pytest.importorskip('PIL.Image')
+
+@pytest.fixture(scope='module')
+def images(shared_dir):
+    folder = shared_dir / 'pictures'
+    folder.mkdir()
+    Image.new('RGB', (1200, 800), (200, 30, 30)).save(folder / 'wide.jpg')
+    Image.new('RGBA', (300, 600), (0, 0, 255, 128)).save(folder / 'tall.png')
+    (folder / 'broken.jpg').write_bytes(b'not really a jpeg')
+    (folder / 'notes.txt').write_bytes(b'text')
+    return folder
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    import app
+
+    cache = ThumbnailCache(str(tmp_path / 'thumbs'), workers=1)
+    monkeypatch.setattr(app, 'thumbnail_cache', cache)
+    # Leave room for the worker process to start
+    monkeypatch.setattr(app, 'thumbnail_wait', 60)
+    yield cache
+    cache.shutdown()
+
+def thumb(server, name, **kwargs):
+    return requests.get(f"{server}/thumb/pictures/{name}", timeout=90, **kwargs)
+
+def test_thumbnails_fit_the_box_and_are_cached(server, images, cache):
+    for name, size in (('wide.jpg', (256, 171)), ('tall.png', (128, 256))):
+        response = thumb(server, name)
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == 'image/jpeg'
+        with Image.open(io.BytesIO(response.content)) as image:
+            assert image.format == 'JPEG' and image.size == size
+    thumb(server, 'wide.jpg')
+    stats = cache.stats()
+    assert (stats['misses'], stats['hits'], stats['entries']) == (2, 1, 2)
+
+def test_versioned_urls_are_immutable_and_others_revalidate(server, images, cache):
+    assert 'immutable' in thumb(server, 'wide.jpg', params={'v': '1'}).headers['Cache-Control']
+    response = thumb(server, 'wide.jpg')
+    assert response.headers['Cache-Control'] == 'no-cache'
+    again = thumb(server, 'wide.jpg', headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+@pytest.mark.parametrize('name, status', [('broken.jpg', 404), ('notes.txt', 404), ('missing.png', 404),
+                                          ('..%2F..%2Fetc%2Fpasswd.jpg', 403)])
+def test_bad_sources_are_refused(server, images, cache, name, status):
+    assert thumb(server, name).status_code == status
+
+def test_undecodable_image_counts_as_a_failure(server, images, cache):
+    thumb(server, 'broken.jpg')
+    assert cache.stats()['failures'] == 1
+    assert cache.stats()['entries'] == 0
+
+def test_image_edited_in_place_gets_a_new_thumbnail(server, images, cache):
+    path = images / 'edit.png'
+    Image.new('RGB', (400, 400), (255, 0, 0)).save(path)
+    first = thumb(server, 'edit.png')
+    Image.new('RGB', (400, 200), (0, 255, 0)).save(path)
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 2_000_000_000))
+    second = thumb(server, 'edit.png')
+    assert second.headers['ETag'] != first.headers['ETag']
+    with Image.open(io.BytesIO(second.content)) as image:
+        assert image.size == (256, 128)
+
+def test_thumbnail_evicted_by_another_worker_is_rendered_again(server, images, cache, tmp_path):
+    thumb(server, 'wide.jpg')
+    for name in os.listdir(tmp_path / 'thumbs'):
+        os.remove(tmp_path / 'thumbs' / name)
+    response = thumb(server, 'wide.jpg')
+    assert response.status_code == 200
+    assert cache.stats()['misses'] == 2
+
+def test_full_queue_asks_the_client_to_retry(server, images, cache, monkeypatch):
+    monkeypatch.setattr(cache, 'max_pending', 0)
+    response = thumb(server, 'tall.png')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,77 @@
+import os
+import socket
+import time
+import pytest
+import requests
+
+BOUNDARY = 'testboundary'
+
+def multipart(*files):
+    """Build a multipart/form-data body with one 'file' part per (filename, data)"""
+    body = b''
+    for filename, data in files:
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode()
+
+def post(server, body):
+    return requests.post(f"{server}/upload", data=body, timeout=30,
+                         headers={'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'})
+
+def names(shared_dir):
+    return sorted(os.listdir(shared_dir))
+
+@pytest.fixture(autouse=True)
+def empty_share(shared_dir):
+    for name in os.listdir(shared_dir):
+        os.remove(os.path.join(shared_dir, name))
+
+def test_parts_are_written_to_the_share(server, shared_dir):
+    response = post(server, multipart(('a.bin', b'a' * 100000), ('b.txt', b'hello')))
+    assert response.status_code == 200
+    assert [result['status'] for result in response.json()['results']] == ['success', 'success']
+    assert (shared_dir / 'a.bin').read_bytes() == b'a' * 100000
+    assert (shared_dir / 'b.txt').read_bytes() == b'hello'
+
+def test_cut_off_body_is_a_400_and_leaves_nothing_behind(server, shared_dir):
+    body = multipart(('first.bin', b'1' * 5000), ('second.bin', b'2' * 5000))
+    response = post(server, body[:-2000])
+    assert response.status_code == 400
+    assert response.json()['error'] == 'Malformed multipart body'
+    assert names(shared_dir) == []
+
+def test_body_without_parts_is_a_400(server, shared_dir):
+    response = post(server, b'not a multipart body at all')
+    assert response.status_code == 400
+    assert 'error' in response.json()
+    assert names(shared_dir) == []
+
+def test_part_is_hidden_until_it_is_complete(server, shared_dir):
+    body = multipart(('growing.bin', b'x' * 200000))
+    host, port = server.rsplit('/', 1)[1].split(':')
+    with socket.create_connection((host, int(port)), timeout=30) as sock:
+        sock.sendall((f'POST /upload HTTP/1.1\r\nHost: {host}\r\n'
+                      f'Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n'
+                      f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n').encode())
+        sock.sendall(body[:100000])
+        # Give the server time to write what it has received
+        time.sleep(0.3)
+        listing = requests.get(f"{server}/api/browse", timeout=30).json()
+        assert 'growing.bin' not in [item['name'] for item in listing['items']]
+        assert not (shared_dir / 'growing.bin').exists()
+
+        sock.sendall(body[100000:])
+        response = b''
+        while chunk := sock.recv(65536):
+            response += chunk
+    assert response.startswith(b'HTTP/1.1 200')
+    assert names(shared_dir) == ['growing.bin']
+    assert (shared_dir / 'growing.bin').stat().st_size == 200000
+
+def test_total_limit_rolls_back_parts_already_received(server, shared_dir, monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'max_upload_size', 50000)
+    response = post(server, multipart(('kept.bin', b'k' * 10000), ('too-much.bin', b't' * 100000)))
+    assert response.status_code == 413
+    assert names(shared_dir) == []
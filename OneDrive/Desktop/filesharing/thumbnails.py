@@ -0,0 +1,153 @@
+import os
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from utils import DiskLRU
+
+# Longest side of a thumbnail, in pixels
+thumbnail_size = 256
+
+# Images larger than this are not thumbnailed
+max_source_size = 64 * 1024 * 1024
+
+# Images with more pixels than this are refused as likely decompression bombs
+max_source_pixels = 100_000_000
+
+# Extensions Pillow can decode that are worth a thumbnail
+THUMBNAIL_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+
+def can_thumbnail(filename):
+    """Check whether a file looks like an image we can thumbnail"""
+    return os.path.splitext(filename)[1].lower() in THUMBNAIL_EXTENSIONS
+
+def render_thumbnail(source_path, target_path, size):
+    """Write a JPEG thumbnail of source_path to target_path (runs in a worker process)"""
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = max_source_pixels
+    with Image.open(source_path) as image:
+        # Let the JPEG decoder downscale while decoding, much cheaper than a full decode
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(target_path, 'JPEG', quality=80, optimize=True)
+
+class ThumbnailCache:
+    """Size-bounded on-disk cache of thumbnails rendered in a process pool
+
+    Thumbnails are keyed by the source file's identity (device, inode, size,
+    mtime) and the thumbnail size, so an edited image gets a new key. Decoding
+    and resizing happen in worker processes, so they neither hold the GIL nor
+    tie up threads serving downloads; at most max_pending renders are queued.
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, workers=2, max_pending=64):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._files = DiskLRU(cache_dir, max_bytes)
+        self._pending = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # Started on first use so importing the app does not start workers;
+        # spawned rather than forked because the server is multithreaded
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def get(self, file_path, st, timeout=None):
+        """Return the path of the thumbnail, rendering it on first use
+
+        Waits at most timeout seconds for a render. Raises TimeoutError when
+        the thumbnail is not ready yet (or too many renders are queued) and
+        ValueError when the image cannot be thumbnailed.
+        """
+        if st.st_size > max_source_size:
+            raise ValueError('Image too large to thumbnail')
+
+        identity = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}:{thumbnail_size}"
+        name = hashlib.sha1(identity.encode()).hexdigest() + '.jpg'
+
+        with self._lock:
+            # A thumbnail another worker evicted is rendered again
+            path = self._files.get(name)
+            if path is not None:
+                self.hits += 1
+                return path
+            done = self._pending.get(name)
+            if done is None:
+                if len(self._pending) >= self.max_pending:
+                    raise TimeoutError('Thumbnail queue is full')
+                done = threading.Event()
+                tmp_path = self._files.temp_path(name)
+                try:
+                    future = self._executor().submit(render_thumbnail, file_path, tmp_path, thumbnail_size)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed by the OOM killer); start a fresh pool next time
+                    self._pool = None
+                    raise ValueError('Thumbnail workers are unavailable')
+                future.add_done_callback(lambda f: self._finish(f, name, tmp_path, done))
+                self._pending[name] = done
+
+        # A render that is still running keeps going, and a retry finds it cached
+        if not done.wait(timeout):
+            raise TimeoutError('Thumbnail is still being rendered')
+        path = self._files.get(name)
+        if path is None:
+            raise ValueError('Image could not be thumbnailed')
+        return path
+
+    def discard(self, path):
+        """Unindex a thumbnail that turned out to be missing"""
+        self._files.discard(os.path.basename(path))
+
+    def _finish(self, future, name, tmp_path, done):
+        """Move a finished render into the cache and wake waiting requests"""
+        try:
+            future.result()
+            self._files.add(name, tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self.failures += 1
+                self._pending.pop(name, None)
+            done.set()
+            return
+        with self._lock:
+            self.misses += 1
+            self._pending.pop(name, None)
+        done.set()
+
+    def stats(self):
+        """Return cache size, hit/miss counters and queued renders"""
+        with self._lock:
+            return {
+                'entries': len(self._files),
+                'bytes': self._files.total_bytes,
+                'max_bytes': self._files.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'failures': self.failures,
+                'pending': len(self._pending),
+                'workers': self.workers
+            }
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
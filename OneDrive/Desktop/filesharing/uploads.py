@@ -0,0 +1,388 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+import contextlib
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NeedData
+from werkzeug.utils import secure_filename
+from utils import process_lock, partial_upload_path
+
+# Default and maximum chunk sizes for upload sessions
+default_chunk_size = 8 * 1024 * 1024
+max_chunk_size = 64 * 1024 * 1024
+
+# Sessions untouched for this long are discarded
+session_ttl = 24 * 60 * 60
+
+# Read size used when copying request bodies and hashing files
+io_buffer_size = 1024 * 1024
+
+# Read size for multipart bodies; the boundary search rescans each read, so
+# smaller reads than io_buffer_size are faster here
+multipart_read_size = 256 * 1024
+
+class UploadError(Exception):
+    """Raised when an upload request cannot be honoured"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+class UploadSessionStore:
+    """Chunked, resumable upload sessions staged on disk
+
+    Each session owns a preallocated .part file and a small JSON record of
+    which chunks have arrived. Chunks can be written in any order and in
+    parallel; the record survives server restarts so clients can resume.
+
+    With shared=True the store is used by several worker processes: records
+    are always read from disk and updated under a file lock, since chunks of
+    one session may arrive at different workers.
+    """
+
+    def __init__(self, staging_dir, shared=False):
+        self.staging_dir = staging_dir
+        self.shared = shared
+        self._sessions = {}
+        self._lock = threading.Lock()
+        os.makedirs(staging_dir, exist_ok=True)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.staging_dir, f"{upload_id}.json")
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.staging_dir, f"{upload_id}.part")
+
+    def _save(self, session):
+        tmp_path = self._meta_path(session['upload_id']) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(session, f)
+        os.replace(tmp_path, self._meta_path(session['upload_id']))
+
+    def _load(self, upload_id):
+        try:
+            uuid.UUID(upload_id)
+        except ValueError:
+            raise UploadError('Unknown upload session', 404)
+
+        session = None if self.shared else self._sessions.get(upload_id)
+        if session is None:
+            try:
+                with open(self._meta_path(upload_id)) as f:
+                    session = json.load(f)
+            except (OSError, ValueError):
+                raise UploadError('Unknown upload session', 404)
+            session['received'] = set(session['received'])
+            if not self.shared:
+                self._sessions[upload_id] = session
+        return session
+
+    def _record_lock(self, upload_id):
+        if not self.shared:
+            return contextlib.nullcontext()
+        return process_lock(self._meta_path(upload_id) + '.lock')
+
+    def _persist(self, session):
+        record = dict(session, received=sorted(session['received']))
+        self._save(record)
+
+    def create(self, filename, size, subpath='', chunk_size=None, sha256=None):
+        """Start a new upload session and return its status"""
+        if size < 0:
+            raise UploadError('Invalid file size')
+        chunk_size = chunk_size or default_chunk_size
+        if chunk_size <= 0 or chunk_size > max_chunk_size:
+            raise UploadError(f'Chunk size must be between 1 and {max_chunk_size} bytes')
+        if sha256 is not None and not isinstance(sha256, str):
+            raise UploadError('Invalid sha256')
+
+        self.cleanup_expired()
+        # The .part file is sparse, so check that the data will fit once it arrives
+        if size > shutil.disk_usage(self.staging_dir).free:
+            raise UploadError('Not enough free space to stage the upload', 507)
+
+        upload_id = str(uuid.uuid4())
+        session = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'subpath': subpath,
+            'size': size,
+            'chunk_size': chunk_size,
+            'total_chunks': max(1, -(-size // chunk_size)),
+            'sha256': sha256.lower() if sha256 else None,
+            'received': set(),
+            'updated_at': time.time()
+        }
+
+        try:
+            with open(self._part_path(upload_id), 'wb') as f:
+                f.truncate(size)
+        except (OSError, OverflowError) as e:
+            # E.g. larger than the file system allows
+            self.discard(upload_id)
+            raise UploadError(f'Cannot stage a {size} byte file: {e}', 507)
+
+        with self._lock:
+            self._sessions[upload_id] = session
+            self._persist(session)
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        """Return the session's metadata and which chunks are present"""
+        with self._lock:
+            session = self._load(upload_id)
+            received = sorted(session['received'])
+        return {
+            'upload_id': upload_id,
+            'filename': session['filename'],
+            'size': session['size'],
+            'chunk_size': session['chunk_size'],
+            'total_chunks': session['total_chunks'],
+            'received': received,
+            'offsets': [index * session['chunk_size'] for index in received],
+            'complete': len(received) == session['total_chunks']
+        }
+
+    def write_chunk(self, upload_id, index, stream, content_length, sha256=None):
+        """Write one numbered chunk from a request stream"""
+        with self._lock:
+            session = self._load(upload_id)
+
+        if index < 0 or index >= session['total_chunks']:
+            raise UploadError('Chunk index out of range')
+        offset = index * session['chunk_size']
+        expected = min(session['chunk_size'], session['size'] - offset)
+        if content_length is None:
+            if expected:
+                raise UploadError('Content-Length is required', 411)
+            # The one empty chunk of an empty file may come without a length
+            content_length = 0
+        if content_length != expected:
+            raise UploadError(f'Chunk {index} must be {expected} bytes')
+
+        digest = hashlib.sha256()
+        written = 0
+        with open(self._part_path(upload_id), 'r+b') as f:
+            f.seek(offset)
+            while written < expected:
+                data = stream.read(min(io_buffer_size, expected - written))
+                if not data:
+                    break
+                digest.update(data)
+                f.write(data)
+                written += len(data)
+
+        if written != expected:
+            raise UploadError(f'Chunk {index} was truncated')
+        if sha256 and digest.hexdigest() != sha256.lower():
+            raise UploadError(f'Checksum mismatch for chunk {index}', 422)
+
+        with self._lock, self._record_lock(upload_id):
+            if self.shared:
+                session = self._load(upload_id)
+            session['received'].add(index)
+            session['updated_at'] = time.time()
+            self._persist(session)
+            return len(session['received'])
+
+    def commit(self, upload_id, destination_for, sha256=None):
+        """Verify a complete session and move the file into the share
+
+        destination_for(session) returns the final path for the file. The
+        whole file is hashed once here and compared to the checksums given
+        at creation time and with the commit, if any; a client can then hash
+        the file while its chunks are being uploaded.
+        """
+        with self._lock:
+            session = self._load(upload_id)
+            missing = session['total_chunks'] - len(session['received'])
+        if missing:
+            raise UploadError(f'{missing} chunk(s) still missing', 409)
+        if sha256 is not None and not isinstance(sha256, str):
+            raise UploadError('Invalid sha256')
+
+        part_path = self._part_path(upload_id)
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for data in iter(lambda: f.read(io_buffer_size), b''):
+                digest.update(data)
+        expected = {checksum.lower() for checksum in (session['sha256'], sha256) if checksum}
+        sha256 = digest.hexdigest()
+        if expected - {sha256}:
+            raise UploadError('Checksum mismatch for assembled file', 422)
+
+        destination = destination_for(session)
+        try:
+            shutil.move(part_path, destination)
+        except OSError:
+            # Release the name reserved for us
+            if os.path.exists(destination) and os.path.getsize(destination) == 0:
+                os.remove(destination)
+            raise
+        self.discard(upload_id)
+        return {'path': destination, 'sha256': sha256, 'size': session['size']}
+
+    def discard(self, upload_id):
+        """Forget a session and delete its staged data"""
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+            for path in (self._meta_path(upload_id), self._part_path(upload_id),
+                         self._meta_path(upload_id) + '.lock'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def cleanup_expired(self):
+        """Remove sessions that have not been touched within session_ttl"""
+        cutoff = time.time() - session_ttl
+        for name in os.listdir(self.staging_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.staging_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    self.discard(name[:-len('.json')])
+            except OSError:
+                pass
+
+class MultipartUpload:
+    """Incremental multipart/form-data parser that writes file parts straight to disk
+
+    feed() takes the body in pieces of any size as it arrives, so the same
+    parser serves blocking WSGI streams and ASGI receive() messages.
+    """
+
+    def __init__(self, content_type, directory, allocate_path, max_file_size=None, max_total_size=None):
+        mimetype, options = parse_options_header(content_type or '')
+        boundary = options.get('boundary')
+        if mimetype != 'multipart/form-data' or not boundary:
+            raise UploadError('Expected a multipart/form-data body')
+
+        # Events are drained after every feed, so the decoder buffer stays around
+        # the size of one piece; non-file fields are discarded rather than accumulated
+        self.decoder = MultipartDecoder(boundary.encode())
+        self.directory = directory
+        self.allocate_path = allocate_path
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+        self.results = []
+        self.current = None
+        self.total = 0
+
+    def _finish(self, part, status='success', message='Uploaded successfully'):
+        part['file'].close()
+        if status == 'success':
+            # The file only appears under its real name once it is complete
+            part['path'] = self.allocate_path(self.directory, part['filename'])
+            os.replace(part['temp'], part['path'])
+        else:
+            os.remove(part['temp'])
+        result = {
+            'filename': os.path.basename(part['path']) if part['path'] else part['original'],
+            'status': status,
+            'message': message
+        }
+        if status == 'success':
+            result['size'] = part['size']
+            result['sha256'] = part['digest'].hexdigest()
+            result['path'] = part['path']
+        self.results.append(result)
+
+    def feed(self, data):
+        """Process the next piece of the body (b'' at its end); return True once it is complete"""
+        self.total += len(data)
+        if self.max_total_size is not None and self.total > self.max_total_size:
+            raise UploadError(f'Upload exceeds the {self.max_total_size} byte limit', 413)
+        try:
+            self.decoder.receive_data(data or None)
+            return self._process_events()
+        except ValueError:
+            # Raised by the decoder for a truncated or malformed body
+            raise UploadError('Malformed multipart body', 400)
+
+    def _process_events(self):
+        current = self.current
+        event = self.decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                filename = secure_filename(event.filename or '')
+                if event.name == 'file' and filename:
+                    temp = partial_upload_path(self.directory, filename)
+                    current = self.current = {
+                        'original': event.filename,
+                        'filename': filename,
+                        'path': None,
+                        'temp': temp,
+                        'file': open(temp, 'wb', buffering=io_buffer_size),
+                        'digest': hashlib.sha256(),
+                        'size': 0,
+                        'failed': False
+                    }
+                else:
+                    current = self.current = None
+            elif isinstance(event, Data) and current is not None:
+                if not current['failed']:
+                    current['size'] += len(event.data)
+                    if self.max_file_size is not None and current['size'] > self.max_file_size:
+                        current['failed'] = True
+                        self._finish(current, 'error', f'File exceeds the {self.max_file_size} byte limit')
+                    else:
+                        current['digest'].update(event.data)
+                        current['file'].write(event.data)
+                if not event.more_data:
+                    if not current['failed']:
+                        self._finish(current)
+                    current = self.current = None
+            event = self.decoder.next_event()
+        return isinstance(event, Epilogue)
+
+    def close(self):
+        """Return one result dict per file part, removing a part left half-written"""
+        # Never leave a half-written file in the share
+        if self.current is not None and not self.current['failed']:
+            self._finish(self.current, 'error', 'Upload interrupted')
+        self.current = None
+        return self.results
+
+    def abort(self):
+        """Remove every part of a rejected request, including the ones already complete"""
+        self.close()
+        for result in self.results:
+            if result['status'] == 'success':
+                try:
+                    os.remove(result['path'])
+                except OSError:
+                    pass
+        self.results = []
+
+def stream_multipart_upload(stream, content_type, directory, allocate_path,
+                            max_file_size=None, max_total_size=None):
+    """Parse a multipart body incrementally and write each file part straight to disk
+
+    Nothing is spooled to a temporary file: parts are decoded as the request
+    body is read and written through a large buffered writer to a hidden
+    name next to their destination, then renamed into place once complete,
+    while a SHA-256 is computed on the fly. A part that grows past
+    max_file_size is removed and reported as an error. A body that grows past
+    max_total_size or is malformed aborts the whole request with an
+    UploadError, and the parts it had already delivered are removed too.
+
+    allocate_path(directory, filename) returns the destination for a part.
+    Returns one result dict per file part, in the order they were sent.
+    """
+    upload = MultipartUpload(content_type, directory, allocate_path, max_file_size, max_total_size)
+    try:
+        while True:
+            data = stream.read(multipart_read_size)
+            if upload.feed(data) or not data:
+                break
+    except Exception:
+        upload.abort()
+        raise
+    return upload.close()
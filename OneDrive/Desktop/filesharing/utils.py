@@ -1,9 +1,23 @@
 import socket
 import os
+import time
+import uuid
+import threading
+import zlib
+import functools
 import qrcode
+from collections import OrderedDict
 from io import BytesIO
 import base64
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Files still being received are written under a hidden name with this suffix
+PARTIAL_UPLOAD_SUFFIX = '.uploading'
+
 def get_local_ip():
     """Get the local IP address of the machine"""
     try:
@@ -16,34 +30,76 @@ def get_local_ip():
     except Exception:
         return "127.0.0.1"
 
+@functools.lru_cache(maxsize=16)
+def qr_code_png(url):
+    """Render the QR code for a URL as PNG bytes, memoized per URL
+
+    Errors propagate rather than being returned, so a failure is not
+    memoized and the next call tries again.
+    """
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(url)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
 def generate_qr_code(url):
     """Generate QR code for the given URL"""
     try:
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Convert to base64 for embedding in HTML
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        return f"data:image/png;base64,{img_str}"
+        png = qr_code_png(url)
     except Exception as e:
         print(f"Error generating QR code: {e}")
         return None
+    # Convert to base64 for embedding in HTML
+    img_str = base64.b64encode(png).decode()
+    return f"data:image/png;base64,{img_str}"
+
+def try_process_lock(lock_path):
+    """Take an exclusive lock shared by all worker processes without waiting
+
+    Returns the open lock file, which holds the lock until it is closed, or
+    None if another process has it. Without fcntl (Windows) there is only
+    ever one server process, so the lock is always granted.
+    """
+    f = open(lock_path, 'a')
+    if fcntl is None:
+        return f
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+def process_lock(lock_path):
+    """Wait for an exclusive lock shared by all worker processes
+
+    Returns the open lock file; use it as a context manager to release it.
+    """
+    f = open(lock_path, 'a')
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    return f
+
+def format_size(size):
+    """Format a size in bytes as a human readable string"""
+    if size is None:
+        return "Unknown"
+    size = float(size)
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} TB"
 
 def get_file_size(file_path):
     """Get human readable file size"""
     try:
-        size = os.path.getsize(file_path)
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size < 1024.0:
-                return f"{size:.1f} {unit}"
-            size /= 1024.0
-        return f"{size:.1f} TB"
+        return format_size(os.path.getsize(file_path))
     except:
         return "Unknown"
 
@@ -56,28 +112,361 @@ def is_safe_path(basedir, path):
     except:
         return False
 
+class NameAllocator:
+    """Hands out unique file names in O(1) instead of probing name_1, name_2, ...
+
+    The next free suffix is remembered per (directory, name), so repeated
+    uploads of the same name cost one or two create attempts. Each name is
+    claimed by atomically creating an empty placeholder file, so concurrent
+    uploads can never be given the same path.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._next_suffix = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _claim(self, path):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+            return True
+        except FileExistsError:
+            return False
+
+    def allocate(self, directory, filename):
+        """Create and return a new empty file for filename in directory"""
+        file_path = os.path.join(directory, filename)
+        if self._claim(file_path):
+            return file_path
+
+        base, ext = os.path.splitext(filename)
+        key = (os.path.abspath(directory), filename)
+        with self._lock:
+            counter = self._next_suffix.pop(key, 1)
+            while not self._claim(os.path.join(directory, f"{base}_{counter}{ext}")):
+                counter += 1
+            self._next_suffix[key] = counter + 1
+            if len(self._next_suffix) > self.max_entries:
+                self._next_suffix.popitem(last=False)
+        return os.path.join(directory, f"{base}_{counter}{ext}")
+
+name_allocator = NameAllocator()
+
+def unique_file_path(directory, filename):
+    """Return a new path in directory for filename, adding _1, _2, ... if it is taken
+
+    The returned path exists as an empty placeholder that the caller overwrites.
+    """
+    return name_allocator.allocate(directory, filename)
+
+def partial_upload_path(directory, filename):
+    """Return a hidden path in directory that receives filename until it is complete"""
+    return os.path.join(directory, f".{filename}.{uuid.uuid4().hex[:12]}{PARTIAL_UPLOAD_SUFFIX}")
+
+def is_partial_upload(name):
+    """Tell whether a directory entry is an upload still in progress"""
+    return name.startswith('.') and name.endswith(PARTIAL_UPLOAD_SUFFIX)
+
+def iter_directory(directory_path):
+    """Yield one compact record per entry using a single os.scandir pass
+
+    Records carry the raw size in bytes and the mtime so callers can sort and
+    aggregate them; formatting happens at render time via format_size.
+    DirEntry caches its stat result, so each entry costs at most one stat.
+    """
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            if is_partial_upload(entry.name):
+                continue
+            try:
+                if entry.is_file():
+                    st = entry.stat()
+                    yield {
+                        'name': entry.name,
+                        'type': 'file',
+                        'size': st.st_size,
+                        'mtime': st.st_mtime
+                    }
+                elif entry.is_dir():
+                    yield {
+                        'name': entry.name,
+                        'type': 'directory',
+                        'size': None,
+                        'mtime': entry.stat().st_mtime
+                    }
+            except OSError:
+                # Entry vanished or is unreadable between listing and stat
+                continue
+
+def sort_key(item):
+    """Directories first, then case-insensitive name"""
+    return (item['type'] == 'file', item['name'].lower())
+
+SORT_KEYS = {
+    'name': lambda item: item['name'].lower(),
+    'size': lambda item: (item['size'] or 0, item['name'].lower()),
+    'mtime': lambda item: (item['mtime'], item['name'].lower())
+}
+
+def sort_items(items, sort='name', reverse=False):
+    """Sort listing records by name, size or mtime, keeping directories first"""
+    ordered = sorted(items, key=SORT_KEYS[sort], reverse=reverse)
+    # Stable partition so directories stay on top in either direction
+    return sorted(ordered, key=lambda item: item['type'] == 'file')
+
 def scan_directory(directory_path):
-    """Recursively scan directory and return file structure"""
+    """Scan a directory and return its entries, directories first"""
     items = []
     try:
-        for item in os.listdir(directory_path):
-            item_path = os.path.join(directory_path, item)
-            if os.path.isfile(item_path):
-                items.append({
-                    'name': item,
-                    'type': 'file',
-                    'size': get_file_size(item_path),
-                    'path': item_path
-                })
-            elif os.path.isdir(item_path):
-                items.append({
-                    'name': item,
-                    'type': 'directory',
-                    'path': item_path
-                })
+        items = list(iter_directory(directory_path))
     except PermissionError:
         pass
     except Exception as e:
         print(f"Error scanning directory: {e}")
-    
-    return sorted(items, key=lambda x: (x['type'] == 'file', x['name'].lower()))
+
+    return sorted(items, key=sort_key)
+
+def listing_etag(fingerprint, variant=''):
+    """Build a strong ETag for a directory listing from its fingerprint
+
+    variant distinguishes representations of the same listing, such as the
+    HTML page and differently sorted or paginated API responses.
+    """
+    inode, mtime_ns, digest = fingerprint
+    return f'"d-{inode:x}-{mtime_ns:x}-{digest:x}-{zlib.crc32(variant.encode()):x}"'
+
+def listing_fingerprint(stat, items):
+    """Combine a directory's (inode, mtime_ns) with the size and mtime of its entries"""
+    inode, mtime_ns = stat
+    newest = max([mtime_ns] + [int(item['mtime'] * 1e9) for item in items])
+    digest = zlib.crc32(''.join(f"{item['name']}/{item['size']}/{item['mtime']!r}\n"
+                                for item in items).encode('utf-8', 'surrogateescape'))
+    return (inode, newest, digest)
+
+class ListingCache:
+    """Bounded LRU cache of directory listings, invalidated by directory mtime
+
+    A directory's mtime and inode change whenever an entry is added, removed or
+    renamed, so one stat of the directory itself is enough to tell whether a
+    cached listing is still valid. Writes into an existing file do not touch
+    the directory, though, so a listing older than revalidate_after seconds is
+    scanned again and compared entry by entry; if nothing changed, it is kept
+    together with its sorted views.
+    """
+
+    def __init__(self, max_entries=256, revalidate_after=1.0):
+        self.max_entries = max_entries
+        self.revalidate_after = revalidate_after
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, directory_path):
+        st = os.stat(directory_path)
+        return (st.st_ino, st.st_mtime_ns)
+
+    def fingerprint(self, directory_path):
+        """Return the (inode, mtime_ns, digest) fingerprint of a directory's listing
+
+        mtime_ns is the newest mtime of the directory and its entries, and
+        digest covers every entry's name, size and mtime, so the fingerprint
+        changes when a file is written in place. Raises OSError if the
+        directory is gone.
+        """
+        key = os.path.abspath(directory_path)
+        try:
+            return self._load(key)['fingerprint']
+        except OSError:
+            self.invalidate(key)
+            raise
+
+    def get(self, directory_path):
+        """Return the listing for directory_path, rescanning only if it changed"""
+        return self._entry(directory_path)['items']
+
+    def get_view(self, directory_path, sort='name', reverse=False):
+        """Return (items, positions) for a sorted view of the listing
+
+        positions maps each entry name to its index in the view, which lets
+        cursor pagination resume after a given entry in O(1). Views are built
+        once per listing and dropped together with it.
+        """
+        entry = self._entry(directory_path)
+        view_key = (sort, reverse)
+        with self._lock:
+            view = entry['views'].get(view_key)
+        if view is None:
+            items = sort_items(entry['items'], sort, reverse)
+            positions = {item['name']: index for index, item in enumerate(items)}
+            view = (items, positions)
+            with self._lock:
+                entry['views'][view_key] = view
+        return view
+
+    def _entry(self, directory_path):
+        key = os.path.abspath(directory_path)
+        try:
+            return self._load(key)
+        except OSError:
+            self.invalidate(key)
+            return {'items': [], 'views': {}}
+
+    def _load(self, key):
+        stat = self._fingerprint(key)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if (cached is not None and cached['stat'] == stat and
+                    now - cached['checked_at'] < self.revalidate_after):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        items = scan_directory(key)
+        with self._lock:
+            if cached is not None and cached['stat'] == stat and cached['items'] == items:
+                # Nothing was written in place since the last scan
+                cached['checked_at'] = now
+                self.revalidations += 1
+                entry = cached
+            else:
+                self.misses += 1
+                entry = {
+                    'stat': stat,
+                    'fingerprint': listing_fingerprint(stat, items),
+                    'checked_at': now,
+                    'items': items,
+                    'views': {}
+                }
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, directory_path=None):
+        """Drop one cached directory, or everything when no path is given"""
+        with self._lock:
+            if directory_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(directory_path), None)
+
+    def stats(self):
+        """Return cache size and hit/miss counters"""
+        with self._lock:
+            # A revalidated listing is reused, so it counts as a hit here
+            total = self.hits + self.revalidations + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'hit_rate': ((self.hits + self.revalidations) / total) if total else 0.0
+            }
+
+class DiskLRU:
+    """Size-bounded index of the files in a cache directory, least recently used first
+
+    Files are written under a temp_path() and add()ed once complete; the
+    least recently used are deleted when the total passes max_bytes. With
+    keep_newest the file just added stays even if it alone is over the
+    limit. Each worker process keeps its own index of the shared directory,
+    so get() checks that a file is still on disk, and callers that find it
+    gone when opening it discard() it.
+    """
+
+    def __init__(self, cache_dir, max_bytes, keep_newest=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.keep_newest = keep_newest
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Index files left by a previous run, oldest access first"""
+        found = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                # Left by a write that never finished
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            found.append((st.st_atime, name, st.st_size))
+        with self._lock:
+            for _, name, size in sorted(found):
+                self._entries[name] = size
+                self.total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Delete the least recently used files until the total fits; call with the lock held"""
+        keep = 1 if self.keep_newest else 0
+        while self.total_bytes > self.max_bytes and len(self._entries) > keep:
+            name, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def temp_path(self, name):
+        """Return a path to write name to before add()ing it, unique to this thread"""
+        return os.path.join(self.cache_dir, f"{name}.{threading.get_ident()}.tmp")
+
+    def get(self, name):
+        """Return the path of a cached file and mark it used, or None if it is not cached
+
+        A file another worker has deleted is unindexed on the way.
+        """
+        path = self.path(name)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            if not os.path.exists(path):
+                self.total_bytes -= self._entries.pop(name)
+                return None
+            self._entries.move_to_end(name)
+            return path
+
+    def size(self, name):
+        """Return the indexed size of name, or None"""
+        with self._lock:
+            return self._entries.get(name)
+
+    def add(self, name, tmp_path):
+        """Move a complete file into the cache; return its path, or None if it was evicted straight away"""
+        path = self.path(name)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self.total_bytes += size - self._entries.get(name, 0)
+            self._entries[name] = size
+            self._entries.move_to_end(name)
+            self._evict()
+            return path if name in self._entries else None
+
+    def discard(self, name):
+        """Unindex name if its file turned out to be missing"""
+        with self._lock:
+            if name in self._entries and not os.path.exists(self.path(name)):
+                self.total_bytes -= self._entries.pop(name)
+
+    def __len__(self):
+        return len(self._entries)